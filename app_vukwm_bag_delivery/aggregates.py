@@ -1,6 +1,8 @@
 import numpy as np
 import pandas as pd
 
+import app_vukwm_bag_delivery.models.pipelines.process_input_data.aggregate_orders as aggregate_orders
+
 
 def date_to_string(df):
     df = df.assign(
@@ -138,35 +140,28 @@ def calc_product_summary(df):
     return route_product_summary
 
 
-def combine_product_name_quantity(df):
-    """We combine all orders assigned to a site into one row, with key info concatinated with `';'`."""
-    product_names = df["Product Name"].values
-    quantity = df["Quantity"].values
-    ticket_numbers = df["Ticket No"].values
-    boxes = df["Quantity"].sum()
-    descriptions = []
-    for i in range(product_names.shape[0]):
-        descriptions.append(f"{product_names[i]}: {quantity[i]}")
-    descriptions = "\n".join(descriptions)
-    df = df.iloc[:1]
-    df["Product description"] = descriptions
-    df["Ticket No"] = "; ".join(ticket_numbers)
-    df["Total boxes"] = boxes
-    df["Product Name"] = "; ".join(product_names)
-    df["Quantity"] = "; ".join(quantity.astype(str))
-    return df
-
-
 def combine_orders(df):
     orders = date_to_string(df)
     orders = get_area_num(orders)
     orders["Transport area"] = "# " + orders["tansport_area_num"].astype(str).str.pad(
         2, fillchar="0"
     )
-    orders_grouped = (
-        orders.groupby(["Site Bk"])
-        .apply(combine_product_name_quantity)
-        .reset_index(drop=True)
+    orders_grouped = aggregate_orders.combine_first_rows(
+        orders,
+        ["Site Bk"],
+        {
+            "Product description": (
+                aggregate_orders.product_descriptions(orders),
+                aggregate_orders.join_values("\n"),
+            ),
+            "Ticket No": ("Ticket No", aggregate_orders.join_values()),
+            "Total boxes": ("Quantity", "sum"),
+            "Product Name": ("Product Name", aggregate_orders.join_values()),
+            "Quantity": (
+                orders["Quantity"].astype(str),
+                aggregate_orders.join_values(),
+            ),
+        },
     )
     return orders_grouped
 
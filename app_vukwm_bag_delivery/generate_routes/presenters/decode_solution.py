@@ -1,9 +1,10 @@
 import streamlit as st
 
+import app_vukwm_bag_delivery.generate_routes.presenters.stage_cache as stage_cache
 import app_vukwm_bag_delivery.models.vroom_wrappers.decode_vroom_solution as decode
 
 
-def decode_solution():
+def generate_reporting_data():
     unassigned_routes = st.session_state.data_03_primary["unassigned_routes"]
     unassigned_stops = st.session_state.data_03_primary["unassigned_stops"]
     solution = st.session_state.data_06_model_output["vroom_solution"]
@@ -18,8 +19,19 @@ def decode_solution():
         st.secrets["osrm_port_mapping"],
     )
     assigned_stops = decoder.convert_solution()
-    st.session_state.data_07_reporting = {
+    return {
         "assigned_stops": assigned_stops,
         "unused_routes": decoder.unused_routes,
         "unserviced_stops": decoder.unserviced_stops,
     }
+
+
+def decode_solution():
+    inputs = [
+        stage_cache.stage_key("solve"),
+        st.session_state.data_03_primary["locations"],
+        dict(st.secrets["osrm_port_mapping"]),
+    ]
+    st.session_state.data_07_reporting = stage_cache.run_stage(
+        "decode_solution", inputs, generate_reporting_data
+    )
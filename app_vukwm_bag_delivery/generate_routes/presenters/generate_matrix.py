@@ -4,7 +4,18 @@ import numpy as np
 import pandas as pd
 import streamlit as st
 
-import app_vukwm_bag_delivery.models.osrm_wrappers.get_osrm_tables as get_osrm_tables
+import app_vukwm_bag_delivery.generate_routes.presenters.stage_cache as stage_cache
+import app_vukwm_bag_delivery.models.pipelines.convert_input_data.deduplicate_locations as deduplicate_locations
+import app_vukwm_bag_delivery.models.osrm_wrappers.osrm_matrix_cache as osrm_matrix_cache
+from app_vukwm_bag_delivery.models.vroom_wrappers import (
+    generate_vroom_object,
+    profile_matrix,
+)
+
+SHARED_MATRIX_ENTRIES = 16
+SHARED_MATRIX_TTL = 24 * 3600
+RESTRICT_PROFILE_MATRICES = True
+DEDUPLICATE_LOCATIONS = True
 
 
 def combine_route_stops(stops, routes):
@@ -26,14 +37,56 @@ def combine_route_stops(stops, routes):
     return matrix_points
 
 
-def extract_matrix(route_df, matrix_df):
+@st.cache_resource(max_entries=SHARED_MATRIX_ENTRIES, ttl=SHARED_MATRIX_TTL)
+def return_shared_matrix(coordinates, endpoint, profile):
+    """Matrix of the locations shared by all sessions. The arrays are read-only, so
+    that no session can change them for the others."""
+    logging.info(f"Generate {profile} matrix with {coordinates.shape[0]} points")
+    matrix = osrm_matrix_cache.get_time_dist_matrix(coordinates, endpoint, profile)
+    for values in matrix.values():
+        values.flags.writeable = False
+    return matrix
+
+
+def extract_matrix(route_df, matrix_df, stops_df=None):
+    """Matrix per profile over the locations in `matrix_df`, ordered by location index.
+
+    With `DEDUPLICATE_LOCATIONS`, co-located locations share one row and column of the
+    matrices. With `stops_df` and `RESTRICT_PROFILE_MATRICES`, each profile's matrix
+    only covers the depots and the stops that the profile's vehicles have the skills
+    for."""
     route_profile = route_df["profile"].unique()
+    n_locations = matrix_df.shape[0]
+    nodes = np.arange(n_locations)
+    if DEDUPLICATE_LOCATIONS:
+        nodes = deduplicate_locations.matrix_nodes(matrix_df)
+        logging.info(
+            f"Collapsed {n_locations} locations into {np.unique(nodes).shape[0]} "
+            "matrix nodes"
+        )
+    profile_locations = {}
+    if RESTRICT_PROFILE_MATRICES and stops_df is not None:
+        profile_locations = generate_vroom_object.profile_location_indices(
+            route_df, stops_df
+        )
     matrix = {}
     for profile in route_profile:
-        logging.info(f"Generate {profile} matrix with {matrix_df.shape[0]} points")
-        matrix[profile] = get_osrm_tables.get_time_dist_matrix(
-            matrix_df, st.secrets["osrm_port_mapping"][profile]
+        location_index = profile_locations.get(profile, np.arange(n_locations))
+        profile_nodes, location_rows = np.unique(
+            nodes[location_index], return_inverse=True
         )
+        coordinates = matrix_df.iloc[profile_nodes][
+            ["longitude", "latitude"]
+        ].reset_index(drop=True)
+        matrix[profile] = dict(
+            return_shared_matrix(
+                coordinates, st.secrets["osrm_port_mapping"][profile], profile
+            )
+        )
+        if profile_nodes.shape[0] < n_locations:
+            rows = np.full(n_locations, -1)
+            rows[location_index] = location_rows.ravel()
+            matrix[profile] = profile_matrix.map_locations(matrix[profile], rows)
     return matrix
 
 
@@ -42,5 +95,20 @@ def generate_matrix_inputs():
         "location_index"
     )
     unassigned_routes = st.session_state.data_03_primary["unassigned_routes"]
-    matrix = extract_matrix(unassigned_routes, locations)
+    profiles = sorted(unassigned_routes["profile"].unique())
+    unassigned_stops = st.session_state.data_03_primary["unassigned_stops"]
+    inputs = [
+        locations[["location_index", "longitude", "latitude"]],
+        {profile: st.secrets["osrm_port_mapping"][profile] for profile in profiles},
+        RESTRICT_PROFILE_MATRICES,
+        DEDUPLICATE_LOCATIONS,
+        deduplicate_locations.LOCATION_TOLERANCE_METERS,
+        unassigned_routes[["location_index", "profile", "skills"]],
+        unassigned_stops[["location_index", "skills"]],
+    ]
+    matrix = stage_cache.run_stage(
+        "generate_matrix_inputs",
+        inputs,
+        lambda: extract_matrix(unassigned_routes, locations, unassigned_stops),
+    )
     st.session_state.data_04_model_input = {"matrix": matrix}
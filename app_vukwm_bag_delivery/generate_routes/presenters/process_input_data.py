@@ -1,6 +1,7 @@
 import pandas as pd
 import streamlit as st
 
+import app_vukwm_bag_delivery.generate_routes.presenters.stage_cache as stage_cache
 import app_vukwm_bag_delivery.util_views.return_session_status as return_session_status
 from app_vukwm_bag_delivery.models.pipelines.convert_input_data import (
     convert_fleet,
@@ -40,20 +41,30 @@ def add_time_windows(df):
     return df
 
 
-def process_input_data():
-    unassigned_routes = convert_fleet.convert_fleet(
-        st.session_state.data_02_intermediate["unassigned_routes"]
-    )
-
+def return_remove_stops():
     if return_session_status.check_jobs_excluded_from_route():
         remove_stops = st.session_state.data_02_intermediate[
             "user_confirmed_removed_unassigned_stops"
         ]
     else:
         remove_stops = None
+    return remove_stops
+
+
+def return_updated_time_windows():
+    if return_session_status.check_time_windows_update():
+        return st.session_state.data_02_intermediate["save_updated_time_windows"]
+    return None
+
+
+def generate_primary_data():
+    unassigned_routes = convert_fleet.convert_fleet(
+        st.session_state.data_02_intermediate["unassigned_routes"]
+    )
 
     unassigned_stops = convert_jobs.unassigned_stops_convert(
-        st.session_state.data_02_intermediate["unassigned_jobs"], remove_stops
+        st.session_state.data_02_intermediate["unassigned_jobs"],
+        return_remove_stops(),
     )
     unassigned_stops = add_time_windows(unassigned_stops)
     unassigned_stops = convert_jobs.add_skills(unassigned_stops, unassigned_routes)
@@ -61,6 +72,21 @@ def process_input_data():
     locations, unassigned_stops, unassigned_routes = convert_jobs.create_locations(
         unassigned_stops, unassigned_routes
     )
-    st.session_state.data_03_primary = {"locations": locations}
-    st.session_state.data_03_primary["unassigned_stops"] = unassigned_stops
-    st.session_state.data_03_primary["unassigned_routes"] = unassigned_routes
+    return {
+        "locations": locations,
+        "unassigned_stops": unassigned_stops,
+        "unassigned_routes": unassigned_routes,
+    }
+
+
+def process_input_data():
+    inputs = [
+        st.session_state.data_02_intermediate["unassigned_routes"],
+        st.session_state.data_02_intermediate["unassigned_jobs"],
+        st.session_state.data_02_intermediate["unassigned_stops_tw"],
+        return_remove_stops(),
+        return_updated_time_windows(),
+    ]
+    st.session_state.data_03_primary = stage_cache.run_stage(
+        "process_input_data", inputs, generate_primary_data
+    )
@@ -1,8 +1,53 @@
 import streamlit as st
 
+import app_vukwm_bag_delivery.generate_routes.presenters.stage_cache as stage_cache
+from app_vukwm_bag_delivery.models.solver_backends import solver_backend
+from app_vukwm_bag_delivery.models.vroom_wrappers import multi_start
 
-def solve():
-    problem_instance = st.session_state.data_04_model_input["vroom_input"]
-    solution = problem_instance.solve(exploration_level=5, nb_threads=4)
+SOLVER_BACKEND = "vroom"  # "hgs" for single-depot vans, "decomposed" for large days
 
-    st.session_state.data_06_model_output = {"vroom_solution": solution}
+
+def show_progress(step_place_holder):
+    def progress(n_solved, n_candidates, best_solution):
+        if step_place_holder is not None and n_solved < n_candidates:
+            step_place_holder.markdown(
+                f":hourglass_flowing_sand: Routes generated: solved {n_solved} of "
+                f"{n_candidates} starts, best cost {best_solution.summary.cost}"
+            )
+
+    return progress
+
+
+def solve_with_backend(step_place_holder):
+    matrix = st.session_state.data_04_model_input["matrix"]
+    locations = st.session_state.data_03_primary["locations"]
+    unassigned_routes = st.session_state.data_03_primary["unassigned_routes"]
+    unassigned_stops = st.session_state.data_03_primary["unassigned_stops"]
+    if SOLVER_BACKEND == "vroom":
+        return multi_start.multi_start_solve(
+            unassigned_routes,
+            unassigned_stops,
+            matrix,
+            multi_start.select_candidates(),
+            show_progress(step_place_holder),
+        )
+    return solver_backend.solve(
+        SOLVER_BACKEND, locations, unassigned_stops, unassigned_routes, matrix
+    )
+
+
+def solve(step_place_holder=None):
+    solution, solve_statistics = stage_cache.run_stage(
+        "solve",
+        [
+            stage_cache.stage_key("generate_vroom_input"),
+            SOLVER_BACKEND,
+            multi_start.select_candidates(),
+        ],
+        lambda: solve_with_backend(step_place_holder),
+    )
+
+    st.session_state.data_06_model_output = {
+        "vroom_solution": solution,
+        "solve_statistics": solve_statistics,
+    }
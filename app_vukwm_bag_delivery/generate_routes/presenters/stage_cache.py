@@ -0,0 +1,91 @@
+"""
+Memoise the Generate Routes stages on a fingerprint of their inputs.
+
+The latest result of each stage is kept in the session with the fingerprint of its
+inputs. When a stage is rerun with the same fingerprint, the stored result is returned
+instead of recomputing it.
+"""
+import hashlib
+import logging
+import pickle
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+STAGE_CACHE_KEY = "generate_routes_stage_cache"
+
+
+def _update_hash(hasher, value):
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        hasher.update(repr(value.dtypes).encode())
+        try:
+            hashed = pd.util.hash_pandas_object(value, index=True).to_numpy()
+            hasher.update(hashed.tobytes())
+        except TypeError:  # unhashable cell values, such as lists
+            hasher.update(pickle.dumps(value))
+    elif isinstance(value, np.ndarray):
+        hasher.update(repr((value.dtype, value.shape)).encode())
+        hasher.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, dict):
+        for key in sorted(value, key=str):
+            _update_hash(hasher, key)
+            _update_hash(hasher, value[key])
+    elif isinstance(value, (list, tuple)):
+        hasher.update(f"{type(value).__name__}{len(value)}".encode())
+        for item in value:
+            _update_hash(hasher, item)
+    else:
+        hasher.update(repr(value).encode())
+
+
+def fingerprint(*values) -> str:
+    """Hash of data-frames, arrays, containers and scalars, for comparing stage inputs."""
+    hasher = hashlib.sha1()
+    for value in values:
+        _update_hash(hasher, value)
+    return hasher.hexdigest()
+
+
+def return_stage_cache() -> dict:
+    if STAGE_CACHE_KEY not in st.session_state:
+        st.session_state[STAGE_CACHE_KEY] = {}
+    return st.session_state[STAGE_CACHE_KEY]
+
+
+def stage_key(name: str):
+    """Fingerprint of the inputs of the latest run of the stage, used to chain stages."""
+    stage = return_stage_cache().get(name)
+    return None if stage is None else stage[0]
+
+
+def _detach(value):
+    """Copy of the result that can be changed without changing the stored result.
+    Data-frames are copied, and arrays, such as the matrices, are returned read-only
+    rather than copied, so that changing them in place fails instead."""
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return value.copy()
+    if isinstance(value, np.ndarray):
+        value = value.view()
+        value.flags.writeable = False
+        return value
+    if isinstance(value, dict):
+        return {key: _detach(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return type(value)(_detach(item) for item in value)
+    return value
+
+
+def run_stage(name: str, inputs, compute):
+    """Return the stored result of the stage if its inputs did not change, otherwise
+    compute and store it. The result is detached from the stored one, see `_detach`,
+    so that later pages changing it do not change the stored result."""
+    stage_cache = return_stage_cache()
+    key = fingerprint(inputs)
+    if name in stage_cache and stage_cache[name][0] == key:
+        logging.info(f"Stage `{name}` inputs unchanged, reusing previous result")
+        result = stage_cache[name][1]
+    else:
+        result = compute()
+        stage_cache[name] = (key, result)
+    return _detach(result)
@@ -0,0 +1,103 @@
+"""
+Persistent cache of Google geocode results, stored in SQLite and keyed on the normalised
+search address.
+"""
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List
+
+GEOCODE_CACHE_PATH = "data/02_intermediate/geocode_cache.sqlite"
+GEOCODE_CACHE_TTL_DAYS = 180
+GEOCODE_CACHE_NO_RESULT_TTL_DAYS = 7  # failed searches are retried sooner
+
+logger = logging.getLogger(__name__)
+
+
+def normalise_address(address: str) -> str:
+    """Case, whitespace and separator insensitive version of an address search string."""
+    address = re.sub(r"\s+", " ", str(address).lower())
+    address = re.sub(r"\s*,[\s,]*", ",", address)
+    return address.strip(" ,")
+
+
+class GeocodeCache:
+    """Geocode results per normalised address, expiring after `ttl_days`."""
+
+    def __init__(
+        self,
+        path: str = GEOCODE_CACHE_PATH,
+        ttl_days: float = GEOCODE_CACHE_TTL_DAYS,
+        no_result_ttl_days: float = GEOCODE_CACHE_NO_RESULT_TTL_DAYS,
+    ):
+        self.path = path
+        self.ttl = ttl_days * 24 * 3600
+        self.no_result_ttl = no_result_ttl_days * 24 * 3600
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connect() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS geocode_results ("
+                "address TEXT PRIMARY KEY, results TEXT NOT NULL, "
+                "n_results INTEGER NOT NULL, created_at REAL NOT NULL)"
+            )
+
+    @contextmanager
+    def _connect(self):
+        """Connection that commits on success and is always closed."""
+        connection = sqlite3.connect(self.path, timeout=30)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def evict_expired(self, now: float = None) -> int:
+        now = time.time() if now is None else now
+        with self._lock, self._connect() as connection:
+            n_evicted = connection.execute(
+                "DELETE FROM geocode_results WHERE created_at < ? "
+                "OR (n_results = 0 AND created_at < ?)",
+                (now - self.ttl, now - self.no_result_ttl),
+            ).rowcount
+        if n_evicted:
+            logger.info(f"Evicted {n_evicted} expired geocode results")
+        return n_evicted
+
+    def get_many(self, addresses: List[str]) -> Dict[str, list]:
+        """Return the cached results of the addresses found, keyed by the given address."""
+        keys = {}
+        for address in addresses:
+            keys.setdefault(normalise_address(address), []).append(address)
+        self.evict_expired()
+        found = {}
+        with self._lock, self._connect() as connection:
+            key_list = list(keys)
+            for start in range(0, len(key_list), 500):
+                chunk = key_list[start : start + 500]
+                rows = connection.execute(
+                    "SELECT address, results FROM geocode_results WHERE address IN "
+                    f"({','.join('?' * len(chunk))})",
+                    chunk,
+                )
+                for key, results in rows:
+                    for address in keys[key]:
+                        found[address] = json.loads(results)
+        return found
+
+    def set_many(self, results: Dict[str, list], now: float = None):
+        now = time.time() if now is None else now
+        rows = [
+            (normalise_address(address), json.dumps(result), len(result), now)
+            for address, result in results.items()
+        ]
+        with self._lock, self._connect() as connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO geocode_results VALUES (?, ?, ?, ?)", rows
+            )
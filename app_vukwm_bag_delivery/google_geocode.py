@@ -1,4 +1,8 @@
 import logging
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from typing import AnyStr, Dict, List
 import re
 import googlemaps
@@ -6,31 +10,124 @@ import numpy as np
 import pandas as pd
 import logging
 
+from app_vukwm_bag_delivery import geocode_cache
+
+GEOCODE_MAX_WORKERS = 8
+GEOCODE_QUERIES_PER_SECOND = 25
+GEOCODE_MAX_RETRIES = 3
+GEOCODE_BACKOFF_SECONDS = 1
 
 logger = logging.getLogger(__name__)
 
 
+class RateLimiter:
+    """Thread-safe limiter that spaces calls at least `1 / queries_per_second` apart."""
+
+    def __init__(self, queries_per_second: float):
+        self.interval = 1 / queries_per_second
+        self._lock = threading.Lock()
+        self._next_time = time.monotonic()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            wait_time = self._next_time - now
+            self._next_time = max(self._next_time, now) + self.interval
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+
+def geocode_with_retries(
+    gmaps: googlemaps.Client,
+    search_string: str,
+    rate_limiter: RateLimiter,
+    max_retries: int = GEOCODE_MAX_RETRIES,
+) -> list:
+    """Geocode a single search string, retrying transport errors with exponential backoff."""
+    for attempt in range(max_retries + 1):
+        rate_limiter.wait()
+        try:
+            return gmaps.geocode(search_string)
+        except (
+            googlemaps.exceptions.Timeout,
+            googlemaps.exceptions.TransportError,
+        ) as error:
+            if attempt == max_retries:
+                raise
+            backoff = GEOCODE_BACKOFF_SECONDS * 2**attempt
+            logger.warning(
+                f"Geocoding {search_string} failed with `{error}`, retry in {backoff}s"
+            )
+            time.sleep(backoff)
+
+
 def geocode_addresses_via_google_maps(
-    search_strings: List[str], api_key: str = None, city_string: str = ""
+    search_strings: List[str],
+    api_key: str = None,
+    city_string: str = "",
+    cache_path: str = geocode_cache.GEOCODE_CACHE_PATH,
+    max_workers: int = GEOCODE_MAX_WORKERS,
+    queries_per_second: float = GEOCODE_QUERIES_PER_SECOND,
 ) -> List[dict]:
     """Geocode addresses using google-maps API.
 
+    Results are cached on disk per normalised search string, only cache misses are sent
+    to the API, concurrently and rate limited.
+
     Args:
         search_strings: address info to be used for searching
         api_key: API key for geocoding
+        cache_path: SQLite geocode cache, no caching if None
+        max_workers: number of concurrent API requests
+        queries_per_second: maximum API request rate
 
     Returns:
         all_geocode_results: list with a dictionary of google search results, the form
             {`search_address`:..., `geocode_results`:...}
     """
-    gmaps = googlemaps.Client(key=api_key)
+    search_strings = list(dict.fromkeys(search_strings))
     n_search_strings = len(search_strings)
-    logger.info(f"Geocoding {n_search_strings} locations..")
+    queries = [search_address + city_string for search_address in search_strings]
+    cache = None if cache_path is None else geocode_cache.GeocodeCache(cache_path)
+    geocode_results = {} if cache is None else cache.get_many(queries)
+    missing_queries = list(
+        dict.fromkeys(query for query in queries if query not in geocode_results)
+    )
+    logger.info(
+        f"Geocoding {n_search_strings} locations, "
+        f"{n_search_strings - len(missing_queries)} found in cache.."
+    )
+    if missing_queries:
+        gmaps = googlemaps.Client(key=api_key, queries_per_second=queries_per_second)
+        rate_limiter = RateLimiter(queries_per_second)
+
+        def _geocode(query):
+            return geocode_with_retries(gmaps, query, rate_limiter)
+
+        new_results = {}
+        error = None
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(_geocode, query) for query in missing_queries]
+            for i, (query, future) in enumerate(zip(missing_queries, futures)):
+                try:
+                    new_results[query] = future.result()
+                except Exception as exception:
+                    logger.warning(f"Geocoding {query} failed: {exception}")
+                    error = error or exception
+                if (i + 1) % 25 == 0:
+                    logger.info(
+                        f"Geocoded {i + 1} of {len(missing_queries)} locations."
+                    )
+        # cache what was paid for, even when some queries failed
+        if cache is not None:
+            cache.set_many(new_results)
+        if error is not None:
+            raise error
+        geocode_results.update(new_results)
+
     all_geocode_results = []
-    for i, search_address in enumerate(search_strings):
-        if (i + 1) % 25 == 0:
-            logging.info(f"Geocoded {i + 1} of {n_search_strings} locations.")
-        geocode_result = gmaps.geocode(search_address + city_string)
+    for search_address, query in zip(search_strings, queries):
+        geocode_result = geocode_results[query]
         if not geocode_result:
             logger.warning(
                 f"Search string {search_address} hard failed on google-API side"
@@ -42,79 +139,85 @@ def geocode_addresses_via_google_maps(
     return all_geocode_results
 
 
-def expand_df(data: pd.DataFrame, expand_columns: list) -> pd.DataFrame:
-    """Expand data frame that has columns with values fof type dictionary"""
-    data = data.copy()
-    for c in expand_columns:
-        data = pd.concat(
-            [data.drop([c], axis="columns"), data[c].apply(pd.Series)],
-            axis="columns",
-        )
-    return data
-
-
-def google_map_results_to_dataframe(geocode_results: list) -> pd.DataFrame:
-    """Transform geocode results into data-frame.
-
-    Args:
-        geocode_results: json results from google-maps API
-    """
-    geo_data = pd.DataFrame(geocode_results)
+def _ordered_keys(dicts) -> list:
+    """Union of dictionary keys, in order of first appearance."""
+    keys = {}
+    for values in dicts:
+        keys.update(dict.fromkeys(values))
+    return list(keys)
 
-    # expand results and explode key columns
-    geo_data = geo_data.explode("geocode_results", ignore_index=True).reset_index(
-        drop=True
-    )
 
-    # flag single match and multiple match results
-    geo_data["match_type"] = "single_match"
-    geo_data.loc[
-        geo_data.duplicated(["search_address"], keep=False), "match_type"
-    ] = "multiple_matches"
-    geo_data = expand_df(geo_data, ["geocode_results", "geometry", "location"]).dropna(
-        how="all", axis=1
-    )
-    geo_data = geo_data.explode("types", ignore_index=True).reset_index(drop=True)
-    return geo_data
+def _first_component_names(address_components: list, components: list) -> dict:
+    """Long name of the first address component of each component type."""
+    names = {}
+    for address_component in address_components:
+        for value_type in address_component.get("types", []):
+            if value_type in components and value_type not in names:
+                names[value_type] = address_component["long_name"]
+    return names
 
 
-def extract_address_types(
-    geo_data: pd.DataFrame, components_of_interest: list
+def google_map_results_to_dataframe(
+    geocode_results: list, components_of_interest: list = ()
 ) -> pd.DataFrame:
-    """Extract address components of interest into wide table format.
+    """Transform geocode results into data-frame, in a single pass over the json.
+
+    Each geocode result becomes one row per entry in its `types`, with the `geometry`
+    and `location` dictionaries expanded into columns. The long name of the first
+    address component of each type in `components_of_interest` is added as a column.
 
     Args:
-        geo_data: json results from google-maps API
+        geocode_results: json results from google-maps API
         components_of_interest: components to search of and retrieve in address components dictionary.
     """
+    results = [
+        (record["search_address"], result)
+        for record in geocode_results
+        for result in record["geocode_results"]
+    ]
+    geometries = [result.get("geometry", {}) for _, result in results]
+    locations = [geometry.get("location", {}) for geometry in geometries]
+    result_columns = _ordered_keys(result for _, result in results)
+    geometry_columns = _ordered_keys(geometries)
+    columns = (
+        ["search_address", "match_type"]
+        + [column for column in result_columns if column != "geometry"]
+        + [column for column in geometry_columns if column != "location"]
+        + _ordered_keys(locations)
+    )
+    components_of_interest = list(components_of_interest)
 
-    def wide_apply_address_types(data, value_type):
-        data["__temp_id"] = data.reset_index(drop=True).index
-        data_non_nan = data.dropna(subset=["address_components"]).copy()
-        value_type_extract = (
-            data_non_nan["address_components"]
-            .dropna()
-            .apply(
-                lambda x: [y for y in x if "types" in y and value_type in y["types"]]
-            )
-        )
-        value_type_extract = value_type_extract.apply(
-            lambda x: x[0]["long_name"] if len(x) > 0 else np.nan
+    # flag single match and multiple match results
+    n_matches = Counter(search_address for search_address, _ in results)
+    row_types = [result.get("types") or [np.nan] for _, result in results]
+    n_rows = sum(len(types) for types in row_types)
+    data = {column: [np.nan] * n_rows for column in columns + components_of_interest}
+    row = 0
+    for (search_address, result), geometry, location, types in zip(
+        results, geometries, locations, row_types
+    ):
+        values = {**result, **geometry, **location}
+        values.pop("geometry", None)
+        values.pop("location", None)
+        values["search_address"] = search_address
+        values["match_type"] = (
+            "multiple_matches" if n_matches[search_address] > 1 else "single_match"
         )
-        data_non_nan[value_type] = value_type_extract
-        data_non_nan = data_non_nan[["__temp_id", value_type]]
-        data = data.merge(
-            data_non_nan,
-            how="left",
-            left_on="__temp_id",
-            right_on="__temp_id",
-            validate="1:1",
+        values.update(
+            _first_component_names(
+                result.get("address_components", []), components_of_interest
+            )
         )
-        data = data.drop(columns="__temp_id")
-        return data
-
+        for value_type in types:
+            values["types"] = value_type
+            for column, value in values.items():
+                data[column][row] = value
+            row += 1
+
+    geo_data = pd.DataFrame({column: data[column] for column in columns})
+    geo_data = geo_data.dropna(how="all", axis=1)
     for component in components_of_interest:
-        geo_data = wide_apply_address_types(geo_data, component)
+        geo_data[component] = data[component]
     return geo_data
 
 
@@ -198,8 +301,7 @@ def transform_geocode_results(
     main_location_types = ["ROOFTOP", "GEOMETRIC_CENTER"]
     column_order_sequence = ["location_type_category", "types_category"]
 
-    data = google_map_results_to_dataframe(search_results)
-    data = extract_address_types(data, components_of_interest)
+    data = google_map_results_to_dataframe(search_results, components_of_interest)
     data = add_main_types_category(data, main_types, main_location_types)
     data = drop_duplicates_add_match_type(data, column_order_sequence)
     return data
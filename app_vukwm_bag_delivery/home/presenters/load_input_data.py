@@ -79,9 +79,11 @@ def confirm_select(selected):
 def load_jobs_file():
     path = st.secrets["s3_input_paths"]["raw_user_input"]
     jobs_file = return_all_jobs()
-    jobs_file_display = jobs_file.assign(
-        filename=jobs_file["filename"].str.replace(path, "", regex=False)
-    ).sort_values(["last_modified"], ascending=False)
+    jobs_file_display = (
+        jobs_file.drop(columns=["etag"], errors="ignore")
+        .assign(filename=jobs_file["filename"].str.replace(path, "", regex=False))
+        .sort_values(["last_modified"], ascending=False)
+    )
     jobs_file_display = jobs_file_display.assign(Selected=False)[
         ["Selected"] + jobs_file_display.columns.tolist()
     ]
@@ -2,13 +2,19 @@
 Retrieve and return OSRM table info. See https://project-osrm.org/docs/v5.24.0/api/#table-service
 """
 
-from typing import Dict, Union
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Sequence, Union
 
 import numpy as np
 import pandas as pd
 import requests
 
+import app_vukwm_bag_delivery.models.osrm_wrappers.osrm_session as osrm_session
+
 PORT_TYPE_MAPPING_DEFAULT_STOP_LIMIT = 1000
+TABLE_BLOCK_SIZE = 100  # OSRM's default --max-table-size
+TABLE_MAX_WORKERS = 8
 
 
 def get_time_dist_matrix(
@@ -18,6 +24,9 @@ def get_time_dist_matrix(
     lat_col: str = "latitude",
     timeout: float = 120,
     slow_down: float = 1,
+    sources: Union[Sequence[int], None] = None,
+    destinations: Union[Sequence[int], None] = None,
+    session: Union[requests.Session, None] = None,
 ) -> Dict[str, np.ndarray]:
     """
     Calculate the time (seconds) and distance (meters) of the shortest-time path between all stops.
@@ -28,6 +37,9 @@ def get_time_dist_matrix(
     lat: column name of longitude coordinate
     timeout: time before time-out error occurs for API
     slow_down: factor by which to slow-down travel speed and increase duration.
+    sources: row indices of `data` to use as sources, all rows if None.
+    destinations: row indices of `data` to use as destinations, all rows if None.
+    session: keep-alive session to send the request with, a closing one is used if None.
     Return:
     time_matrix: short-time path time (seconds) between stops i and j.
     distance_matrix: short-time path distance (meters) between stops i and j.
@@ -42,23 +54,33 @@ def get_time_dist_matrix(
         ).tolist()
         coordinates = ";".join(coordinates)
         url = f"{endpoint}{coordinates}?annotations=distance,duration"
+        if sources is not None:
+            url += "&sources=" + ";".join(str(i) for i in sources)
+        if destinations is not None:
+            url += "&destinations=" + ";".join(str(i) for i in destinations)
         return url
 
     def _send_get_request(url: str) -> dict:
-        with requests.Session() as session:
-            response_content = session.get(
-                url, timeout=timeout, headers={"Connection": "close"}
-            ).json()
+        if session is not None:
+            response_content = session.get(url, timeout=timeout).json()
+        else:
+            with requests.Session() as new_session:
+                response_content = new_session.get(
+                    url, timeout=timeout, headers={"Connection": "close"}
+                ).json()
+        if response_content.get("code") != "Ok":
+            message = response_content.get("message")
+            raise ValueError(f"OSRM table request failed: `{message}`")
         return response_content
 
     def _get_time_matrix(
         api_response: dict, slow_down: Union[float, int]
     ) -> np.ndarray:
-        time_matrix = np.array(api_response["durations"]) * slow_down
+        time_matrix = np.array(api_response["durations"], dtype=float) * slow_down
         return time_matrix
 
     def _get_distance_matrix(api_response) -> np.ndarray:
-        distance_matrix = np.array(api_response["distances"])
+        distance_matrix = np.array(api_response["distances"], dtype=float)
         return distance_matrix
 
     table_end_point = f"{endpoint}/table/v1/driving/"
@@ -68,3 +90,87 @@ def get_time_dist_matrix(
     distance_matrix = _get_distance_matrix(api_response)
 
     return {"time_matrix": time_matrix, "distance_matrix": distance_matrix}
+
+
+def split_blocks(indices: np.ndarray, block_size: int) -> list:
+    """Split indices into consecutive blocks of at most `block_size`."""
+    return [
+        indices[start : start + block_size]
+        for start in range(0, indices.shape[0], block_size)
+    ]
+
+
+def get_time_dist_matrix_tiled(
+    data: pd.DataFrame,
+    endpoint: str = None,
+    lon_col: str = "longitude",
+    lat_col: str = "latitude",
+    timeout: float = 120,
+    slow_down: float = 1,
+    sources: Union[Sequence[int], None] = None,
+    destinations: Union[Sequence[int], None] = None,
+    block_size: int = TABLE_BLOCK_SIZE,
+    max_workers: int = TABLE_MAX_WORKERS,
+) -> Dict[str, np.ndarray]:
+    """
+    Tiled version of `get_time_dist_matrix` for large location sets.
+
+    The sources and destinations are split into blocks of at most `block_size`. Each
+    source-destination block is requested separately, with only the block's coordinates
+    in the URL, concurrently over a pooled keep-alive session. Blocks are written into
+    preallocated float32 matrices.
+    Args:
+    block_size: maximum number of sources and destinations per request
+    max_workers: number of concurrent requests
+    Return:
+    time_matrix: short-time path time (seconds) between stops i and j.
+    distance_matrix: short-time path distance (meters) between stops i and j.
+    """
+    n_locations = data.shape[0]
+    sources = np.arange(n_locations) if sources is None else np.asarray(sources)
+    destinations = (
+        np.arange(n_locations) if destinations is None else np.asarray(destinations)
+    )
+    coordinates = data[[lon_col, lat_col]].reset_index(drop=True)
+    time_matrix = np.empty((sources.shape[0], destinations.shape[0]), dtype=np.float32)
+    distance_matrix = np.empty_like(time_matrix)
+
+    source_blocks = split_blocks(np.arange(sources.shape[0]), block_size)
+    destination_blocks = split_blocks(np.arange(destinations.shape[0]), block_size)
+    tiles = [
+        (rows, columns) for rows in source_blocks for columns in destination_blocks
+    ]
+    session = osrm_session.get_session(pool_size=max(max_workers, 1))
+
+    def _get_tile(tile):
+        rows, columns = tile
+        tile_locations, tile_index = np.unique(
+            np.concatenate([sources[rows], destinations[columns]]), return_inverse=True
+        )
+        tile_matrix = get_time_dist_matrix(
+            coordinates.iloc[tile_locations],
+            endpoint,
+            lon_col=lon_col,
+            lat_col=lat_col,
+            timeout=timeout,
+            slow_down=slow_down,
+            sources=tile_index[: rows.shape[0]],
+            destinations=tile_index[rows.shape[0] :],
+            session=session,
+        )
+        time_matrix[rows[0] : rows[-1] + 1, columns[0] : columns[-1] + 1] = tile_matrix[
+            "time_matrix"
+        ]
+        distance_matrix[
+            rows[0] : rows[-1] + 1, columns[0] : columns[-1] + 1
+        ] = tile_matrix["distance_matrix"]
+
+    logging.info(
+        "Requesting %i x %i OSRM table in %i tiles",
+        sources.shape[0],
+        destinations.shape[0],
+        len(tiles),
+    )
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(_get_tile, tiles))
+    return {"time_matrix": time_matrix, "distance_matrix": distance_matrix}
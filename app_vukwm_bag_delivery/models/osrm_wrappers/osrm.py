@@ -4,13 +4,70 @@ Wrapper for converting OSRM json results into pandas data-frames.
 import json
 import logging
 from copy import deepcopy
-from typing import Dict, List
+from typing import Dict, List, Tuple
 
 import geopandas as gpd
+import numpy as np
 import pandas as pd
 from shapely.geometry import LineString
 
 EPSG = "EPSG:4326"
+POLYLINE_PRECISION = 6
+
+
+def decode_polyline(polyline: str, precision: int = POLYLINE_PRECISION) -> np.ndarray:
+    """Decode an encoded polyline into an array of lon-lat coordinates.
+
+    All varints are decoded at once with NumPy: every character carries 5 bits, and
+    characters without the continuation bit (0x20) end a value. Values are zig-zag
+    encoded lat-lon deltas.
+    """
+    chunks = np.frombuffer(polyline.encode(), dtype=np.uint8).astype(np.int64) - 63
+    value_end = (chunks & 0x20) == 0
+    value_id = np.concatenate([[0], np.cumsum(value_end)[:-1]])
+    value_start = np.concatenate([[0], np.flatnonzero(value_end)[:-1] + 1])
+    shift = 5 * (np.arange(chunks.shape[0]) - value_start[value_id])
+    values = np.bincount(
+        value_id, weights=(chunks & 0x1F) << shift, minlength=value_start.shape[0]
+    ).astype(np.int64)
+    deltas = np.where(values & 1, ~(values >> 1), values >> 1)
+    lat_lon = np.cumsum(deltas.reshape(-1, 2), axis=0) / 10**precision
+    return lat_lon[:, ::-1]
+
+
+def encode_polyline(coordinates, precision: int = POLYLINE_PRECISION) -> str:
+    """Encode lon-lat coordinates as a polyline, the inverse of `decode_polyline`."""
+    lat_lon = np.round(np.asarray(coordinates, dtype=float)[:, ::-1] * 10**precision)
+    deltas = np.diff(lat_lon.astype(np.int64), axis=0, prepend=0).ravel()
+    values = np.where(deltas < 0, ~(deltas << 1), deltas << 1)
+    remaining = values[:, None] >> (5 * np.arange(7))
+    present = remaining > 0
+    present[:, 0] = True
+    chunks = (remaining & 0x1F) | np.where(remaining >= 0x20, 0x20, 0)
+    return (chunks[present] + 63).astype(np.uint8).tobytes().decode()
+
+
+def split_overview_legs(route_path_info: dict) -> List[np.ndarray]:
+    """Lon-lat coordinates of each leg of a route with a polyline full overview.
+
+    Each leg has one distance annotation per segment of the overview, and consecutive
+    legs share their end and start coordinate.
+    """
+    coordinates = decode_polyline(route_path_info["geometry"])
+    n_segments = np.array(
+        [len(leg["annotation"]["distance"]) for leg in route_path_info["legs"]]
+    )
+    if n_segments.sum() + 1 != coordinates.shape[0]:
+        raise ValueError(
+            "OSRM leg annotations do not match the overview geometry, "
+            "request the route with `overview=full` and `annotations=distance`."
+        )
+    leg_end = np.cumsum(n_segments)
+    leg_start = leg_end - n_segments
+    return [
+        coordinates[[start, end]] if start == end else coordinates[start : end + 1]
+        for start, end in zip(leg_start, leg_end)
+    ]
 
 
 class OsrmRoutePathNormalizer:
@@ -85,6 +142,8 @@ class OsrmRoutePathNormalizer:
 
     def extract_travel_leg_geometry(self) -> gpd.GeoSeries:
         """Extract the geometry path in WKT between all stops."""
+        if isinstance(self._route_path_info["geometry"], str):
+            return self.extract_travel_leg_geometry_from_overview()
         legs = deepcopy(self._leg_info)
         for i, leg in enumerate(legs):
             leg["__id"] = i
@@ -97,6 +156,15 @@ class OsrmRoutePathNormalizer:
         geometry = leg_steps["geometry"].apply(LineString)
         return geometry
 
+    def extract_travel_leg_geometry_from_overview(self) -> gpd.GeoSeries:
+        """Split the encoded full overview geometry into legs, for lean requests without
+        steps."""
+        geometry = [
+            LineString(coordinates)
+            for coordinates in split_overview_legs(self._route_path_info)
+        ]
+        return gpd.GeoSeries(geometry)
+
     def extract_travel_leg_duration_distance(self) -> pd.DataFrame:
         """Extract the travel distance (km) and duration (seconds) between all stops"""
         legs_info_df = pd.DataFrame(self._leg_info)[["duration", "distance"]]
@@ -109,6 +177,7 @@ class OsrmRoutePathNormalizer:
     def extract_travel_leg_info(self) -> gpd.GeoDataFrame:
         """Extract travel metrix and path info."""
         self._check_route_path_type()
+        self._set_route_info()
         self._set_route_legs()
         leg_kpis = self.extract_travel_leg_duration_distance()
         leg_paths = self.extract_travel_leg_geometry()
@@ -123,7 +192,10 @@ class OsrmRoutePathNormalizer:
         route_path_info = self._route_path_info
         total_distance_km = route_path_info["distance"] / 1000
         total_duration_hours = route_path_info["duration"] / 3600
-        route_path = route_path_info["geometry"]["coordinates"]
+        if isinstance(route_path_info["geometry"], str):
+            route_path = decode_polyline(route_path_info["geometry"])
+        else:
+            route_path = route_path_info["geometry"]["coordinates"]
         geometry = LineString(route_path)
         route_summary = pd.DataFrame(
             [
@@ -138,3 +210,49 @@ class OsrmRoutePathNormalizer:
             route_summary, geometry=route_summary["geometry"], crs=EPSG
         )
         return route_summary
+
+
+def legs_to_trip_info(
+    legs: List[dict], snaps: List[dict]
+) -> Tuple[gpd.GeoDataFrame, pd.DataFrame, gpd.GeoDataFrame]:
+    """Assemble the travel leg, road snap and route summary info of a route from its
+    legs and road snaps, in the format of `OsrmRoutePathNormalizer`.
+
+    Args:
+        legs: `duration`, `distance` and polyline `geometry` of each leg
+        snaps: road snap `distance` and `location` of each stop
+    """
+    leg_paths = [decode_polyline(leg["geometry"]) for leg in legs]
+    leg_info = gpd.GeoDataFrame(
+        {
+            "duration_seconds": [leg["duration"] for leg in legs],
+            "distance_km": [leg["distance"] / 1000 for leg in legs],
+        },
+        geometry=[LineString(path) for path in leg_paths],
+        crs=EPSG,
+    )
+    leg_info["travel_sequence"] = range(leg_info.shape[0])
+
+    snap_locations = np.array([snap["location"] for snap in snaps]).reshape(-1, 2)
+    waypoint_info = pd.DataFrame(
+        {
+            "road_snap_distance_m": [snap["distance"] for snap in snaps],
+            "road_snap_longitude": snap_locations[:, 0],
+            "road_snap_latitude": snap_locations[:, 1],
+            "original_index": range(len(snaps)),
+            "route_sequence": range(len(snaps)),
+        }
+    )
+
+    route_path = np.concatenate(leg_paths[:1] + [path[1:] for path in leg_paths[1:]])
+    route_summary = gpd.GeoDataFrame(
+        {
+            "total_distance_km": [sum(leg["distance"] for leg in legs) / 1000],
+            "total_travel_duration_hours": [
+                sum(leg["duration"] for leg in legs) / 3600
+            ],
+        },
+        geometry=[LineString(route_path)],
+        crs=EPSG,
+    )
+    return leg_info, waypoint_info, route_summary
@@ -4,13 +4,18 @@ Get and format OSRM route info. See https://project-osrm.org/docs/v5.24.0/api/#r
 
 
 import logging
-from typing import Callable, Dict, Tuple, Union
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Callable, Dict, List, Tuple, Union
 
 import geopandas as gpd
+import numpy as np
 import pandas as pd
 import requests
 
 import app_vukwm_bag_delivery.models.osrm_wrappers.osrm as osrm
+import app_vukwm_bag_delivery.models.osrm_wrappers.osrm_leg_cache as osrm_leg_cache
+import app_vukwm_bag_delivery.models.osrm_wrappers.osrm_session as osrm_session
 
 OSRM_DRIVING_DEFAULTS = {
     "steps": "true",
@@ -19,6 +24,16 @@ OSRM_DRIVING_DEFAULTS = {
     "geometries": "geojson",
     "continue_straight": "false",
 }
+# Compact leg geometry: the encoded full overview is split into legs with the per-leg
+# distance annotations, instead of concatenating the GeoJSON geometry of every step.
+OSRM_LEAN_DEFAULTS = {
+    "steps": "false",
+    "annotations": "distance",
+    "overview": "full",
+    "geometries": "polyline6",
+    "continue_straight": "false",
+}
+LEAN_GEOMETRY = True
 BOUNDING_BOX = {
     "min_lon": -0.2432798003,
     "min_lat": 51.4463733546,
@@ -26,6 +41,9 @@ BOUNDING_BOX = {
     "max_lat": 51.5727989572,
 }
 TIMEOUT_LIMIT = 300  # seconds
+ROUTE_MAX_WORKERS = 8
+ROUTE_MAX_WAYPOINTS = 100  # below OSRM's default --max-viaroute-size
+USE_LEG_CACHE = True
 
 
 def generate_osrm_defaults(osrm_driving_defaults: Union[Dict, None] = None) -> str:
@@ -46,12 +64,18 @@ def generate_osrm_point_inputs(
 
 
 def get_osrm_request(
-    port: str, coordinates: str, defaults: Callable, timeout: float = 30
+    port: str,
+    coordinates: str,
+    defaults: Callable,
+    timeout: float = 30,
+    session: Union[requests.Session, None] = None,
 ) -> Union[Dict, str]:
     """Get OSRM response"""
     request = f"{port}/route/v1/driving/{coordinates}?{defaults()}"
     logging.debug("OSRM request: `%s`" % request)
-    with requests.get(request, timeout=timeout) as req:
+    if session is None:
+        session = requests
+    with session.get(request, timeout=timeout) as req:
         results = req.json()
 
     if results["code"] != "Ok":
@@ -61,16 +85,34 @@ def get_osrm_request(
     return results
 
 
-def generate_osrm_route(
-    route_stops: pd.DataFrame, vehicle_type: Union[str, None], port_mapping
-) -> Union[Dict, str]:
-    """Solve route using OSRM solver, based on route type."""
+def select_port(port_mapping, vehicle_type: Union[str, None], request_number: int = 0):
+    """Return the port for the vehicle type. A profile can map to a single port or to
+    a pool of ports, in which case requests are spread over the pool round-robin."""
     if vehicle_type is None:
-        port = port_mapping["default"]
+        ports = port_mapping["default"]
     else:
-        port = port_mapping[vehicle_type]
+        ports = port_mapping[vehicle_type]
+    if isinstance(ports, str):
+        return ports
+    return ports[request_number % len(ports)]
+
+
+def generate_osrm_route(
+    route_stops: pd.DataFrame,
+    vehicle_type: Union[str, None],
+    port_mapping,
+    session: Union[requests.Session, None] = None,
+    request_number: int = 0,
+    lean: bool = False,
+) -> Union[Dict, str]:
+    """Solve route using OSRM solver, based on route type. Lean requests skip steps and
+    return compact polyline6 geometry."""
+    port = select_port(port_mapping, vehicle_type, request_number)
     coordinates = generate_osrm_point_inputs(route_stops)
-    results = get_osrm_request(port, coordinates, generate_osrm_defaults)
+    defaults = OSRM_LEAN_DEFAULTS if lean else OSRM_DRIVING_DEFAULTS
+    results = get_osrm_request(
+        port, coordinates, partial(generate_osrm_defaults, defaults), session=session
+    )
     return results
 
 
@@ -87,12 +129,158 @@ def generate_trip_info(
     return leg_info, stop_sequence_info, route_summary_info
 
 
+def find_missing_runs(legs: list, snaps: list) -> List[Tuple[int, int]]:
+    """Start and end (inclusive) stop positions of consecutive stops that have a leg or
+    road snap missing from the cache."""
+    needed = np.array([snap is None for snap in snaps])
+    missing_legs = np.flatnonzero([leg is None for leg in legs])
+    needed[missing_legs] = True
+    needed[missing_legs + 1] = True
+    run_edges = np.diff(np.concatenate([[0], needed.astype(int), [0]]))
+    return list(
+        zip(np.flatnonzero(run_edges == 1), np.flatnonzero(run_edges == -1) - 1)
+    )
+
+
+def fetch_legs(
+    runs: list,
+    vehicle_type: str,
+    port_mapping,
+    session: requests.Session,
+    max_workers: int = ROUTE_MAX_WORKERS,
+    max_waypoints: int = ROUTE_MAX_WAYPOINTS,
+) -> list:
+    """Legs between consecutive coordinates and road snaps of all coordinates, of each
+    run of coordinates.
+
+    Runs are requested in lean mode, in overlapping chunks of at most `max_waypoints`,
+    with the chunks of all runs requested concurrently. A chunk never spans two runs,
+    so there are no legs between the end of a run and the start of the next.
+
+    Returns:
+        the legs and snaps of each run
+    """
+    runs = [np.repeat(run, 2, axis=0) if run.shape[0] == 1 else run for run in runs]
+    chunk_starts = [
+        (run_number, start)
+        for run_number, run in enumerate(runs)
+        for start in range(0, run.shape[0] - 1, max_waypoints - 1)
+    ]
+
+    def _fetch_chunk(request_number):
+        run_number, start = chunk_starts[request_number]
+        chunk = pd.DataFrame(
+            runs[run_number][start : start + max_waypoints],
+            columns=["longitude", "latitude"],
+        )
+        results = generate_osrm_route(
+            chunk, vehicle_type, port_mapping, session, request_number, lean=True
+        )
+        route = results["routes"][0]
+        legs = [
+            {
+                "duration": leg["duration"],
+                "distance": leg["distance"],
+                "geometry": osrm.encode_polyline(path),
+            }
+            for leg, path in zip(route["legs"], osrm.split_overview_legs(route))
+        ]
+        snaps = [
+            {"distance": waypoint["distance"], "location": waypoint["location"]}
+            for waypoint in results["waypoints"]
+        ]
+        return legs, snaps
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        chunk_results = list(executor.map(_fetch_chunk, range(len(chunk_starts))))
+    run_results = [([], []) for _ in runs]
+    last_snaps = [None] * len(runs)
+    for (run_number, _), (chunk_legs, chunk_snaps) in zip(chunk_starts, chunk_results):
+        legs, snaps = run_results[run_number]
+        legs += chunk_legs
+        snaps += chunk_snaps[:-1]  # the last stop starts the next chunk
+        last_snaps[run_number] = chunk_snaps[-1]
+    for (_, snaps), last_snap in zip(run_results, last_snaps):
+        snaps.append(last_snap)
+    return run_results
+
+
+def generate_cached_trip_info(
+    route_requests: list,
+    port_mapping,
+    session: requests.Session,
+    max_workers: int = ROUTE_MAX_WORKERS,
+    leg_cache: Union[osrm_leg_cache.OsrmLegCache, None] = None,
+) -> list:
+    """Trip info of each route assembled from cached legs. Missing legs and road snaps
+    are requested per run of consecutive stops, the runs of a vehicle type together."""
+    if leg_cache is None:
+        leg_cache = osrm_leg_cache.get_leg_cache()
+    routes = []
+    batches = {}
+    for _, route_stops, route_type in route_requests:
+        coordinates = route_stops[["longitude", "latitude"]].to_numpy(dtype=float)
+        legs = leg_cache.get_legs(route_type, coordinates)
+        snaps = leg_cache.get_snaps(route_type, coordinates)
+        routes.append((route_type, coordinates, legs, snaps))
+        batch = batches.setdefault(route_type, [])
+        for start, end in find_missing_runs(legs, snaps):
+            batch.append(coordinates[start : end + 1])
+
+    fetched = {}
+    for route_type, batch in batches.items():
+        if not batch:
+            continue
+        logging.info(
+            "Requesting %i OSRM stops in %i runs for missing %s legs",
+            sum(run.shape[0] for run in batch),
+            len(batch),
+            route_type,
+        )
+        run_results = fetch_legs(batch, route_type, port_mapping, session, max_workers)
+        for coordinates, (legs, snaps) in zip(batch, run_results):
+            leg_cache.put_route(route_type, coordinates, legs, snaps)
+            keys = osrm_leg_cache.coordinate_keys(coordinates)
+            fetched.update(
+                {
+                    ("leg", route_type, a, b): leg
+                    for a, b, leg in zip(keys, keys[1:], legs)
+                }
+            )
+            fetched.update(
+                {("snap", route_type, xy): snap for xy, snap in zip(keys, snaps)}
+            )
+    if fetched:
+        leg_cache.save()
+
+    route_results = []
+    for route_type, coordinates, legs, snaps in routes:
+        keys = osrm_leg_cache.coordinate_keys(coordinates)
+        legs = [
+            leg or fetched[("leg", route_type, a, b)]
+            for a, b, leg in zip(keys, keys[1:], legs)
+        ]
+        snaps = [
+            snap or fetched[("snap", route_type, xy)] for xy, snap in zip(keys, snaps)
+        ]
+        route_results.append(osrm.legs_to_trip_info(legs, snaps))
+    return route_results
+
+
 def return_route_osrm_info(
     assigned_stops: pd.DataFrame,
     port_mapping,
     route_id_name: str = "route_id",
     vehicle_type_name: str = "profile",
+    max_workers: int = ROUTE_MAX_WORKERS,
+    lean: bool = LEAN_GEOMETRY,
+    use_leg_cache: bool = USE_LEG_CACHE,
 ) -> dict:
+    """Fetch OSRM route info for all routes. Routes are requested concurrently with up
+    to `max_workers` requests in flight, results keep the order of the routes.
+    With `lean`, routes are requested without steps and with polyline6 geometry.
+    With `use_leg_cache`, routes are assembled from cached legs and only legs that are
+    not cached yet are requested."""
     logging.info("Total number of stops %i" % assigned_stops.shape[0])
     leg_info = []
     stop_sequence_info = []
@@ -110,17 +298,49 @@ def return_route_osrm_info(
             subset=["longitude"]
         )
 
+    route_requests = []
     for route_id in vehicle_id_types:
-        logging.info("Processing %s" % route_id)
         route_stops = assigned_stops.loc[assigned_stops[route_id_name] == route_id]
-        logging.info("Number of stops %i" % route_stops.shape[0])
         route_type = route_stops[vehicle_type_name].unique()
         assert len(route_type) == 1
-        route_type = route_type[0]
-        results = generate_osrm_route(route_stops, route_type, port_mapping)
-        leg_info_i, stop_sequence_info_i, route_summary_info_i = generate_trip_info(
-            results
+        route_requests.append((route_id, route_stops, route_type[0]))
+
+    session = osrm_session.get_session(pool_size=max(max_workers, 1))
+
+    def _route_osrm_info(request_number):
+        route_id, route_stops, route_type = route_requests[request_number]
+        logging.info("Processing %s" % route_id)
+        logging.info("Number of stops %i" % route_stops.shape[0])
+        results = generate_osrm_route(
+            route_stops, route_type, port_mapping, session, request_number, lean
         )
+        if not lean:
+            return generate_trip_info(results)
+        try:
+            return generate_trip_info(results)
+        except ValueError as error:
+            logging.warning("%s, requesting full route for %s", error, route_id)
+            results = generate_osrm_route(
+                route_stops, route_type, port_mapping, session, request_number
+            )
+            return generate_trip_info(results)
+
+    route_results = None
+    if use_leg_cache:
+        try:
+            route_results = generate_cached_trip_info(
+                route_requests, port_mapping, session, max_workers
+            )
+        except ValueError as error:
+            logging.warning("%s, requesting full routes", error)
+    if route_results is None:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            route_results = list(
+                executor.map(_route_osrm_info, range(len(route_requests)))
+            )
+
+    for (route_id, _, _), route_result in zip(route_requests, route_results):
+        leg_info_i, stop_sequence_info_i, route_summary_info_i = route_result
         logging.info("Number of legs %i" % leg_info_i.shape[0])
         logging.info("Number of stops %i" % stop_sequence_info_i.shape[0])
         leg_info_i[route_id_name] = route_id
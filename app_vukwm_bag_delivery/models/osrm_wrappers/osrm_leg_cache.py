@@ -0,0 +1,118 @@
+"""
+In-memory LRU cache of OSRM route legs and road snaps, with optional disk persistence.
+
+Legs are keyed by (profile, from-coordinate, to-coordinate) and store the travel duration,
+distance and polyline6 encoded path. Road snaps are keyed by (profile, coordinate).
+"""
+import logging
+import os
+import pickle
+import threading
+from collections import OrderedDict
+from typing import Dict, Hashable, List, Tuple, Union
+
+import numpy as np
+
+COORDINATE_PRECISION = 6
+LEG_CACHE_SIZE = 200000
+LEG_CACHE_PATH = None  # e.g. "data/04_model_input/osrm_leg_cache.pkl" to persist legs
+
+_CACHE_LOCK = threading.Lock()
+_CACHES: Dict[Tuple[str, int], "OsrmLegCache"] = {}
+
+
+def coordinate_keys(coordinates: np.ndarray) -> List[Tuple[float, float]]:
+    """Rounded lon-lat tuples used in cache keys."""
+    return list(map(tuple, np.round(coordinates, COORDINATE_PRECISION).tolist()))
+
+
+class OsrmLegCache:
+    """Least recently used leg and snap entries are evicted beyond `max_size` entries."""
+
+    def __init__(self, max_size: int = LEG_CACHE_SIZE, path: Union[str, None] = None):
+        self.max_size = max_size
+        self.path = path
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get_many(self, keys: List[Hashable]) -> dict:
+        """Return the cached entries of the keys found, marking them as recently used."""
+        found = {}
+        with self._lock:
+            for key in keys:
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    found[key] = self._entries[key]
+        return found
+
+    def put_many(self, entries: dict):
+        with self._lock:
+            for key, value in entries.items():
+                self._entries[key] = value
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def get_legs(
+        self, profile: str, coordinates: np.ndarray
+    ) -> List[Union[dict, None]]:
+        """Cached leg between each pair of consecutive coordinates, None if missing."""
+        keys = coordinate_keys(coordinates)
+        leg_keys = [("leg", profile, a, b) for a, b in zip(keys[:-1], keys[1:])]
+        found = self.get_many(leg_keys)
+        return [found.get(key) for key in leg_keys]
+
+    def get_snaps(
+        self, profile: str, coordinates: np.ndarray
+    ) -> List[Union[dict, None]]:
+        """Cached road snap of each coordinate, None if missing."""
+        snap_keys = [("snap", profile, xy) for xy in coordinate_keys(coordinates)]
+        found = self.get_many(snap_keys)
+        return [found.get(key) for key in snap_keys]
+
+    def put_route(self, profile: str, coordinates: np.ndarray, legs: list, snaps: list):
+        """Store the legs and snaps of a route through `coordinates`."""
+        keys = coordinate_keys(coordinates)
+        entries = {
+            ("leg", profile, a, b): leg for a, b, leg in zip(keys[:-1], keys[1:], legs)
+        }
+        entries.update({("snap", profile, xy): snap for xy, snap in zip(keys, snaps)})
+        self.put_many(entries)
+
+    def load(self):
+        if self.path is None or not os.path.isfile(self.path):
+            return self
+        try:
+            with open(self.path, "rb") as file:
+                entries = pickle.load(file)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            logging.warning("Could not read OSRM leg cache %s, ignoring", self.path)
+            return self
+        self.put_many(entries)
+        return self
+
+    def save(self):
+        """Write to a temporary file first so that readers never see a partial file."""
+        if self.path is None:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with self._lock:
+            entries = OrderedDict(self._entries)
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "wb") as file:
+            pickle.dump(entries, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, self.path)
+
+
+def get_leg_cache(
+    path: Union[str, None] = LEG_CACHE_PATH, max_size: int = LEG_CACHE_SIZE
+) -> OsrmLegCache:
+    """Return the process wide leg cache, loaded from `path` on first use."""
+    key = (path, max_size)
+    with _CACHE_LOCK:
+        if key not in _CACHES:
+            _CACHES[key] = OsrmLegCache(max_size, path).load()
+        return _CACHES[key]
@@ -0,0 +1,281 @@
+"""
+Persistent on-disk cache for OSRM time and distance matrices.
+
+Pairwise durations and distances are stored per profile and OSRM server as NumPy `.npy`
+blocks, indexed by the (rounded) lon-lat coordinates of each location. Only the rows and
+columns of coordinates that have not been seen before are requested from OSRM. Pairs
+that OSRM cannot route are stored too, so that they are not requested again. Beyond
+`MATRIX_CACHE_MAX_LOCATIONS`, the least recently used locations are evicted.
+
+Sub-matrices are returned as int32 seconds and meters, truncated as VROOM does when it
+reads the matrix, which takes half the memory of float64 per session.
+"""
+import hashlib
+import logging
+import os
+import threading
+import time
+from typing import Dict
+
+import numpy as np
+import pandas as pd
+
+import app_vukwm_bag_delivery.models.osrm_wrappers.get_osrm_tables as get_osrm_tables
+
+MATRIX_CACHE_DIR = "data/04_model_input/osrm_matrix_cache"
+# e.g. the date of the map extract, to start new caches when the OSRM data is rebuilt
+OSRM_DATA_VERSION = None
+MATRIX_CACHE_MAX_LOCATIONS = 5000  # two float32 matrices of 100 MB each
+COORDINATE_PRECISION = 6
+CACHE_DTYPE = np.float32
+MATRIX_DTYPE = np.int32
+MATRIX_UNREACHABLE = 10**7  # seconds or meters between locations without a route
+CACHE_UNROUTABLE = np.inf  # pairs OSRM could not route, NaN pairs were never requested
+
+_CACHE_LOCK = threading.Lock()
+
+
+def cache_path(cache_dir: str, profile: str, endpoint: str) -> str:
+    """Directory of the cache of a profile's OSRM server, so that matrices of another
+    server, or of another map extract with `OSRM_DATA_VERSION`, are never mixed."""
+    server = hashlib.sha1(f"{endpoint}|{OSRM_DATA_VERSION}".encode()).hexdigest()
+    return os.path.join(cache_dir, profile, server[:12])
+
+
+class OsrmMatrixCache:
+    """Content-addressed matrix cache for a single OSRM profile and server."""
+
+    def __init__(
+        self,
+        profile: str,
+        endpoint: str,
+        cache_dir: str = MATRIX_CACHE_DIR,
+        max_locations: int = MATRIX_CACHE_MAX_LOCATIONS,
+    ):
+        self._path = cache_path(cache_dir, profile, endpoint)
+        self.max_locations = max_locations
+        self.coordinates = np.empty((0, 2))
+        self.last_used = np.empty(0)
+        self.durations = np.empty((0, 0), dtype=CACHE_DTYPE)
+        self.distances = np.empty((0, 0), dtype=CACHE_DTYPE)
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self._path, f"{name}.npy")
+
+    def load(self):
+        """Memory-map the cached blocks, starting empty if they are missing or inconsistent."""
+        try:
+            coordinates = np.load(self._file("coordinates"))
+            last_used = np.load(self._file("last_used"))
+            durations = np.load(self._file("durations"), mmap_mode="r")
+            distances = np.load(self._file("distances"), mmap_mode="r")
+        except (FileNotFoundError, ValueError):
+            return self
+        n_coordinates = coordinates.shape[0]
+        if (
+            durations.shape != (n_coordinates, n_coordinates)
+            or distances.shape != durations.shape
+            or last_used.shape != (n_coordinates,)
+        ):
+            logging.warning(
+                "Inconsistent OSRM matrix cache in %s, ignoring", self._path
+            )
+            return self
+        self.coordinates = coordinates
+        self.last_used = last_used
+        self.durations = durations
+        self.distances = distances
+        return self
+
+    def _write(self, name: str, values: np.ndarray):
+        """Write to a temporary file first so that readers never see partial files."""
+        os.makedirs(self._path, exist_ok=True)
+        temp_file = self._file(f"{name}.tmp")
+        with open(temp_file, "wb") as file:
+            np.save(file, values)
+        os.replace(temp_file, self._file(name))
+
+    def save(self):
+        self._write("durations", self.durations)
+        self._write("distances", self.distances)
+        self._write("last_used", self.last_used)
+        self._write("coordinates", self.coordinates)
+
+    def save_usage(self):
+        """Write only the last use of each location, when the matrices did not change."""
+        self._write("last_used", self.last_used)
+
+    def index_coordinates(self, coordinates: np.ndarray) -> np.ndarray:
+        """Return the cache index of each coordinate, adding unseen coordinates to the
+        cache and marking all of them as used."""
+        coordinates = np.round(coordinates, COORDINATE_PRECISION)
+        lookup = {xy: i for i, xy in enumerate(map(tuple, self.coordinates.tolist()))}
+        cache_index = np.empty(coordinates.shape[0], dtype=int)
+        new_coordinates = []
+        for i, xy in enumerate(map(tuple, coordinates.tolist())):
+            if xy not in lookup:
+                lookup[xy] = len(lookup)
+                new_coordinates.append(xy)
+            cache_index[i] = lookup[xy]
+        if new_coordinates:
+            cache_index = self._grow(np.array(new_coordinates), cache_index)
+        self.last_used[cache_index] = time.time()
+        return cache_index
+
+    def _grow(self, new_coordinates: np.ndarray, cache_index: np.ndarray) -> np.ndarray:
+        """Add the new coordinates after the cached ones that are kept. Beyond
+        `max_locations`, the least recently used locations that are not in `cache_index`
+        are evicted. Returns `cache_index` in the grown cache."""
+        n_old = self.coordinates.shape[0]
+        requested = np.unique(cache_index[cache_index < n_old])
+        n_keep = max(
+            min(n_old, self.max_locations - new_coordinates.shape[0]),
+            requested.shape[0],
+        )
+        keep = np.arange(n_old)
+        if n_keep < n_old:
+            others = np.setdiff1d(keep, requested)
+            recent = np.argsort(-self.last_used[others], kind="stable")
+            keep = np.union1d(requested, others[recent[: n_keep - requested.shape[0]]])
+            logging.info(
+                "OSRM matrix cache: evicting %i least recently used locations",
+                n_old - n_keep,
+            )
+        n_new = n_keep + new_coordinates.shape[0]
+        durations = np.full((n_new, n_new), np.nan, dtype=CACHE_DTYPE)
+        distances = np.full((n_new, n_new), np.nan, dtype=CACHE_DTYPE)
+        kept = np.ix_(keep, keep) if n_keep < n_old else np.s_[:, :]
+        durations[:n_keep, :n_keep] = self.durations[kept]
+        distances[:n_keep, :n_keep] = self.distances[kept]
+        self.durations = durations
+        self.distances = distances
+        self.coordinates = np.vstack([self.coordinates[keep], new_coordinates])
+        self.last_used = np.r_[self.last_used[keep], np.zeros(new_coordinates.shape[0])]
+        new_index = np.full(n_old + new_coordinates.shape[0], -1)
+        new_index[keep] = np.arange(n_keep)
+        new_index[n_old:] = np.arange(n_keep, n_new)
+        return new_index[cache_index]
+
+    def _fetch_block(
+        self,
+        unique_index: np.ndarray,
+        rows: np.ndarray,
+        columns: np.ndarray,
+        endpoint: str,
+        timeout: float,
+    ):
+        """Fetch the `rows` x `columns` block (positions in `unique_index`) from OSRM."""
+        n_locations = unique_index.shape[0]
+        coordinates = pd.DataFrame(
+            self.coordinates[unique_index], columns=["longitude", "latitude"]
+        )
+        block_matrix = get_osrm_tables.get_time_dist_matrix_tiled(
+            coordinates,
+            endpoint,
+            timeout=timeout,
+            sources=None if rows.shape[0] == n_locations else rows,
+            destinations=None if columns.shape[0] == n_locations else columns,
+        )
+        block = np.ix_(unique_index[rows], unique_index[columns])
+        for values, name in [
+            (self.durations, "time_matrix"),
+            (self.distances, "distance_matrix"),
+        ]:
+            block_values = block_matrix[name]
+            values[block] = np.where(
+                np.isnan(block_values), CACHE_UNROUTABLE, block_values
+            )
+
+    def fill_missing(self, cache_index: np.ndarray, endpoint: str, timeout: float):
+        """Request only the missing rows and columns of the sub-matrix from OSRM.
+
+        Locations never seen before get their full row and column. Pairs between known
+        locations that were never requested together are fetched as one final block.
+        """
+        unique_index = np.unique(cache_index)
+        missing = np.isnan(self.durations[np.ix_(unique_index, unique_index)])
+        if not missing.any():
+            return False
+        if not self.durations.flags.writeable:
+            self.durations = np.array(self.durations)
+            self.distances = np.array(self.distances)
+        all_locations = np.arange(unique_index.shape[0])
+        new_locations = np.flatnonzero(np.diag(missing))
+        logging.info(
+            "OSRM matrix cache: %i of %i locations are new",
+            new_locations.shape[0],
+            unique_index.shape[0],
+        )
+        if new_locations.shape[0] > 0:
+            self._fetch_block(
+                unique_index, new_locations, all_locations, endpoint, timeout
+            )
+            known_locations = np.setdiff1d(all_locations, new_locations)
+            if known_locations.shape[0] > 0:
+                self._fetch_block(
+                    unique_index, known_locations, new_locations, endpoint, timeout
+                )
+            missing = np.isnan(self.durations[np.ix_(unique_index, unique_index)])
+        if missing.any():
+            self._fetch_block(
+                unique_index,
+                np.flatnonzero(missing.any(axis=1)),
+                np.flatnonzero(missing.any(axis=0)),
+                endpoint,
+                timeout,
+            )
+        return True
+
+    def sub_matrix(
+        self, cache_index: np.ndarray, slow_down: float = 1
+    ) -> Dict[str, np.ndarray]:
+        block = np.ix_(cache_index, cache_index)
+        return {
+            "time_matrix": compact_matrix(
+                self.durations[block].astype(float) * slow_down
+            ),
+            "distance_matrix": compact_matrix(self.distances[block]),
+        }
+
+
+def compact_matrix(values: np.ndarray) -> np.ndarray:
+    """Whole seconds or meters, with pairs that OSRM could not route set to
+    `MATRIX_UNREACHABLE`."""
+    values = np.where(np.isfinite(values), values, MATRIX_UNREACHABLE)
+    return values.astype(MATRIX_DTYPE)
+
+
+def get_time_dist_matrix(
+    data: pd.DataFrame,
+    endpoint: str,
+    profile: str,
+    lon_col: str = "longitude",
+    lat_col: str = "latitude",
+    timeout: float = 120,
+    slow_down: float = 1,
+    cache_dir: str = MATRIX_CACHE_DIR,
+) -> Dict[str, np.ndarray]:
+    """
+    Cached drop-in for `get_osrm_tables.get_time_dist_matrix`.
+    Args:
+    data: data-frame with lat-lon coordinates, matrix rows follow its row order
+    endpoint: OSRM RestAPI endpoint of the profile
+    profile: routing profile, used as the cache key together with the endpoint and the
+        coordinates
+    cache_dir: directory under which the matrices of each profile and server are stored
+    Return:
+    time_matrix: short-time path time (int32 seconds) between stops i and j.
+    distance_matrix: short-time path distance (int32 meters) between stops i and j.
+    """
+    coordinates = data[[lon_col, lat_col]].to_numpy(dtype=float)
+    with _CACHE_LOCK:
+        cache = OsrmMatrixCache(
+            profile, endpoint, cache_dir, MATRIX_CACHE_MAX_LOCATIONS
+        ).load()
+        cache_index = cache.index_coordinates(coordinates)
+        if cache.fill_missing(cache_index, endpoint, timeout):
+            cache.save()
+        else:
+            cache.save_usage()
+        matrix = cache.sub_matrix(cache_index, slow_down)
+    return matrix
@@ -0,0 +1,47 @@
+"""
+Shared keep-alive HTTP sessions for OSRM requests, with connection pooling and bounded retries.
+"""
+import threading
+from typing import Dict, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+POOL_SIZE = 16
+MAX_RETRIES = 3
+RETRY_BACKOFF_FACTOR = 0.5
+RETRY_STATUS_CODES = [429, 500, 502, 503, 504]
+
+_SESSION_LOCK = threading.Lock()
+_SESSIONS: Dict[Tuple[int, int], requests.Session] = {}
+
+
+def create_session(
+    pool_size: int = POOL_SIZE, max_retries: int = MAX_RETRIES
+) -> requests.Session:
+    """Create a session that keeps up to `pool_size` connections per host open."""
+    retries = Retry(
+        total=max_retries,
+        backoff_factor=RETRY_BACKOFF_FACTOR,
+        status_forcelist=RETRY_STATUS_CODES,
+        allowed_methods=["GET"],
+    )
+    adapter = HTTPAdapter(
+        pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retries
+    )
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def get_session(
+    pool_size: int = POOL_SIZE, max_retries: int = MAX_RETRIES
+) -> requests.Session:
+    """Return the process wide session for the pool size and retry settings."""
+    key = (pool_size, max_retries)
+    with _SESSION_LOCK:
+        if key not in _SESSIONS:
+            _SESSIONS[key] = create_session(pool_size, max_retries)
+        return _SESSIONS[key]
@@ -8,6 +8,8 @@ import numpy as np
 import pandas as pd
 import streamlit
 
+import app_vukwm_bag_delivery.models.pipelines.process_input_data.aggregate_orders as aggregate_orders
+
 FILTER_COLUMNS = "Ticket No"
 AGGREGATION_IDs = ["stop_id"]
 
@@ -40,21 +42,15 @@ UNASSIGNED_STOPS_COLUMN_MAPPING = [
 ]
 
 
-def combine_product_name_quantity(df):
-    """We combine all orders assigned to a site into one row, with key info concatinated with `';'`."""
-    duration = df["service_duration__seconds"].max()
-    demand = df["demand"].sum()
-    df = df.iloc[:1]  # TODO: this stores key info, but also assigns the same date info
-    df["demand"] = demand
-    df["service_duration__seconds"] = duration
-    return df
-
-
 def combine_orders(df):
-    orders_grouped = (
-        df.groupby(AGGREGATION_IDs)
-        .apply(combine_product_name_quantity)
-        .reset_index(drop=True)
+    """We combine all orders assigned to a site into one row, adding up their demand."""
+    orders_grouped = aggregate_orders.combine_first_rows(
+        df,
+        AGGREGATION_IDs,
+        {
+            "demand": ("demand", "sum"),
+            "service_duration__seconds": ("service_duration__seconds", "max"),
+        },
     )
     return orders_grouped
 
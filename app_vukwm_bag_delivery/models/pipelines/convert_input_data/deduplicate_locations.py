@@ -0,0 +1,73 @@
+"""
+Collapse co-located locations into shared matrix nodes.
+
+Sites in shopping centres or at the same street number often share coordinates. Such
+locations only need one row and column in the travel time and distance matrices. Each
+location is mapped to a node, the index of the first location within the tolerance.
+"""
+import numpy as np
+import pandas as pd
+
+import app_vukwm_bag_delivery.models.osrm_wrappers.osrm_matrix_cache as osrm_matrix_cache
+
+EARTH_RADIUS_METERS = 6_371_000
+LOCATION_TOLERANCE_METERS = 5
+
+
+def local_xy(latitude: np.ndarray, longitude: np.ndarray) -> np.ndarray:
+    """Equirectangular projection in meters, accurate over the extent of a city."""
+    latitude = np.radians(latitude)
+    longitude = np.radians(longitude)
+    x = longitude * np.cos(np.mean(latitude)) * EARTH_RADIUS_METERS
+    y = latitude * EARTH_RADIUS_METERS
+    return np.column_stack([x, y])
+
+
+def cluster_points(xy: np.ndarray, tolerance: float) -> np.ndarray:
+    """Index of the first point within `tolerance` of each point, in input order.
+
+    Points are bucketed on a grid with cells of the tolerance, so only the points in
+    the neighbouring cells are compared."""
+    cells = np.floor(xy / tolerance).astype(np.int64)
+    grid = {}
+    nodes = np.empty(xy.shape[0], dtype=int)
+    for i, (cell_x, cell_y) in enumerate(cells):
+        nodes[i] = i
+        candidates = [
+            j
+            for dx in (-1, 0, 1)
+            for dy in (-1, 0, 1)
+            for j in grid.get((cell_x + dx, cell_y + dy), [])
+        ]
+        if candidates:
+            distances = np.hypot(*(xy[candidates] - xy[i]).T)
+            closest = np.argmin(distances)
+            if distances[closest] <= tolerance:
+                nodes[i] = candidates[closest]
+                continue
+        grid.setdefault((cell_x, cell_y), []).append(i)
+    return nodes
+
+
+def matrix_nodes(
+    locations: pd.DataFrame, tolerance_meters: float = LOCATION_TOLERANCE_METERS
+) -> np.ndarray:
+    """Matrix node of each location, by position in `locations`.
+
+    Locations with identical coordinates, at the precision of the matrix cache, always
+    share a node. With a positive tolerance, locations within `tolerance_meters` of
+    the first location of a node join that node too."""
+    coordinates = np.round(
+        locations[["latitude", "longitude"]].to_numpy(dtype=float),
+        osrm_matrix_cache.COORDINATE_PRECISION,
+    )
+    _, first_index, inverse = np.unique(
+        coordinates, axis=0, return_index=True, return_inverse=True
+    )
+    nodes = first_index[inverse.ravel()]
+    if tolerance_meters > 0:
+        unique_index = np.unique(nodes)
+        xy = local_xy(coordinates[unique_index, 0], coordinates[unique_index, 1])
+        clustered = unique_index[cluster_points(xy, tolerance_meters)]
+        nodes = clustered[np.searchsorted(unique_index, nodes)]
+    return nodes
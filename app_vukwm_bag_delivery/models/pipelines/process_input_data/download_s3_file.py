@@ -1,12 +1,22 @@
 import json
 import logging
 import os
-from typing import Dict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Union
 
 import boto3
 import pandas as pd
 import toml
 
+from app_vukwm_bag_delivery.models.pipelines.process_input_data import (
+    ingest_cache,
+    raw_input_processing,
+    s3_manifest,
+)
+
+DOWNLOAD_MAX_WORKERS = 5
+METADATA_SUFFIX = ".s3.json"
+
 
 def get_s3_bucket_session(s3_cred: Dict[str, str], bucket: str):
     aws_access_key_id = s3_cred["aws_access_key_id"]
@@ -20,30 +30,58 @@ def get_s3_bucket_session(s3_cred: Dict[str, str], bucket: str):
     return my_bucket
 
 
-def download_file(my_bucket, s3_path, local_path):
+def object_metadata(etag, size, last_modified) -> Dict[str, str]:
+    """Version info of an S3 object, used to validate local copies."""
+    return {
+        "etag": str(etag),
+        "size": str(int(size)),
+        "last_modified": pd.Timestamp(last_modified).isoformat(),
+    }
+
+
+def read_local_metadata(local_path: str) -> Union[Dict[str, str], None]:
+    try:
+        with open(local_path + METADATA_SUFFIX, mode="r", encoding="utf-8") as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def write_local_metadata(local_path: str, metadata: Dict[str, str]):
+    with open(local_path + METADATA_SUFFIX, mode="w", encoding="utf-8") as file:
+        json.dump(metadata, file)
+
+
+def download_file(my_bucket, s3_path, local_path, metadata=None):
+    """Download the object, unless the local copy has the same ETag, size and
+    last-modified time. The object is looked up if `metadata` is not given."""
     if not os.path.isdir(local_path[: local_path.rfind("/") + 1]):
         os.makedirs(local_path[: local_path.rfind("/")])
     key = s3_path
     upload = local_path
-    if os.path.isfile(local_path):
+    if metadata is None:
+        s3_object = my_bucket.Object(key)
+        metadata = object_metadata(
+            s3_object.e_tag, s3_object.content_length, s3_object.last_modified
+        )
+    if os.path.isfile(local_path) and read_local_metadata(local_path) == metadata:
         logging.info(f"File {key} already downloaded to {upload}")
     else:
         try:
-            my_bucket.download_file(key, upload)
+            my_bucket.download_file(key, upload + ".tmp")
+            os.replace(upload + ".tmp", upload)
         except:
             logging.error(f"Could not download {key} to {upload}")
             raise ValueError("failure")
+        write_local_metadata(local_path, metadata)
+    return metadata
 
 
 def get_latest_bucket_files(my_bucket, prefix: str) -> pd.DataFrame:
-    existing_s3_files = my_bucket.objects.filter(Prefix=prefix)
-    pulled_results = []
-    for key in existing_s3_files:
-        pulled_results.append(
-            {"filename": key.key, "size": key.size, "last_modified": key.last_modified}
-        )
-    file_info = pd.DataFrame(pulled_results)
-    return file_info
+    """Objects under the prefix, from the manifest after listing the new uploads."""
+    manifest = s3_manifest.S3Manifest()
+    manifest.sync(my_bucket, prefix)
+    return manifest.files(my_bucket.name, prefix)
 
 
 def download_return_file(my_bucket, file_info, driver, latest_file=None):
@@ -51,10 +89,46 @@ def download_return_file(my_bucket, file_info, driver, latest_file=None):
         latest_file = file_info.sort_values(["last_modified"], ascending=False).iloc[0][
             "filename"
         ]
-    download_file(my_bucket, latest_file, "data/" + latest_file)
+    metadata = None
+    if isinstance(file_info, pd.DataFrame) and "etag" in file_info:
+        latest_info = file_info.loc[file_info["filename"] == latest_file]
+        if latest_info.shape[0] == 1:
+            latest_info = latest_info.iloc[0]
+            metadata = object_metadata(
+                latest_info["etag"], latest_info["size"], latest_info["last_modified"]
+            )
+    download_file(my_bucket, latest_file, "data/" + latest_file, metadata)
     return driver("data/" + latest_file)
 
 
+def return_latest_file(
+    bucket, s3_cred, prefix, driver, cache_input=False, prepare=None
+):
+    """Return the latest file of the prefix read with `driver`, with a session of its
+    own so that it can run in a worker thread.
+
+    The prefix is listed in full, as uploads have arbitrary names, so that the latest
+    file is found whatever its key. The ETag and size of the listing are used to skip
+    downloading a file that is already up to date.
+    With `cache_input`, tabular files are read through the Parquet ingest cache and
+    converted with `prepare` on their first read."""
+    my_bucket = get_s3_bucket_session(s3_cred, bucket)
+    objects = s3_manifest.list_objects(my_bucket, prefix)
+    if not objects:
+        raise ValueError(f"No files found in {bucket}/{prefix}")
+    latest = max(objects, key=lambda x: (pd.Timestamp(x["LastModified"]), x["Key"]))
+    local_path = "data/" + latest["Key"]
+    metadata = download_file(
+        my_bucket,
+        latest["Key"],
+        local_path,
+        object_metadata(latest.get("ETag"), latest["Size"], latest["LastModified"]),
+    )
+    if not cache_input:
+        return driver(local_path)
+    return ingest_cache.read_cached(local_path, metadata["etag"], driver, prepare)
+
+
 def read_json_file(file_name: str):
     """Readd single test file"""
     with open(file_name, mode="r", encoding="utf-8") as file:
@@ -90,28 +164,35 @@ def return_routing_files(
     unassgined_stops_prefix_path,
     time_windows_prefix_path,
     bag_weights_prefix_path,
+    max_workers=DOWNLOAD_MAX_WORKERS,
 ):
-    my_bucket = get_s3_bucket_session(s3_cred, bucket)
-
-    excel_files = get_latest_bucket_files(my_bucket, excel_prefix_path)
-    latest_excel_file = download_return_file(my_bucket, excel_files, pd.read_excel)
-
-    geo_files = get_latest_bucket_files(my_bucket, geocoded_prefix_path)
-    latest_geo_file = download_return_file(my_bucket, geo_files, pd.read_csv)
-
-    unassigned_stops_files = get_latest_bucket_files(
-        my_bucket, unassgined_stops_prefix_path
-    )
-    latest_unassigned_stops_file = download_return_file(
-        my_bucket, unassigned_stops_files, read_json_file
-    )
-
-    time_windows_files = get_latest_bucket_files(my_bucket, time_windows_prefix_path)
-    latest_time_windows_file = download_return_file(
-        my_bucket, time_windows_files, pd.read_csv
-    )
-    weight_files = get_latest_bucket_files(my_bucket, bag_weights_prefix_path)
-    latest_weight_files = download_return_file(my_bucket, weight_files, pd.read_csv)
+    """List, download and read the latest file of each input prefix concurrently."""
+    prefix_drivers = [
+        (excel_prefix_path, pd.read_excel, True, None),
+        (
+            geocoded_prefix_path,
+            pd.read_csv,
+            True,
+            raw_input_processing.cast_column_types,
+        ),
+        (unassgined_stops_prefix_path, read_json_file, False, None),
+        (time_windows_prefix_path, pd.read_csv, True, None),
+        (bag_weights_prefix_path, pd.read_csv, True, None),
+    ]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(
+                return_latest_file, bucket, s3_cred, prefix, driver, cache, prepare
+            )
+            for prefix, driver, cache, prepare in prefix_drivers
+        ]
+        (
+            latest_excel_file,
+            latest_geo_file,
+            latest_unassigned_stops_file,
+            latest_time_windows_file,
+            latest_weight_files,
+        ) = [future.result() for future in futures]
     return (
         latest_excel_file,
         latest_geo_file,
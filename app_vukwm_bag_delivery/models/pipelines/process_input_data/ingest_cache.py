@@ -0,0 +1,74 @@
+"""
+Typed Parquet copies of the downloaded input files, keyed by the ETag of the S3 object.
+
+The first read of an object version parses the source file and stores the frame as
+Parquet next to it. Later reads memory-map the Parquet file instead of parsing the Excel
+or CSV file again, until a new version of the object is downloaded.
+"""
+import glob
+import logging
+import os
+import re
+from typing import Callable, Union
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+INGEST_CACHE_SUFFIX = ".parquet"
+
+logger = logging.getLogger(__name__)
+
+
+def cache_path(local_path: str, etag: str) -> str:
+    """ETags are quoted, and contain a `-` for multipart uploads."""
+    version = re.sub(r"[^0-9A-Za-z]", "", etag)
+    return f"{local_path}.{version}{INGEST_CACHE_SUFFIX}"
+
+
+def restore_missing_values(df: pd.DataFrame) -> pd.DataFrame:
+    """Arrow returns missing strings as None, while the parsers return NaN."""
+    for column in df.columns[df.dtypes == object]:
+        if df[column].isna().any():
+            df[column] = df[column].where(df[column].notna(), np.nan)
+    return df
+
+
+def remove_stale_versions(local_path: str, keep_path: str):
+    for path in glob.glob(f"{glob.escape(local_path)}.*{INGEST_CACHE_SUFFIX}"):
+        if path != keep_path:
+            os.remove(path)
+
+
+def write_cache(df: pd.DataFrame, path: str):
+    """Write to a temporary file first so that readers never see a partial file."""
+    temp_path = f"{path}.tmp"
+    df.to_parquet(temp_path, index=True)
+    os.replace(temp_path, path)
+
+
+def read_cached(
+    local_path: str,
+    etag: str,
+    driver: Callable[[str], pd.DataFrame],
+    prepare: Union[Callable[[pd.DataFrame], pd.DataFrame], None] = None,
+) -> pd.DataFrame:
+    """Return the frame of the object version, parsing the source with `driver` and
+    converting it with `prepare` only if the version has not been read before."""
+    path = cache_path(local_path, etag)
+    if os.path.isfile(path):
+        try:
+            return restore_missing_values(pd.read_parquet(path, memory_map=True))
+        except (OSError, pa.ArrowException):
+            logger.warning(f"Could not read input cache {path}, parsing {local_path}")
+    df = driver(local_path)
+    if prepare is not None:
+        df = prepare(df)
+    remove_stale_versions(local_path, path)
+    try:
+        write_cache(df, path)
+    except (pa.ArrowException, TypeError, ValueError):
+        logger.warning(f"Could not cache {local_path} as Parquet, parsing it each time")
+        if os.path.isfile(f"{path}.tmp"):
+            os.remove(f"{path}.tmp")
+    return df
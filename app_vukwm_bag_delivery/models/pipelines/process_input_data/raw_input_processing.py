@@ -7,6 +7,8 @@ import numpy as np
 import pandas as pd
 import streamlit as st
 
+import app_vukwm_bag_delivery.models.pipelines.process_input_data.aggregate_orders as aggregate_orders
+
 INPUT_DATE_COLUMNS_FORMAT = {
     "Created Date": "%%d/%m/%Y",
     "Required Date": "%%d/%m/%Y",
@@ -27,6 +29,11 @@ COLUMN_TYPES = {
 }
 
 
+def cast_column_types(df):
+    """Cast the ID columns, where present, to the types used for matching."""
+    return df.astype({key: value for key, value in COLUMN_TYPES.items() if key in df})
+
+
 def add_excel_time_dates(df, excel_df):
     excel_df = excel_df.assign(
         **{
@@ -106,37 +113,27 @@ def assign_bicycle_skills(df):
     )
 
 
-def combine_product_name_quantity(df):
-    """We combine all orders assigned to a site into one row, with key info concatinated with `';'`."""
-    product_names = df["Product Name"].values
-    quantity = df["Quantity"].values
-    ticket_numbers = df["Ticket No"].values
-    boxes = df["Quantity"].sum()
-    total_weight = df["Order Weight (kg)"].sum()
-    descriptions = []
-    for i in range(product_names.shape[0]):
-        descriptions.append(f"{product_names[i]}: {quantity[i]}")
-    descriptions = "\n".join(descriptions)
-    df = df.iloc[:1]  # TODO: this stores key info, but also assigns the same date info
-    df["Product description"] = descriptions
-    df["Ticket No"] = "; ".join(ticket_numbers)
-    df["Total batches"] = boxes
-    df["Order Weight (kg)"] = total_weight
-    df["Product Name"] = "; ".join(product_names)
-    df["Quantity"] = "; ".join(quantity.astype(str))
-    return df
-
-
 def filter_unassigned(df):
     """Return unassigned jobs for routing"""
     return df.loc[~df["completed"]]
 
 
 def combine_orders(df):
-    orders_grouped = (
-        df.groupby(AGGREGATION_IDs)
-        .apply(combine_product_name_quantity)
-        .reset_index(drop=True)
+    """We combine all orders assigned to a site into one row, with key info concatinated with `';'`."""
+    orders_grouped = aggregate_orders.combine_first_rows(
+        df,
+        AGGREGATION_IDs,
+        {
+            "Product description": (
+                aggregate_orders.product_descriptions(df),
+                aggregate_orders.join_values("\n"),
+            ),
+            "Ticket No": ("Ticket No", aggregate_orders.join_values()),
+            "Total batches": ("Quantity", "sum"),
+            "Order Weight (kg)": ("Order Weight (kg)", "sum"),
+            "Product Name": ("Product Name", aggregate_orders.join_values()),
+            "Quantity": (df["Quantity"].astype(str), aggregate_orders.join_values()),
+        },
     )
     return orders_grouped
 
@@ -149,7 +146,6 @@ def process_input_data(df, excel_df, bag_weights, excel_date_format=True):
     df = filter_unassigned(df)
     df = extract_transport_number(df)
     df = assign_bicycle_skills(df)
-    for key in COLUMN_TYPES:
-        df[key] = df[key].astype(COLUMN_TYPES[key])
+    df = cast_column_types(df)
     df = add_order_weight(df, bag_weights)
     return df
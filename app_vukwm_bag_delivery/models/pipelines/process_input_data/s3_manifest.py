@@ -0,0 +1,176 @@
+"""
+Local index of the objects under each S3 input prefix, stored in SQLite.
+
+The index is updated incrementally by listing only the keys after the last key seen,
+so that each login lists the new uploads rather than the whole history of the prefix.
+As S3 lists keys in lexicographic order, objects overwritten in place, deleted, or
+uploaded under keys sorting before the last key are only picked up by a full refresh,
+which is done periodically. Only the rows of objects that changed are written.
+
+The manifest backs the file browser. The latest upload of a prefix is resolved from a
+listing of the whole prefix instead, see `list_objects`, as uploads have arbitrary
+names and a new one may sort before the last key seen.
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Union
+
+import pandas as pd
+
+S3_MANIFEST_PATH = "data/01_raw/s3_manifest.sqlite"
+S3_MANIFEST_FULL_REFRESH_HOURS = 24
+
+logger = logging.getLogger(__name__)
+
+
+def list_objects(my_bucket, prefix: str, start_after: str = None) -> list:
+    """Objects under the prefix, after `start_after` if given, as listed by S3."""
+    list_arguments = {"Bucket": my_bucket.name, "Prefix": prefix}
+    if start_after is not None:
+        list_arguments["StartAfter"] = start_after
+    paginator = my_bucket.meta.client.get_paginator("list_objects_v2")
+    return [
+        s3_object
+        for page in paginator.paginate(**list_arguments)
+        for s3_object in page.get("Contents", [])
+    ]
+
+
+class S3Manifest:
+    """Key, size, last-modified time and ETag of the objects per bucket and prefix."""
+
+    def __init__(
+        self,
+        path: str = S3_MANIFEST_PATH,
+        full_refresh_hours: float = S3_MANIFEST_FULL_REFRESH_HOURS,
+    ):
+        self.path = path
+        self.full_refresh = full_refresh_hours * 3600
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connect() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS objects ("
+                "bucket TEXT NOT NULL, prefix TEXT NOT NULL, key TEXT NOT NULL, "
+                "size INTEGER NOT NULL, last_modified REAL NOT NULL, etag TEXT, "
+                "PRIMARY KEY (bucket, prefix, key))"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS objects_last_modified "
+                "ON objects (bucket, prefix, last_modified)"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS prefixes ("
+                "bucket TEXT NOT NULL, prefix TEXT NOT NULL, last_key TEXT, "
+                "refreshed_at REAL NOT NULL, PRIMARY KEY (bucket, prefix))"
+            )
+
+    @contextmanager
+    def _connect(self):
+        """Connection that commits on success and is always closed."""
+        connection = sqlite3.connect(self.path, timeout=30)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def _prefix_state(self, bucket: str, prefix: str):
+        with self._connect() as connection:
+            return connection.execute(
+                "SELECT last_key, refreshed_at FROM prefixes "
+                "WHERE bucket = ? AND prefix = ?",
+                (bucket, prefix),
+            ).fetchone()
+
+    def _stored_rows(self, bucket: str, prefix: str) -> set:
+        with self._connect() as connection:
+            return set(
+                connection.execute(
+                    "SELECT * FROM objects WHERE bucket = ? AND prefix = ?",
+                    (bucket, prefix),
+                ).fetchall()
+            )
+
+    def sync(self, my_bucket, prefix: str, now: float = None) -> int:
+        """List the objects added under the prefix since the last sync, or all objects
+        if the prefix was not fully listed within `full_refresh_hours`.
+
+        Returns the number of objects listed."""
+        now = time.time() if now is None else now
+        state = self._prefix_state(my_bucket.name, prefix)
+        full_refresh = state is None or now - state[1] > self.full_refresh
+        objects = list_objects(my_bucket, prefix, None if full_refresh else state[0])
+        rows = {
+            (
+                my_bucket.name,
+                prefix,
+                s3_object["Key"],
+                s3_object["Size"],
+                pd.Timestamp(s3_object["LastModified"]).timestamp(),
+                s3_object.get("ETag"),
+            )
+            for s3_object in objects
+        }
+        # an incremental listing only has keys after the last key, which are all new
+        changed, deleted = rows, []
+        if full_refresh:
+            stored = self._stored_rows(my_bucket.name, prefix)
+            changed = rows - stored
+            listed_keys = {row[2] for row in rows}
+            deleted = [row[:3] for row in stored if row[2] not in listed_keys]
+        last_key = max([row[2] for row in rows], default=None)
+        if last_key is None and not full_refresh:
+            last_key = state[0]
+        refreshed_at = now if full_refresh else state[1]
+        prefix_state = (last_key, refreshed_at)
+        if changed or deleted or state is None or tuple(state) != prefix_state:
+            with self._lock, self._connect() as connection:
+                connection.executemany(
+                    "DELETE FROM objects WHERE bucket = ? AND prefix = ? AND key = ?",
+                    deleted,
+                )
+                connection.executemany(
+                    "INSERT OR REPLACE INTO objects VALUES (?, ?, ?, ?, ?, ?)",
+                    sorted(changed),
+                )
+                connection.execute(
+                    "INSERT OR REPLACE INTO prefixes VALUES (?, ?, ?, ?)",
+                    (my_bucket.name, prefix, *prefix_state),
+                )
+        logger.info(
+            f"{'Listed' if full_refresh else 'Updated'} S3 manifest of "
+            f"{my_bucket.name}/{prefix} with {len(rows)} objects, "
+            f"{len(changed)} changed and {len(deleted)} deleted"
+        )
+        return len(rows)
+
+    def latest_file(self, bucket: str, prefix: str) -> Union[str, None]:
+        """Key of the most recently modified object under the prefix in the manifest,
+        which may miss new keys sorting before the last key listed."""
+        with self._connect() as connection:
+            row = connection.execute(
+                "SELECT key FROM objects WHERE bucket = ? AND prefix = ? "
+                "ORDER BY last_modified DESC, key DESC LIMIT 1",
+                (bucket, prefix),
+            ).fetchone()
+        return None if row is None else row[0]
+
+    def files(self, bucket: str, prefix: str) -> pd.DataFrame:
+        """Objects under the prefix, in the format of a bucket listing."""
+        with self._connect() as connection:
+            file_info = pd.read_sql_query(
+                "SELECT key AS filename, size, last_modified, etag FROM objects "
+                "WHERE bucket = ? AND prefix = ? ORDER BY key",
+                connection,
+                params=(bucket, prefix),
+            )
+        file_info["last_modified"] = pd.to_datetime(
+            file_info["last_modified"], unit="s", utc=True
+        )
+        return file_info
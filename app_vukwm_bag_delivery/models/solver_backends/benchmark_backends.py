@@ -0,0 +1,122 @@
+"""
+Compare the solver backends on identical problem instances.
+
+Run as a module to benchmark synthetic single-depot van instances:
+
+    python -m app_vukwm_bag_delivery.models.solver_backends.benchmark_backends
+"""
+import time
+
+import numpy as np
+import pandas as pd
+
+from app_vukwm_bag_delivery.models.pipelines.convert_input_data import convert_jobs
+from app_vukwm_bag_delivery.models.solver_backends import solver_backend
+
+BENCHMARK_SPEED_METERS_PER_SECOND = 8
+BENCHMARK_SIZES = [(50, 2), (150, 4), (300, 6)]
+
+
+def synthetic_instance(n_stops: int, n_vehicles: int, seed: int = 0) -> dict:
+    """Random stops around a single van depot in London, with straight-line travel."""
+    rng = np.random.default_rng(seed)
+    routes = pd.DataFrame(
+        {
+            "route_id": [f"VAN{i}" for i in range(n_vehicles)],
+            "stop_id": [f"VAN{i}" for i in range(n_vehicles)],
+            "route_index": np.arange(n_vehicles),
+            "profile": "auto",
+            "skills": np.nan,
+            "latitude": 51.51,
+            "longitude": -0.09,
+            "capacity": 1000,
+            "max_stops": 60,
+            "time_window_start": "07:00:00",
+            "time_window_end": "17:00:00",
+            "service_duration_default__seconds": 300.0,
+            "replenish_duration__seconds": 600.0,
+            "activity_type": "DEPOT_START_END",
+        }
+    )
+    stops = pd.DataFrame(
+        {
+            "stop_id": [f"STOP{i}" for i in range(n_stops)],
+            "latitude": rng.uniform(51.45, 51.57, n_stops),
+            "longitude": rng.uniform(-0.2, 0.02, n_stops),
+            "demand": rng.uniform(5, 60, n_stops).round(1),
+            "skills": np.nan,
+            "activity_type": "DELIVERY",
+            "service_duration__seconds": 300,
+            "time_window_start": rng.choice(["07:00:00", "09:00:00"], n_stops),
+            "time_window_end": rng.choice(["12:00:00", "17:00:00"], n_stops),
+        }
+    )
+    locations, stops, routes = convert_jobs.create_locations(stops, routes)
+    locations = locations.sort_values("location_index")
+    x = np.radians(locations["longitude"].to_numpy()) * np.cos(np.radians(51.51))
+    y = np.radians(locations["latitude"].to_numpy())
+    distances = 6_371_000 * np.hypot(x[:, None] - x, y[:, None] - y)
+    matrix = {
+        "auto": {
+            "time_matrix": (distances / BENCHMARK_SPEED_METERS_PER_SECOND)
+            .round()
+            .astype(np.int32),
+            "distance_matrix": distances.round().astype(np.int32),
+        }
+    }
+    return {
+        "locations": locations,
+        "unassigned_stops": stops,
+        "unassigned_routes": routes,
+        "matrix": matrix,
+    }
+
+
+def compare_backends(
+    instances: dict, backends=solver_backend.SOLVER_BACKENDS
+) -> pd.DataFrame:
+    """Solve each named instance with each backend.
+
+    Args:
+        instances: problem per name, with `locations`, `unassigned_stops`,
+            `unassigned_routes` and `matrix`
+
+    Returns:
+        cost, unassigned jobs and solve time per instance and backend
+    """
+    results = []
+    for name, instance in instances.items():
+        for backend in backends:
+            start = time.perf_counter()
+            solution, _ = solver_backend.solve(
+                backend,
+                instance["locations"],
+                instance["unassigned_stops"],
+                instance["unassigned_routes"],
+                instance["matrix"],
+            )
+            results.append(
+                {
+                    "instance": name,
+                    "backend": backend,
+                    "n_stops": instance["unassigned_stops"].shape[0],
+                    "n_vehicles": instance["unassigned_routes"].shape[0],
+                    "cost": solution.summary.cost,
+                    "unassigned": solution.summary.unassigned,
+                    "solve_seconds": round(time.perf_counter() - start, 2),
+                }
+            )
+    return pd.DataFrame(results)
+
+
+if __name__ == "__main__":
+    print(
+        compare_backends(
+            {
+                f"{n_stops}_stops_{n_vehicles}_vans": synthetic_instance(
+                    n_stops, n_vehicles
+                )
+                for n_stops, n_vehicles in BENCHMARK_SIZES
+            }
+        ).to_string(index=False)
+    )
@@ -0,0 +1,347 @@
+"""
+Decompose a very large day into smaller routing problems and solve them in parallel.
+
+Vehicles are grouped by depot and skills, and each stop goes to the nearest group that
+can serve it, with stops without skills kept for vehicles without skills. Groups with
+more than `DECOMPOSE_MAX_STOPS` stops are split into sectors around their depot, each
+with its share of the vehicles. The partitions are solved with VROOM in worker
+processes.
+
+Stops whose nearest neighbour is in another partition lie on a boundary. For each pair
+of neighbouring partitions, the routes that visit their boundary stops are solved again
+together with both partitions' unassigned stops, and the result is kept if it is better.
+"""
+import logging
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+import pandas as pd
+
+from app_vukwm_bag_delivery.models.vroom_wrappers import (
+    generate_vroom_object,
+    multi_start,
+    profile_matrix,
+    solve_vroom_object,
+)
+
+DECOMPOSE_MAX_STOPS = 150
+# a stop is on a boundary when another partition is within this factor of the travel
+# time to the nearest stop of its own partition
+BOUNDARY_FACTOR = 1.2
+SERVICE_STEP_TYPES = ["job", "delivery"]
+
+
+def fleet_groups(route_df: pd.DataFrame) -> np.ndarray:
+    """Group of each route, routes in a group share their depot and skills."""
+    keys = (
+        route_df["latitude"].round(6).astype(str)
+        + ","
+        + route_df["longitude"].round(6).astype(str)
+        + ","
+        + route_df["skills"].astype(str)
+    )
+    return pd.factorize(keys)[0]
+
+
+def assign_stop_groups(route_df, stops_df, matrix, groups) -> np.ndarray:
+    """Group of the depot nearest to each stop, among the groups that can serve it."""
+    stop_index = stops_df["location_index"].to_numpy(dtype=int)
+    stop_skills = generate_vroom_object.parse_unique_values(
+        stops_df["skills"], generate_vroom_object.parse_stop_skills
+    )
+    n_groups = groups.max() + 1
+    times = np.full((n_groups, stop_index.shape[0]), np.nan)
+    eligible = np.zeros((n_groups, stop_index.shape[0]), dtype=bool)
+    skilled = np.zeros(n_groups, dtype=bool)
+    for group, group_routes in route_df.groupby(groups):
+        route = group_routes.iloc[0]
+        vehicle_skills = [
+            skills or set()
+            for skills in generate_vroom_object.parse_unique_values(
+                group_routes["skills"], generate_vroom_object.parse_vehicle_skills
+            )
+        ]
+        skilled[group] = any(vehicle_skills)
+        times[group] = profile_matrix.lookup(
+            matrix[route["profile"]],
+            "time_matrix",
+            int(route["location_index"]),
+            stop_index,
+        )
+        eligible[group] = [
+            skills is None or any(skills <= vehicle for vehicle in vehicle_skills)
+            for skills in stop_skills
+        ]
+    if (~skilled).any():
+        without_skills = np.array([skills is None for skills in stop_skills])
+        eligible[np.ix_(skilled, without_skills)] = False
+    times = np.where(np.isnan(times), np.inf, times)
+    eligible_times = np.where(eligible, times, np.inf)
+    # stops that no group can serve go to the nearest depot, where they stay unassigned
+    unservable = np.isinf(eligible_times).all(axis=0)
+    eligible_times[:, unservable] = times[:, unservable]
+    return np.argmin(eligible_times, axis=0)
+
+
+def sweep_sectors(stops_df, depot_latitude, depot_longitude, n_sectors) -> np.ndarray:
+    """Split stops into sectors around the depot, balancing demand and stop counts.
+
+    The sweep starts at the widest angle between stops, so no sector straddles it."""
+    angle = np.arctan2(
+        stops_df["latitude"].to_numpy() - depot_latitude,
+        (stops_df["longitude"].to_numpy() - depot_longitude)
+        * np.cos(np.radians(depot_latitude)),
+    )
+    order = np.argsort(angle, kind="stable")
+    sorted_angle = angle[order]
+    gaps = np.diff(np.r_[sorted_angle, sorted_angle[0] + 2 * np.pi])
+    order = np.roll(order, -((np.argmax(gaps) + 1) % order.shape[0]))
+    demand = stops_df["demand"].to_numpy(dtype=float)[order]
+    weight = 1 / order.shape[0] + (
+        demand / demand.sum() if demand.sum() > 0 else 1 / order.shape[0]
+    )
+    middle = (np.cumsum(weight) - weight / 2) / weight.sum()
+    sectors = np.empty(order.shape[0], dtype=int)
+    sectors[order] = np.minimum((middle * n_sectors).astype(int), n_sectors - 1)
+    return sectors
+
+
+def partition_problem(
+    route_df, stops_df, matrix, max_stops=DECOMPOSE_MAX_STOPS
+) -> list:
+    """Partitions of the problem, as (routes, stops) with the vehicles of the stops."""
+    groups = fleet_groups(route_df)
+    stop_groups = assign_stop_groups(route_df, stops_df, matrix, groups)
+    partitions = []
+    for group, group_routes in route_df.groupby(groups):
+        group_stops = stops_df.loc[stop_groups == group]
+        if group_stops.shape[0] == 0:
+            continue
+        n_sectors = min(
+            int(np.ceil(group_stops.shape[0] / max_stops)), group_routes.shape[0]
+        )
+        if n_sectors <= 1:
+            partitions.append((group_routes, group_stops))
+            continue
+        depot = group_routes.iloc[0]
+        sectors = sweep_sectors(
+            group_stops, depot["latitude"], depot["longitude"], n_sectors
+        )
+        vehicles = np.array_split(np.arange(group_routes.shape[0]), n_sectors)
+        for sector in range(n_sectors):
+            partitions.append(
+                (
+                    group_routes.iloc[vehicles[sector]],
+                    group_stops.loc[sectors == sector],
+                )
+            )
+    return partitions
+
+
+def solve_partition(route_df, stops_df, matrix, nb_threads):
+    """Only takes plain data so that it can be run in a worker process."""
+    return multi_start.solve_problem(
+        route_df, stops_df, matrix, "decomposed_partition", max_threads=nb_threads
+    )
+
+
+def solve_partitions(partitions, matrix) -> list:
+    """Solve the (routes, stops) partitions concurrently, in the route solver pool. Each
+    partition is sent with its locations re-indexed and its own matrices."""
+    subproblems = [
+        multi_start.local_problem(route_df, stops_df, matrix)
+        for route_df, stops_df in partitions
+    ]
+    n_workers, nb_threads = solve_vroom_object.split_threads(len(subproblems))
+    logging.info(
+        "Solving %i partitions with %i workers and %i threads each",
+        len(subproblems),
+        n_workers,
+        nb_threads,
+    )
+    if n_workers == 1:
+        solutions = [
+            solve_partition(*subproblem[:3], nb_threads) for subproblem in subproblems
+        ]
+    else:
+        pool = solve_vroom_object.get_pool()
+        try:
+            futures = [
+                pool.submit(solve_partition, *subproblem[:3], nb_threads)
+                for subproblem in subproblems
+            ]
+            solutions = [future.result() for future in futures]
+        except BrokenProcessPool:
+            logging.warning("Route solver pool stopped, solving partitions one by one")
+            solve_vroom_object.reset_pool()
+            solutions = [
+                solve_partition(*subproblem[:3], nb_threads)
+                for subproblem in subproblems
+            ]
+    return [
+        multi_start.global_solution(solution, locations)
+        for solution, (_, _, _, locations) in zip(solutions, subproblems)
+    ]
+
+
+def boundary_partitions(stops_df, stop_partition, matrix, profile) -> np.ndarray:
+    """Partition that each stop is on the boundary with, -1 if it is not."""
+    stop_index = stops_df["location_index"].to_numpy(dtype=int)
+    n_partitions = stop_partition.max() + 1
+    nearest = np.full((stop_index.shape[0], n_partitions), np.inf)
+    for partition in range(n_partitions):
+        members = np.flatnonzero(stop_partition == partition)
+        times = profile_matrix.lookup(
+            matrix[profile], "time_matrix", stop_index[:, None], stop_index[members]
+        ).astype(float)
+        times[members, np.arange(members.shape[0])] = np.nan  # not to itself
+        times = np.where(np.isnan(times), np.inf, times)
+        nearest[:, partition] = times.min(axis=1, initial=np.inf)
+    own = nearest[np.arange(stop_index.shape[0]), stop_partition]
+    nearest[np.arange(stop_index.shape[0]), stop_partition] = np.inf
+    neighbour = np.argmin(nearest, axis=1)
+    on_boundary = nearest[np.arange(stop_index.shape[0]), neighbour] <= (
+        BOUNDARY_FACTOR * own
+    )
+    return np.where(on_boundary & np.isfinite(own), neighbour, -1)
+
+
+def repair_pairs(stop_partition, neighbour) -> list:
+    """Pairs of partitions with the most boundary stops between them, each partition in
+    at most one pair so that the pairs can be repaired independently."""
+    boundary = neighbour >= 0
+    pairs = pd.Series(
+        list(
+            zip(
+                np.minimum(stop_partition, neighbour)[boundary],
+                np.maximum(stop_partition, neighbour)[boundary],
+            )
+        ),
+        dtype=object,
+    ).value_counts(sort=True)
+    selected = []
+    used = set()
+    for pair in pairs.index:
+        if used.isdisjoint(pair):
+            selected.append(pair)
+            used.update(pair)
+    return selected
+
+
+def served_location_index(routes: pd.DataFrame) -> np.ndarray:
+    steps = routes.loc[routes["type"].isin(SERVICE_STEP_TYPES)]
+    return steps["id"].astype(int).to_numpy()
+
+
+def route_cost(routes: pd.DataFrame) -> int:
+    """Travel duration of the routes, which is VROOM's cost."""
+    if routes.shape[0] == 0:
+        return 0
+    return int(routes.groupby("vehicle_id")["duration"].max().sum())
+
+
+def repair_boundaries(partitions, solutions, stops_df, matrix, profile):
+    """Solve the boundary routes of neighbouring partitions together, keeping the new
+    routes when they leave fewer stops unassigned or cost less."""
+    stop_partition = np.empty(stops_df.shape[0], dtype=int)
+    stop_position = pd.Series(np.arange(stops_df.shape[0]), index=stops_df.index)
+    for partition, (_, partition_stops) in enumerate(partitions):
+        stop_partition[stop_position[partition_stops.index]] = partition
+    neighbour = boundary_partitions(stops_df, stop_partition, matrix, profile)
+    repairs = []
+    for first, second in repair_pairs(stop_partition, neighbour):
+        pair = [first, second]
+        boundary_index = stops_df["location_index"].to_numpy(dtype=int)[
+            np.isin(stop_partition, pair) & np.isin(neighbour, pair)
+        ]
+        pair_routes = pd.concat([solutions[partition].routes for partition in pair])
+        vehicles = pair_routes.loc[
+            pair_routes["type"].isin(SERVICE_STEP_TYPES)
+            & pair_routes["id"].isin(boundary_index),
+            "vehicle_id",
+        ].unique()
+        if vehicles.shape[0] == 0:
+            continue
+        repair_routes = pair_routes.loc[pair_routes["vehicle_id"].isin(vehicles)]
+        pair_stops = pd.concat([partitions[partition][1] for partition in pair])
+        served = served_location_index(pair_routes)
+        repair_stops = pair_stops.loc[
+            pair_stops["location_index"].isin(served_location_index(repair_routes))
+            | ~pair_stops["location_index"].isin(served)
+        ]
+        route_df = pd.concat([partitions[partition][0] for partition in pair])
+        route_df = route_df.loc[route_df["route_index"].isin(vehicles)]
+        repairs.append((pair, vehicles, route_df, repair_stops))
+    if not repairs:
+        return solutions, 0
+    repaired = solve_partitions(
+        [(route_df, repair_stops) for _, _, route_df, repair_stops in repairs], matrix
+    )
+    unassigned_change = 0
+    for (pair, vehicles, _, _), solution in zip(repairs, repaired):
+        previous = [solutions[partition] for partition in pair]
+        previous_routes = pd.concat([solution.routes for solution in previous])
+        previous_unassigned = sum(solution.summary.unassigned for solution in previous)
+        previous_cost = route_cost(
+            previous_routes.loc[previous_routes["vehicle_id"].isin(vehicles)]
+        )
+        if (solution.summary.unassigned, route_cost(solution.routes)) >= (
+            previous_unassigned,
+            previous_cost,
+        ):
+            continue
+        logging.info(
+            f"Repaired the boundary of partitions {pair}: cost {previous_cost} to "
+            f"{route_cost(solution.routes)}, unassigned {previous_unassigned} to "
+            f"{solution.summary.unassigned}"
+        )
+        unassigned_change += solution.summary.unassigned - previous_unassigned
+        for partition, partition_solution in zip(pair, previous):
+            kept = partition_solution.routes.loc[
+                ~partition_solution.routes["vehicle_id"].isin(vehicles)
+            ]
+            solutions[partition] = multi_start.CandidateSolution(kept, 0, 0)
+        solutions[pair[0]].routes = pd.concat(
+            [solutions[pair[0]].routes, solution.routes]
+        )
+    return solutions, unassigned_change
+
+
+def solve_decomposed(locations, unassigned_stops, unassigned_routes, matrix):
+    """Solve the problem by partition and repair the partition boundaries.
+
+    Returns:
+        the solution and a data-frame with the cost and unassigned jobs of the
+        partitions, and of the solution after repairing their boundaries
+    """
+    partitions = partition_problem(unassigned_routes, unassigned_stops, matrix)
+    solutions = solve_partitions(partitions, matrix)
+    partition_cost = sum(route_cost(solution.routes) for solution in solutions)
+    unassigned = sum(solution.summary.unassigned for solution in solutions)
+    logging.info(
+        f"Solved {len(partitions)} partitions of "
+        f"{[stops.shape[0] for _, stops in partitions]} stops, cost "
+        f"{partition_cost} with {unassigned} unassigned"
+    )
+    profile = unassigned_routes["profile"].mode().iloc[0]
+    solutions, unassigned_change = repair_boundaries(
+        partitions, solutions, unassigned_stops, matrix, profile
+    )
+    routes = pd.concat([solution.routes for solution in solutions])
+    routes = routes.sort_values("vehicle_id", kind="stable").reset_index(drop=True)
+    solution = multi_start.CandidateSolution(
+        routes, route_cost(routes), unassigned + unassigned_change
+    )
+    logging.info(
+        f"Repaired the partition boundaries, cost {solution.summary.cost} with "
+        f"{solution.summary.unassigned} unassigned"
+    )
+    statistics = pd.DataFrame(
+        {
+            "stage": ["partitions", "repaired"],
+            "n_partitions": len(partitions),
+            "cost": [partition_cost, solution.summary.cost],
+            "unassigned": [unassigned, solution.summary.unassigned],
+        }
+    )
+    return solution, statistics
@@ -0,0 +1,222 @@
+"""
+Hybrid Genetic Search (HGS-CVRP) backend, through `hygese`, for single-depot vans.
+
+HGS solves the capacitated vehicle routing problem with a route duration limit, but not
+time windows, skills, shipments, stop limits or vehicles of different capacities. It is
+therefore only used when all vehicles share a depot and profile, and no stop needs
+skills, and it plans with the smallest vehicle capacity. Stops that end up late, or
+beyond a vehicle's stop limit, are moved to the cheapest route where they fit, or left
+unassigned as VROOM would. Routes are returned in VROOM's `solution.routes` format.
+"""
+import logging
+from typing import List
+
+import hygese
+import numpy as np
+import pandas as pd
+
+from app_vukwm_bag_delivery.models.vroom_wrappers import (
+    generate_vroom_object,
+    multi_start,
+    warm_start,
+)
+
+HGS_PROFILES = ["auto"]
+HGS_TIME_LIMIT_SECONDS = 10
+HGS_SEED = 0
+AMOUNT_SCALE = 1000  # as the VROOM delivery amounts
+
+
+def check_hgs_problem(
+    locations: pd.DataFrame, route_df: pd.DataFrame, stops_df: pd.DataFrame
+) -> bool:
+    """Check that the problem is a single-depot van problem without skills."""
+    if route_df.shape[0] == 0 or stops_df.shape[0] == 0:
+        return False
+    if not route_df["profile"].isin(HGS_PROFILES).all():
+        return False
+    stop_skills = generate_vroom_object.parse_unique_values(
+        stops_df["skills"], generate_vroom_object.parse_stop_skills
+    )
+    if any(stop_skills):
+        return False
+    depots = (
+        locations.set_index("location_index")
+        .loc[route_df["location_index"], ["latitude", "longitude"]]
+        .round(6)
+        .drop_duplicates()
+    )
+    return depots.shape[0] == 1
+
+
+def route_fits(route, evaluator, demands, capacity, sequence: List[int]) -> bool:
+    return (
+        len(sequence) <= route["max_stops"]
+        and demands[sequence].sum() <= capacity
+        and evaluator.evaluate(sequence)[0] <= 0
+    )
+
+
+def remove_infeasible_stops(route, evaluator, demands, capacity, sequence):
+    """Remove the first late stop, or the last stop when the route ends late or is
+    over its limits, until the route fits. Returns the route and the removed stops."""
+    sequence = list(sequence)
+    removed = []
+    while sequence and not route_fits(route, evaluator, demands, capacity, sequence):
+        schedule = evaluator.schedule(sequence, evaluator.shift_start).iloc[1:-1]
+        late = schedule["arrival"].to_numpy() > np.array(
+            [evaluator.time_window_end[node] for node in sequence]
+        )
+        position = int(np.argmax(late)) if late.any() else len(sequence) - 1
+        removed.append(sequence.pop(position))
+    return sequence, removed
+
+
+def insert_stops(routes, evaluators, demands, capacities, sequences, nodes):
+    """Insert each stop where it adds the least travel time to a route it fits in.
+    Returns the stops that fit in no route."""
+    unassigned = []
+    for node in nodes:
+        best = None
+        for i, (route, (evaluator, _)) in enumerate(zip(routes, evaluators)):
+            travel = evaluator.evaluate(sequences[i])[1]
+            for position in range(len(sequences[i]) + 1):
+                candidate = sequences[i][:position] + [node] + sequences[i][position:]
+                if not route_fits(route, evaluator, demands, capacities[i], candidate):
+                    continue
+                added = evaluator.evaluate(candidate)[1] - travel
+                if best is None or added < best[0]:
+                    best = (added, i, candidate)
+        if best is None:
+            unassigned.append(node)
+        else:
+            sequences[best[1]] = best[2]
+    return unassigned
+
+
+def assign_vehicles(routes: pd.DataFrame, evaluator, hgs_routes):
+    """Give the longest HGS routes, by travel and service time, to the vehicles with
+    the longest shifts. Returns the sequence per vehicle and the stops of the HGS routes
+    left over when HGS needed more routes than there are vehicles."""
+    route_durations = [
+        evaluator.evaluate(sequence)[1] + sum(evaluator.service[n] for n in sequence)
+        for sequence in hgs_routes
+    ]
+    shift_order = np.argsort(
+        -(routes["time_window_end_seconds"] - routes["time_window_start_seconds"]),
+        kind="stable",
+    )
+    route_order = np.argsort(route_durations, kind="stable")[::-1]
+    sequences = [[] for _ in range(routes.shape[0])]
+    for vehicle, hgs_route in zip(shift_order, route_order):
+        sequences[vehicle] = list(hgs_routes[hgs_route])
+    left_over = [
+        node
+        for hgs_route in route_order[routes.shape[0] :]
+        for node in hgs_routes[hgs_route]
+    ]
+    return sequences, left_over
+
+
+def solve_hgs(
+    locations: pd.DataFrame,
+    stops_df: pd.DataFrame,
+    route_df: pd.DataFrame,
+    matrix: dict,
+    time_limit: float = HGS_TIME_LIMIT_SECONDS,
+) -> multi_start.CandidateSolution:
+    """Solve a problem that passes `check_hgs_problem` with HGS."""
+    routes = generate_vroom_object.add_midnight_seconds_time_windows(route_df)
+    routes = routes.reset_index(drop=True)
+    stops = generate_vroom_object.assign_service_defaults(route_df, stops_df)
+    stops = generate_vroom_object.add_midnight_seconds_time_windows(stops)
+    stops = stops.reset_index(drop=True)
+    evaluators = [
+        warm_start.route_evaluator(route, stops, matrix)
+        for _, route in routes.iterrows()
+    ]
+    evaluator = evaluators[0][0]
+    demands = np.r_[0, (stops["demand"] * AMOUNT_SCALE).round().to_numpy()]
+    capacities = (routes["capacity"].astype(int) * AMOUNT_SCALE).tolist()
+    shift_lengths = (
+        routes["time_window_end_seconds"] - routes["time_window_start_seconds"]
+    )
+    # HGS plans with the smallest capacity and returns no routes at all when a stop
+    # does not fit in it, so such stops are left to the insertion on larger vehicles
+    hgs_nodes = np.r_[0, np.flatnonzero(demands[1:] <= min(capacities)) + 1]
+    oversized = sorted(set(range(1, demands.shape[0])) - set(hgs_nodes))
+    hgs_routes = []
+    if hgs_nodes.shape[0] > 1:
+        # HGS stops the process when the routes cannot carry all stops, and returns no
+        # routes when it finds no feasible packing, so it may plan more routes than
+        # there are vehicles, up to the bins that first-fit packing could need
+        n_hgs_routes = max(
+            routes.shape[0],
+            min(
+                hgs_nodes.shape[0] - 1,
+                2 * int(np.ceil(demands[hgs_nodes].sum() / min(capacities))) + 1,
+            ),
+        )
+        result = hygese.Solver(
+            parameters=hygese.AlgorithmParameters(timeLimit=time_limit, seed=HGS_SEED),
+            verbose=False,
+        ).solve_cvrp(
+            {
+                "distance_matrix": np.array(evaluator.durations, dtype=float)[
+                    np.ix_(hgs_nodes, hgs_nodes)
+                ],
+                "service_times": np.array(evaluator.service, dtype=float)[hgs_nodes],
+                "demands": demands[hgs_nodes],
+                "vehicle_capacity": min(capacities),
+                "num_vehicles": n_hgs_routes,
+                "duration_limit": float(shift_lengths.max()),
+                "depot": 0,
+            },
+            rounding=False,
+        )
+        logging.info(
+            f"HGS found {len(result.routes)} routes with cost {result.cost} in "
+            f"{result.time:.1f} s"
+        )
+        hgs_routes = [hgs_nodes[route].tolist() for route in result.routes]
+
+    sequences, removed = assign_vehicles(routes, evaluator, hgs_routes)
+    removed = oversized + removed
+    for i, (route, (route_evaluator, _)) in enumerate(
+        zip(routes.to_dict("records"), evaluators)
+    ):
+        sequences[i], route_removed = remove_infeasible_stops(
+            route, route_evaluator, demands, capacities[i], sequences[i]
+        )
+        removed.extend(route_removed)
+    insert_stops(
+        routes.to_dict("records"), evaluators, demands, capacities, sequences, removed
+    )
+    # stops in no route, whether HGS left them out or they fit in no route
+    assigned = {node for sequence in sequences for node in sequence}
+    unassigned = [node for node in range(1, demands.shape[0]) if node not in assigned]
+    if removed:
+        logging.info(
+            f"Moved {len(removed) - len(unassigned)} and unassigned "
+            f"{len(unassigned)} stops that HGS routed infeasibly, on extra routes, or "
+            "could not fit in the smallest vehicle"
+        )
+
+    solution_routes = [
+        warm_start.solution_route(route, route_evaluator, route_locations, sequence)
+        for (_, route), (route_evaluator, route_locations), sequence in zip(
+            routes.iterrows(), evaluators, sequences
+        )
+        if sequence
+    ]
+    cost = sum(
+        route_evaluator.evaluate(sequence)[1]
+        for (route_evaluator, _), sequence in zip(evaluators, sequences)
+    )
+    return multi_start.CandidateSolution(
+        pd.concat(solution_routes, ignore_index=True)
+        if solution_routes
+        else pd.DataFrame(),
+        int(round(cost)),
+        len(unassigned),
+    )
@@ -0,0 +1,50 @@
+"""
+Solve a routing problem with VROOM, HGS, or VROOM by partition, in one output format.
+
+The backends take the `locations`, `unassigned_stops` and `unassigned_routes` frames
+and the matrices of a problem, and return a solution with `routes` and a `summary` with
+the `cost` and number of `unassigned` jobs, with routes in VROOM's `solution.routes`
+format, so that `DecodeVroomSolution` and the reporting work with any of them. With the
+solution comes a data-frame with statistics of the solve, or None.
+"""
+import logging
+
+from app_vukwm_bag_delivery.models.solver_backends import decomposition, hgs_backend
+from app_vukwm_bag_delivery.models.vroom_wrappers import multi_start
+
+SOLVER_BACKENDS = ["vroom", "hgs", "decomposed"]
+
+
+def solve_vroom(locations, unassigned_stops, unassigned_routes, matrix):
+    solution = multi_start.solve_problem(
+        unassigned_routes, unassigned_stops, matrix, "vroom_backend"
+    )
+    return solution, None
+
+
+def solve(backend: str, locations, unassigned_stops, unassigned_routes, matrix):
+    """Solve with `backend`. Problems that HGS cannot model are solved with VROOM.
+
+    Returns:
+        the solution, and the statistics of the solve or None
+    """
+    if backend not in SOLVER_BACKENDS:
+        raise ValueError(
+            f"Unknown solver backend {backend}, use one of {SOLVER_BACKENDS}"
+        )
+    if backend == "decomposed":
+        return decomposition.solve_decomposed(
+            locations, unassigned_stops, unassigned_routes, matrix
+        )
+    if backend == "hgs":
+        if hgs_backend.check_hgs_problem(
+            locations, unassigned_routes, unassigned_stops
+        ):
+            solution = hgs_backend.solve_hgs(
+                locations, unassigned_stops, unassigned_routes, matrix
+            )
+            return solution, None
+        logging.info(
+            "HGS only solves single-depot van problems without skills, using VROOM"
+        )
+    return solve_vroom(locations, unassigned_stops, unassigned_routes, matrix)
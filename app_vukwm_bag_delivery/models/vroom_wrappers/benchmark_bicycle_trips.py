@@ -0,0 +1,105 @@
+"""
+Compare the compact bicycle trip model with the shipment model on identical routes.
+
+Run as a module to benchmark synthetic bicycle routes:
+
+    python -m app_vukwm_bag_delivery.models.vroom_wrappers.benchmark_bicycle_trips
+"""
+import time
+
+import pandas as pd
+
+from app_vukwm_bag_delivery.models.solver_backends import benchmark_backends
+from app_vukwm_bag_delivery.models.vroom_wrappers import (
+    bicycle_trips,
+    solve_vroom_object,
+)
+
+BICYCLE_SPEED_METERS_PER_SECOND = 4
+BICYCLE_CAPACITY = 250
+BENCHMARK_SIZES = [30, 60, 120]
+
+
+def synthetic_bicycle_instance(n_stops: int, seed: int = 0) -> dict:
+    """The stops of `benchmark_backends.synthetic_instance` for a single bicycle, which
+    has to return to its depot to replenish several times a day."""
+    instance = benchmark_backends.synthetic_instance(n_stops, 1, seed)
+    routes = instance["unassigned_routes"].assign(
+        route_id="BIKE0",
+        profile="bicycle",
+        skills="1",
+        capacity=BICYCLE_CAPACITY,
+    )
+    matrix = instance["matrix"]["auto"]
+    speed_ratio = (
+        benchmark_backends.BENCHMARK_SPEED_METERS_PER_SECOND
+        / BICYCLE_SPEED_METERS_PER_SECOND
+    )
+    matrix = {
+        "bicycle": {
+            "time_matrix": (matrix["time_matrix"] * speed_ratio).astype(
+                matrix["time_matrix"].dtype
+            ),
+            "distance_matrix": matrix["distance_matrix"],
+        }
+    }
+    return {**instance, "unassigned_routes": routes, "matrix": matrix}
+
+
+def served_stops(routes) -> int:
+    if routes.shape[0] == 0:
+        return 0
+    return routes.loc[routes["type"].isin(["job", "delivery"]), "id"].nunique()
+
+
+def compare_bicycle_models(instances: dict) -> pd.DataFrame:
+    """Solve the bicycle route of each named instance with the compact trip model and
+    with the shipment model.
+
+    Args:
+        instances: problem per name, with `unassigned_stops`, `unassigned_routes` and
+            `matrix`
+
+    Returns:
+        unassigned stops, travel duration and solve time per instance and model
+    """
+    compact_bicycle_trips = bicycle_trips.COMPACT_BICYCLE_TRIPS
+    results = []
+    try:
+        for name, instance in instances.items():
+            stops = instance["unassigned_stops"]
+            for model, compact in [("compact_trips", True), ("shipments", False)]:
+                bicycle_trips.COMPACT_BICYCLE_TRIPS = compact
+                start = time.perf_counter()
+                routes = solve_vroom_object.solve_route(
+                    instance["unassigned_routes"],
+                    stops,
+                    instance["matrix"],
+                    use_warm_start=False,
+                )
+                results.append(
+                    {
+                        "instance": name,
+                        "model": model,
+                        "n_stops": stops.shape[0],
+                        "unassigned": stops.shape[0] - served_stops(routes),
+                        "duration": (
+                            int(routes["duration"].max()) if routes.shape[0] > 0 else 0
+                        ),
+                        "solve_seconds": round(time.perf_counter() - start, 2),
+                    }
+                )
+    finally:
+        bicycle_trips.COMPACT_BICYCLE_TRIPS = compact_bicycle_trips
+    return pd.DataFrame(results)
+
+
+if __name__ == "__main__":
+    print(
+        compare_bicycle_models(
+            {
+                f"{n_stops}_stops": synthetic_bicycle_instance(n_stops)
+                for n_stops in BENCHMARK_SIZES
+            }
+        ).to_string(index=False)
+    )
@@ -0,0 +1,348 @@
+"""
+Compact multi-trip model of the bicycle route.
+
+The shipment model of `generate_vroom_object.add_bicycle_shipment_to_vroom` gives each
+bicycle stop its own depot pickup, which doubles the number of tasks. Here the bicycle
+stops are plain jobs, solved in two phases:
+
+1. Cluster: the stops are split into trips by solving them with one copy of the bicycle
+   per trip, each with the bicycle's capacity and a consecutive slot of its shift.
+2. Sequence: the trips are solved one after the other, each starting once the bicycle
+   is back at the depot and replenished. Stops that no longer fit are carried over to
+   the next trip, and the stops still unserved, in a cluster or not, go to extra trips
+   at the end of the day. Each trip is then solved
+   again with the unassigned stops near it, in the time left around it.
+
+The trips are joined into a route in the format of the shipment model, with a pickup
+step where the bicycle replenishes, so that `DecodeVroomSolution` splits it into trips.
+"""
+import logging
+
+import numpy as np
+import pandas as pd
+from vroom.input import input
+
+from app_vukwm_bag_delivery.models.vroom_wrappers import (
+    generate_vroom_object,
+    profile_matrix,
+    solver_policy,
+)
+
+COMPACT_BICYCLE_TRIPS = True
+# travel between the stops of a trip, as a multiple of the time to the nearest stop
+TRIP_NEIGHBOUR_FACTOR = 2
+FILL_MAX_CANDIDATES = 20  # unassigned stops nearest to a trip, to try to add to it
+PICKUP_ID_OFFSET = 10000  # as the pickups of the shipment model
+
+
+def split_bicycle_problem(route_df, stops_df):
+    """The bicycle route and its stops, and the other routes and stops, when there is a
+    single bicycle route with stops. Otherwise None, to solve the shipment model."""
+    (
+        stops_bicycle,
+        stops_normal,
+        bicycle_route_df,
+        normal_route_df,
+    ) = generate_vroom_object.filter_bicycles(stops_df, route_df)
+    if bicycle_route_df.shape[0] != 1 or stops_bicycle.shape[0] == 0:
+        return None
+    stops_bicycle = generate_vroom_object.assign_service_defaults(
+        bicycle_route_df, stops_bicycle
+    )
+    stops_bicycle = generate_vroom_object.add_midnight_seconds_time_windows(
+        stops_bicycle
+    )
+    bicycle_route = generate_vroom_object.add_midnight_seconds_time_windows(
+        bicycle_route_df
+    ).iloc[0]
+    return bicycle_route, stops_bicycle, normal_route_df, stops_normal
+
+
+def trip_routes(route, time_windows) -> pd.DataFrame:
+    """A copy of the bicycle for each (start, end) time window."""
+    time_windows = np.array(time_windows, dtype=int).reshape(-1, 2)
+    return pd.DataFrame([route] * time_windows.shape[0]).assign(
+        route_index=np.arange(time_windows.shape[0]),
+        time_window_start_seconds=time_windows[:, 0],
+        time_window_end_seconds=time_windows[:, 1],
+    )
+
+
+def trip_input(route, stops_df, matrix, routes):
+    """Jobs of the stops, with the copies of the bicycle in `routes`."""
+    profile = {route["profile"]: matrix[route["profile"]]}
+    node_rows, routes, stops_df = generate_vroom_object.assign_vroom_locations(
+        profile, routes, stops_df
+    )
+    problem_instance = input.Input()
+    problem_instance = generate_vroom_object.add_matrix_profiles(
+        problem_instance, profile, node_rows
+    )
+    problem_instance = generate_vroom_object.add_vehicle_to_vroom(
+        problem_instance, routes
+    )
+    return generate_vroom_object.add_stop_to_vroom(problem_instance, stops_df)
+
+
+def solve_trips(
+    route,
+    stops_df,
+    matrix,
+    time_windows,
+    context,
+    max_threads=None,
+    exploration_level=None,
+) -> pd.DataFrame:
+    """`solution.routes` of the stops, with a copy of the bicycle per time window."""
+    routes = trip_routes(route, time_windows)
+    solution = solver_policy.solve(
+        trip_input(route, stops_df, matrix, routes),
+        context,
+        max_threads=max_threads,
+        exploration_level=exploration_level,
+    )
+    return generate_vroom_object.restore_location_index(solution.routes, routes)
+
+
+def served_stops(solution_routes: pd.DataFrame) -> np.ndarray:
+    jobs = solution_routes.loc[solution_routes["type"] == "job"]
+    return jobs["location_index"].to_numpy(dtype=int)
+
+
+def trip_slots(route, n_trips) -> np.ndarray:
+    """Consecutive (start, end) time windows of the trips over the shift, with the
+    replenishing at the start of each trip after the first."""
+    bounds = np.linspace(
+        route["time_window_start_seconds"],
+        route["time_window_end_seconds"],
+        n_trips + 1,
+    ).round()
+    starts = (
+        bounds[:-1] + np.r_[0, [route["replenish_duration__seconds"]] * (n_trips - 1)]
+    )
+    return np.c_[starts, bounds[1:]].astype(int)
+
+
+def estimate_trips(route, stops_df, matrix) -> int:
+    """Number of trips that fit in the shift, and are needed for the demand and stop
+    limit. A trip goes to and from the depot and visits as many stops as the bicycle
+    can carry, with `TRIP_NEIGHBOUR_FACTOR` times the time to the nearest stop between
+    stops."""
+    stop_index = stops_df["location_index"].to_numpy(dtype=int)
+    depot = int(route["location_index"])
+    route_matrix = matrix[route["profile"]]
+    times = profile_matrix.lookup(
+        route_matrix, "time_matrix", stop_index[:, None], stop_index
+    ).astype(float)
+    np.fill_diagonal(times, np.nan)
+    nearest = np.nanmin(times, axis=1) if stop_index.shape[0] > 1 else np.zeros(1)
+    depot_times = profile_matrix.lookup(
+        route_matrix, "time_matrix", depot, stop_index
+    ) + profile_matrix.lookup(route_matrix, "time_matrix", stop_index, depot)
+    stops_per_trip = min(
+        route["max_stops"],
+        route["capacity"] / max(stops_df["demand"].mean(), 1e-9),
+        stop_index.shape[0],
+    )
+    trip_duration = (
+        np.nanmean(depot_times)
+        + stops_per_trip
+        * (
+            stops_df["service_duration__seconds"].mean()
+            + TRIP_NEIGHBOUR_FACTOR * np.nanmean(nearest)
+        )
+        + route["replenish_duration__seconds"]
+    )
+    shift = route["time_window_end_seconds"] - route["time_window_start_seconds"]
+    needed = max(
+        np.ceil(stops_df["demand"].sum() / route["capacity"]),
+        np.ceil(stop_index.shape[0] / route["max_stops"]),
+    )
+    return int(max(min(shift // trip_duration, needed), 1))
+
+
+def cluster_trips(route, stops_df, matrix, max_threads=None, exploration_level=None):
+    """Location indices of the stops of each trip, and the end of each trip's slot.
+
+    The trips get consecutive slots of the shift, so that they can follow each other."""
+    n_trips = estimate_trips(route, stops_df, matrix)
+    slots = trip_slots(route, n_trips)
+    routes = solve_trips(
+        route,
+        stops_df,
+        matrix,
+        slots,
+        "bicycle_clusters",
+        max_threads,
+        exploration_level,
+    )
+    trips = routes.groupby("vehicle_id")
+    return [
+        (served_stops(trips.get_group(trip)), slots[trip, 1])
+        for trip in sorted(trips.groups)
+    ]
+
+
+def sequence_trips(
+    route, stops_df, matrix, clusters, max_threads=None, exploration_level=None
+):
+    """Solve the trips one after the other, each from the end of the previous trip to
+    the end of its slot, or of the shift for the last trip.
+
+    Returns:
+        the `solution.routes` frame of each trip, and the stops left unassigned
+    """
+    shift_end = route["time_window_end_seconds"]
+    ready = route["time_window_start_seconds"]
+    clusters = list(clusters)
+    carried = stops_df.iloc[:0]
+    trips = []
+    while ready < shift_end:
+        if clusters:
+            cluster, slot_end = clusters.pop(0)
+            trip_stops = pd.concat(
+                [carried, stops_df.loc[stops_df["location_index"].isin(cluster)]]
+            )
+        else:
+            # extra trips take every stop not yet served, including those of no cluster
+            trip_stops = stops_df.loc[
+                ~stops_df["location_index"].isin(
+                    np.concatenate([served_stops(trip) for trip in trips] + [[]])
+                )
+            ]
+            if trip_stops.shape[0] == 0:
+                break
+        end = slot_end if clusters else shift_end
+        trip = solve_trips(
+            route,
+            trip_stops,
+            matrix,
+            [(ready, max(end, ready))],
+            "bicycle_trip",
+            max_threads,
+            exploration_level,
+        )
+        served = served_stops(trip)
+        carried = trip_stops.loc[~trip_stops["location_index"].isin(served)]
+        if served.shape[0] == 0:
+            if not clusters:
+                break
+            continue
+        trips.append(trip)
+        ready = trip["arrival"].iloc[-1] + route["replenish_duration__seconds"]
+    assigned = np.concatenate([served_stops(trip) for trip in trips] + [[]])
+    unassigned = stops_df.loc[~stops_df["location_index"].isin(assigned)]
+    return trips, unassigned
+
+
+def fill_trips(
+    route, stops_df, matrix, trips, max_threads=None, exploration_level=None
+):
+    """Solve each trip again with the unassigned stops nearest to it, between the end of
+    the previous trip and the start of the next, keeping it when it serves more stops.
+
+    Returns:
+        the trips and the stops left unassigned
+    """
+    trips = list(trips)
+    for i, trip in enumerate(trips):
+        assigned = np.concatenate([served_stops(trip) for trip in trips])
+        unassigned = stops_df.loc[~stops_df["location_index"].isin(assigned)]
+        if unassigned.shape[0] == 0:
+            break
+        start = route["time_window_start_seconds"]
+        if i > 0:
+            start = (
+                trips[i - 1]["arrival"].iloc[-1] + route["replenish_duration__seconds"]
+            )
+        end = route["time_window_end_seconds"]
+        if i < len(trips) - 1:
+            end = trips[i + 1]["arrival"].iloc[0] - route["replenish_duration__seconds"]
+        trip_index = served_stops(trip)
+        nearest = profile_matrix.lookup(
+            matrix[route["profile"]],
+            "time_matrix",
+            trip_index[:, None],
+            unassigned["location_index"].to_numpy(dtype=int),
+        ).min(axis=0)
+        candidates = unassigned.iloc[
+            np.argsort(nearest, kind="stable")[:FILL_MAX_CANDIDATES]
+        ]
+        trip_stops = pd.concat(
+            [stops_df.loc[stops_df["location_index"].isin(trip_index)], candidates]
+        )
+        filled = solve_trips(
+            route,
+            trip_stops,
+            matrix,
+            [(start, max(end, start))],
+            "bicycle_fill",
+            max_threads,
+            exploration_level,
+        )
+        if served_stops(filled).shape[0] > served_stops(trip).shape[0]:
+            trips[i] = filled
+    assigned = np.concatenate([served_stops(trip) for trip in trips] + [[]])
+    return trips, stops_df.loc[~stops_df["location_index"].isin(assigned)]
+
+
+def join_trips(route, trips) -> pd.DataFrame:
+    """Route of the trips, with a replenishing pickup step between trips."""
+    steps = []
+    travel = 0
+    returned = None
+    for i, trip in enumerate(trips):
+        trip = trip.assign(
+            vehicle_id=route["route_index"],
+            duration=trip["duration"] + travel,
+            type=trip["type"].astype(str).replace({"job": "delivery"}),
+        )
+        if i > 0:
+            # the bicycle waits at the depot from its return until it replenishes for
+            # the next trip
+            replenish = int(route["replenish_duration__seconds"])
+            waiting = max(trip["arrival"].iloc[0] - replenish - returned, 0)
+            pickup = trip.columns.get_indexer(
+                ["type", "arrival", "waiting_time", "setup", "id"]
+            )
+            trip.iloc[0, pickup] = [
+                "pickup",
+                returned,
+                waiting,
+                replenish,
+                PICKUP_ID_OFFSET + trip["location_index"].iloc[1],
+            ]
+        travel = trip["duration"].iloc[-1]
+        returned = trip["arrival"].iloc[-1]
+        if i < len(trips) - 1:
+            trip = trip.iloc[:-1]  # the next trip's pickup is back at the depot
+        steps.append(trip)
+    routes = pd.concat(steps, ignore_index=True)
+    return routes.assign(type=routes["type"].astype("category"))
+
+
+def solve_bicycle_trips(
+    route, stops_df, matrix, max_threads=None, exploration_level=None
+):
+    """Solve the bicycle route with the compact trip model.
+
+    Returns:
+        the `solution.routes` frame of the bicycle, its travel duration and the number
+        of unassigned stops
+    """
+    clusters = cluster_trips(route, stops_df, matrix, max_threads, exploration_level)
+    trips, unassigned = sequence_trips(
+        route, stops_df, matrix, clusters, max_threads, exploration_level
+    )
+    trips, unassigned = fill_trips(
+        route, stops_df, matrix, trips, max_threads, exploration_level
+    )
+    logging.info(
+        f"Bicycle route {route['route_id']}: {len(trips)} trips from "
+        f"{len(clusters)} clusters, {unassigned.shape[0]} of {stops_df.shape[0]} "
+        "stops unassigned"
+    )
+    if not trips:
+        return pd.DataFrame(), 0, unassigned.shape[0]
+    routes = join_trips(route, trips)
+    return routes, int(routes["duration"].iloc[-1]), unassigned.shape[0]
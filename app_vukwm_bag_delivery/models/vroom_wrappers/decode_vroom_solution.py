@@ -12,6 +12,8 @@ from shapely import wkt
 sys.path.insert(0, ".")
 
 import app_vukwm_bag_delivery.models.osrm_wrappers.osrm_get_routes as osrm_get_routes
+import app_vukwm_bag_delivery.time_utils as time_utils
+from app_vukwm_bag_delivery.models.vroom_wrappers import profile_matrix
 
 VROOM_ROUTES_MAPPING_OLD_TO_NEW = {
     "vehicle_id": "route_index",
@@ -109,16 +111,13 @@ def convert_solution_routes(
 def calc_times(
     assigned_stops: pd.DataFrame,
     time_horizon_start: str = "00:00:00",
-    output_format: str = "%H:%M:%S",
 ) -> pd.DataFrame:
     """Calc formatted arrival, service start times and departure times."""
 
     def hms_from_seconds(seconds_series):
-        return (
-            time_horizon_dt + pd.to_timedelta(seconds_series, unit="s")
-        ).dt.strftime(output_format)
+        return time_utils.seconds_to_hms(time_horizon_seconds + seconds_series)
 
-    time_horizon_dt = pd.to_datetime(time_horizon_start)
+    time_horizon_seconds = time_utils.hms_to_seconds([time_horizon_start])[0]
     arrival_time__seconds = assigned_stops["arrival_time__seconds"]
     service_start_time__seconds = (
         arrival_time__seconds + assigned_stops["waiting_duration__seconds"]
@@ -255,42 +254,38 @@ class DecodeVroomSolution:
         ]
 
     def add_matrix_info(self):
-        route_ids = self.assigned_stops["route_id"].unique()
-        routes_kpis = []
-        for route_id in route_ids:
-            stops = self.assigned_stops.loc[
-                self.assigned_stops["route_id"] == route_id
-            ].copy()
-            profile = stops["profile"].unique()
-            assert len(profile) == 1
-            profile = profile[0]
-            time_matrix = self.matrix[profile]["time_matrix"]
-            distance_matrix = self.matrix[profile]["distance_matrix"]
-
-            location_index = stops["location_index"].values
-
-            travel_times = [
-                time_matrix[location_index[i - 1], location_index[i]]
-                for i in range(1, location_index.shape[0])
-            ]
-            travel_times.insert(0, 0)
+        """Add travel duration, distance and speed from the previous stop in the route."""
+        stops = self.assigned_stops
+        route_order = pd.factorize(stops["route_id"])[0]
+        if (np.diff(route_order) < 0).any():
+            stops = stops.take(np.argsort(route_order, kind="stable"))
+        assert (stops.groupby("route_id")["profile"].nunique() <= 1).all()
+
+        location_index = stops["location_index"].to_numpy(dtype=int)
+        previous_index = stops.groupby("route_id")["location_index"].shift(1)
+        has_previous = previous_index.notna().to_numpy()
+        previous_index = previous_index.fillna(0).to_numpy(dtype=int)
+        profiles = stops["profile"].to_numpy()
+
+        travel_times = np.zeros(stops.shape[0])
+        travel_distances = np.zeros(stops.shape[0])
+        for profile in pd.unique(profiles):
+            legs = has_previous & (profiles == profile)
+            leg_from = previous_index[legs]
+            leg_to = location_index[legs]
+            travel_times[legs] = profile_matrix.lookup(
+                self.matrix[profile], "time_matrix", leg_from, leg_to
+            )
+            travel_distances[legs] = profile_matrix.lookup(
+                self.matrix[profile], "distance_matrix", leg_from, leg_to
+            )
 
-            travel_distances = [
-                distance_matrix[location_index[i - 1], location_index[i]]
-                for i in range(1, location_index.shape[0])
-            ]
-            travel_distances.insert(0, 0)
-
-            stops["travel_duration_to_stop__seconds"] = travel_times
-            stops["travel_distance_to_stop__meters"] = travel_distances
-            routes_kpis.append(stops)
-        routes_kpis = pd.concat(routes_kpis)
-        routes_kpis["travel_speed__kmh"] = (
-            routes_kpis["travel_distance_to_stop__meters"]
-            / routes_kpis["travel_duration_to_stop__seconds"]
-            * 3.6
-        ).fillna(0)
-        self.assigned_stops = routes_kpis
+        with np.errstate(divide="ignore", invalid="ignore"):
+            travel_speed = travel_distances / travel_times * 3.6
+        stops["travel_duration_to_stop__seconds"] = travel_times
+        stops["travel_distance_to_stop__meters"] = travel_distances
+        stops["travel_speed__kmh"] = np.where(np.isnan(travel_speed), 0, travel_speed)
+        self.assigned_stops = stops
 
     def get_geo_info(self):
         travel_path_info = osrm_get_routes.return_route_osrm_info(
@@ -348,9 +343,10 @@ class DecodeVroomSolution:
 
     def assign_service_issues(self):
         early_flag = self.assigned_stops["waiting_duration__seconds"].fillna(0) > 0
-        late_flag = pd.to_datetime(
-            self.assigned_stops["arrival_time"]
-        ) > pd.to_datetime(self.assigned_stops["time_window_end"])
+        time_window_end = time_utils.hms_to_seconds(
+            self.assigned_stops["time_window_end"]
+        )
+        late_flag = self.assigned_stops["arrival_time__seconds"] > time_window_end
         self.assigned_stops = self.assigned_stops.assign(service_issue="ON-TIME")
         self.assigned_stops.loc[early_flag, "service_issue"] = "EARLY"
         self.assigned_stops.loc[late_flag, "service_issue"] = "LATE"
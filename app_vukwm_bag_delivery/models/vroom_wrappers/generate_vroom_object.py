@@ -6,58 +6,158 @@ import streamlit as st
 import vroom
 from vroom.input import input
 
+import app_vukwm_bag_delivery.time_utils as time_utils
+from app_vukwm_bag_delivery.models.vroom_wrappers import profile_matrix
+
 problem_instance = input.Input()
 
 PICKUP_DEFAULT = 1800  # 15min
 
 
-def add_matrix_profiles(vroom_model, matrix):
-    for profile in matrix:
+def add_matrix_profiles(vroom_model, matrix, node_rows):
+    """Time matrix of each profile between the nodes of `assign_vroom_locations`."""
+    for i, profile in enumerate(matrix):
         vroom_model.set_durations_matrix(
-            profile=profile, matrix_input=matrix[profile]["time_matrix"]
+            profile=profile,
+            matrix_input=profile_matrix.node_matrix(
+                matrix[profile], "time_matrix", node_rows[:, i]
+            ),
         )
     return vroom_model
 
 
+def assign_vroom_locations(matrix, route_df, stops_df):
+    """Matrix nodes of the problem's depots and stops, see `profile_matrix.shared_nodes`,
+    and the routes and stops with the node of their location as `vroom_location`, so
+    that VROOM gets the matrices of these locations only.
+
+    Returns:
+        the row of each node in each profile's matrix, and the routes and stops
+    """
+    node_rows, location_nodes = profile_matrix.shared_nodes(
+        matrix,
+        np.r_[
+            route_df["location_index"].to_numpy(dtype=int),
+            stops_df["location_index"].to_numpy(dtype=int),
+        ],
+    )
+    route_df = route_df.assign(
+        vroom_location=location_nodes[route_df["location_index"].to_numpy(dtype=int)]
+    )
+    stops_df = stops_df.assign(
+        vroom_location=location_nodes[stops_df["location_index"].to_numpy(dtype=int)]
+    )
+    return node_rows, route_df, stops_df
+
+
+def restore_location_index(solution_routes: pd.DataFrame, route_df) -> pd.DataFrame:
+    """`solution.routes` with the global location index of each step in place of its
+    VROOM location: the id of jobs and deliveries, and the depot of the vehicle for the
+    other steps, as the bicycle also picks up at its depot."""
+    if solution_routes.shape[0] == 0:
+        return solution_routes
+    depots = route_df.set_index("route_index")["location_index"]
+    served = solution_routes["type"].isin(["job", "delivery"]).to_numpy()
+    location_index = np.where(
+        served,
+        solution_routes["id"].fillna(-1).to_numpy(dtype=int),
+        depots.reindex(solution_routes["vehicle_id"]).to_numpy(dtype=int),
+    )
+    return solution_routes.assign(location_index=location_index)
+
+
 def add_midnight_seconds_time_windows(df):
-    time_start = pd.to_datetime(df["time_window_start"])
-    time_end = pd.to_datetime(df["time_window_end"])
+    time_start = time_utils.hms_to_seconds(df["time_window_start"])
+    time_end = time_utils.hms_to_seconds(df["time_window_end"])
     df = df.assign(
-        time_window_start_seconds=(
-            (time_start - time_start.dt.normalize()) / pd.Timedelta("1 second")
-        ).astype(int),
-        time_window_end_seconds=(
-            (time_end - time_end.dt.normalize()) / pd.Timedelta("1 second")
-        ).astype(int),
+        time_window_start_seconds=time_start.astype(int),
+        time_window_end_seconds=time_end.astype(int),
     )
     return df
 
 
+def parse_vehicle_skills(skills):
+    if pd.isna(skills):
+        return None
+    return {int(x) for x in skills.split(",")}
+
+
+def parse_stop_skills(skills):
+    if pd.isna(skills):
+        return None
+    return set([int(skills)])
+
+
+def parse_unique_values(values: pd.Series, parser) -> list:
+    """Parse each unique value once, e.g. skills that repeat for most stops."""
+    codes, uniques = pd.factorize(values)
+    # missing values have code -1, which indexes the parsed missing value at the end
+    parsed = [parser(value) for value in uniques] + [parser(np.nan)]
+    return [parsed[code] for code in codes]
+
+
+def profile_location_indices(route_df, stops_df) -> dict:
+    """Location indices that the vehicles of each profile can visit: all depots, as
+    these are also the pickup locations of shipments, and the stops whose skills are
+    held by one of the profile's vehicles."""
+    depots = route_df["location_index"].to_numpy(dtype=int)
+    stop_index = stops_df["location_index"].to_numpy(dtype=int)
+    stop_skills = parse_unique_values(stops_df["skills"], parse_stop_skills)
+    locations = {}
+    for profile, profile_routes in route_df.groupby("profile"):
+        vehicle_skills = [
+            skills or set()
+            for skills in parse_unique_values(
+                profile_routes["skills"], parse_vehicle_skills
+            )
+        ]
+        visitable = [
+            skills is None or any(skills <= vehicle for vehicle in vehicle_skills)
+            for skills in stop_skills
+        ]
+        locations[profile] = np.union1d(
+            depots, stop_index[np.array(visitable, dtype=bool)]
+        )
+    return locations
+
+
 def add_vehicle_to_vroom(vroom_object, route_df):
     route_df["capacity"] = route_df["capacity"].astype(int)
-    for i, route in route_df.iterrows():
-        if pd.isna(route["skills"]):
-            skills = None
-        else:
-            skills = route["skills"].split(",")
-            skills = {int(x) for x in skills}
-        vroom_object.add_vehicle(
-            [
-                vroom.vehicle.Vehicle(
-                    route["route_index"],
-                    start=route["location_index"],
-                    end=route["location_index"],
-                    description=route["route_id"],
-                    capacity=[route["capacity"] * 1000, route["max_stops"]],
-                    profile=route["profile"],
-                    skills=skills,
-                    time_window=vroom.time_window.TimeWindow(
-                        route["time_window_start_seconds"],
-                        route["time_window_end_seconds"],
-                    ),
-                )
-            ]
+    skills = parse_unique_values(route_df["skills"], parse_vehicle_skills)
+    vehicles = [
+        vroom.vehicle.Vehicle(
+            route_index,
+            start=vroom_location,
+            end=vroom_location,
+            description=route_id,
+            capacity=[capacity * 1000, max_stops],
+            profile=profile,
+            skills=skill,
+            time_window=vroom.time_window.TimeWindow(tw_start, tw_end),
+        )
+        for (
+            route_index,
+            vroom_location,
+            route_id,
+            capacity,
+            max_stops,
+            profile,
+            skill,
+            tw_start,
+            tw_end,
+        ) in zip(
+            route_df["route_index"].tolist(),
+            route_df["vroom_location"].tolist(),
+            route_df["route_id"].tolist(),
+            route_df["capacity"].tolist(),
+            route_df["max_stops"].tolist(),
+            route_df["profile"].tolist(),
+            skills,
+            route_df["time_window_start_seconds"].tolist(),
+            route_df["time_window_end_seconds"].tolist(),
         )
+    ]
+    vroom_object.add_vehicle(vehicles)
     return vroom_object
 
 
@@ -68,28 +168,38 @@ def add_vehicles(vroom_object, route_df):
 
 
 def add_stop_to_vroom(vroom_object, stop_df):
-    for i, stop in stop_df.iterrows():
-        if pd.isna(stop["skills"]):
-            skill = None
-        else:
-            skill = set([int(stop["skills"])])
-        vroom_object.add_job(
-            [
-                vroom.job.Job(
-                    stop["location_index"],
-                    location=stop["location_index"],
-                    skills=skill,
-                    delivery=[round(stop["demand"] * 1000), 1],
-                    service=stop["service_duration__seconds"],
-                    time_windows=[
-                        vroom.time_window.TimeWindow(
-                            stop["time_window_start_seconds"],
-                            stop["time_window_end_seconds"],
-                        )  # note that a stop can have multiple time-windows when it has a schedule, for example, between 09:00 and 10:00 or between 12:00 and 15:00
-                    ],
-                )
-            ]
+    skills = parse_unique_values(stop_df["skills"], parse_stop_skills)
+    jobs = [
+        vroom.job.Job(
+            location_index,
+            location=vroom_location,
+            skills=skill,
+            delivery=[round(demand * 1000), 1],
+            service=service,
+            time_windows=[
+                vroom.time_window.TimeWindow(tw_start, tw_end)
+            ],  # note that a stop can have multiple time-windows when it has a schedule, for example, between 09:00 and 10:00 or between 12:00 and 15:00
         )
+        for (
+            location_index,
+            vroom_location,
+            skill,
+            demand,
+            service,
+            tw_start,
+            tw_end,
+        ) in zip(
+            stop_df["location_index"].tolist(),
+            stop_df["vroom_location"].tolist(),
+            skills,
+            stop_df["demand"].tolist(),
+            stop_df["service_duration__seconds"].tolist(),
+            stop_df["time_window_start_seconds"].tolist(),
+            stop_df["time_window_end_seconds"].tolist(),
+        )
+    ]
+    if jobs:
+        vroom_object.add_job(jobs)
     return vroom_object
 
 
@@ -98,7 +208,7 @@ def generate_pickup_shipment(pickup_stop_df):
         logging.warning("Shipments can only involve one pickup stop, not multiple.")
     stop = pickup_stop_df.iloc[0]
     pickup_stop = {
-        "location": stop["location_index"],
+        "location": stop["vroom_location"],
         "setup": stop["replenish_duration__seconds"],
         "service": 0,
         "time_windows": [
@@ -111,43 +221,44 @@ def generate_pickup_shipment(pickup_stop_df):
     return pickup_stop
 
 
-def generate_delivery_shipment(stop):
-    delivery_stop = {
-        "id": stop["location_index"],
-        "location": stop["location_index"],
-        "service": stop["service_duration__seconds"],
-        "time_windows": [
-            vroom.time_window.TimeWindow(
-                int(stop["time_window_start_seconds"]),
-                int(stop["time_window_end_seconds"]),
-            )
-        ],
-    }
-    return delivery_stop
-
-
 def add_bicycle_shipment_to_vroom(vroom_object, deliver_stop_df, pickup_stops_df):
     """Assume that all these stops have to be picked-up from the same bicycle location."""
     master_pickup_stop = generate_pickup_shipment(pickup_stops_df)
-    for _, stop in deliver_stop_df.iterrows():
-        if pd.isna(stop["skills"]):
-            skill = None
-        else:
-            skill = set([int(stop["skills"])])
-        pickup_stop = vroom.ShipmentStep(
-            **{**master_pickup_stop, **{"id": 10000 + stop["location_index"]}}
+    skills = parse_unique_values(deliver_stop_df["skills"], parse_stop_skills)
+    shipments = [
+        vroom.job.Shipment(
+            pickup=vroom.ShipmentStep(
+                **{**master_pickup_stop, **{"id": 10000 + location_index}}
+            ),
+            delivery=vroom.ShipmentStep(
+                id=location_index,
+                location=vroom_location,
+                service=service,
+                time_windows=[vroom.time_window.TimeWindow(int(tw_start), int(tw_end))],
+            ),
+            skills=skill,
+            amount=[demand * 1000, 1],
         )
-        deliver_stop = vroom.ShipmentStep(**generate_delivery_shipment(stop))
-        vroom_object.add_job(
-            [
-                vroom.job.Shipment(
-                    pickup=pickup_stop,
-                    delivery=deliver_stop,
-                    skills=skill,
-                    amount=[stop["demand"] * 1000, 1],
-                )
-            ]
+        for (
+            location_index,
+            vroom_location,
+            skill,
+            demand,
+            service,
+            tw_start,
+            tw_end,
+        ) in zip(
+            deliver_stop_df["location_index"].tolist(),
+            deliver_stop_df["vroom_location"].tolist(),
+            skills,
+            deliver_stop_df["demand"].tolist(),
+            deliver_stop_df["service_duration__seconds"].tolist(),
+            deliver_stop_df["time_window_start_seconds"].tolist(),
+            deliver_stop_df["time_window_end_seconds"].tolist(),
         )
+    ]
+    if shipments:
+        vroom_object.add_job(shipments)
     return vroom_object
 
 
@@ -0,0 +1,270 @@
+"""
+Solve the routing problem from several starts at once and keep the best solution.
+
+VROOM's heuristics break ties by the order of the jobs, so solving the same problem
+with the stops shuffled often finds a cheaper plan. Each candidate solves the problem
+in a worker process, with its own exploration level and stop order. The best candidate
+has the fewest unassigned jobs, and the lowest cost among those.
+"""
+import logging
+import time
+import types
+from concurrent.futures import as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+import pandas as pd
+
+from app_vukwm_bag_delivery.models.vroom_wrappers import (
+    bicycle_trips,
+    generate_vroom_object,
+    profile_matrix,
+    solve_vroom_object,
+    solver_policy,
+)
+
+# An exploration level of None uses the level of the solver policy, and a shuffle seed
+# of None keeps the stops in their input order.
+MULTI_START_CANDIDATES = [
+    {"name": "input_order", "exploration_level": None, "shuffle_seed": None},
+    {"name": "shuffle_1", "exploration_level": None, "shuffle_seed": 1},
+    {"name": "shuffle_2", "exploration_level": None, "shuffle_seed": 2},
+    {"name": "shuffle_3", "exploration_level": None, "shuffle_seed": 3},
+    {"name": "shuffle_4", "exploration_level": None, "shuffle_seed": 4},
+    {"name": "shuffle_5", "exploration_level": None, "shuffle_seed": 5},
+    {"name": "shuffle_6", "exploration_level": None, "shuffle_seed": 6},
+    {"name": "shuffle_7", "exploration_level": None, "shuffle_seed": 7},
+]
+
+
+class CandidateSolution:
+    """The routes and summary of a VROOM solution, which can be returned from a worker
+    process, unlike the solution itself. Used by the decoder in place of the solution."""
+
+    def __init__(self, routes: pd.DataFrame, cost: int, unassigned: int):
+        self.routes = routes
+        self.summary = types.SimpleNamespace(cost=cost, unassigned=unassigned)
+
+
+def solve_problem(
+    route_df, stops_df, matrix, context, max_threads=None, exploration_level=None
+) -> CandidateSolution:
+    """Solve the routes and stops with VROOM. With `COMPACT_BICYCLE_TRIPS`, the bicycle
+    route is solved on its own with `bicycle_trips`, and counts its unassigned stops
+    once rather than as a pickup and a delivery."""
+    problem = None
+    if bicycle_trips.COMPACT_BICYCLE_TRIPS:
+        problem = bicycle_trips.split_bicycle_problem(route_df, stops_df)
+    if problem is None:
+        solution = solver_policy.solve(
+            solve_vroom_object.generate_vroom_input(route_df, stops_df, matrix),
+            context,
+            max_threads=max_threads,
+            exploration_level=exploration_level,
+        )
+        return CandidateSolution(
+            generate_vroom_object.restore_location_index(solution.routes, route_df),
+            solution.summary.cost,
+            solution.summary.unassigned,
+        )
+    bicycle_route, bicycle_stops, normal_route_df, normal_stops = problem
+    routes, cost, unassigned = bicycle_trips.solve_bicycle_trips(
+        bicycle_route, bicycle_stops, matrix, max_threads, exploration_level
+    )
+    routes = [routes]
+    if normal_route_df.shape[0] > 0 and normal_stops.shape[0] > 0:
+        solution = solver_policy.solve(
+            solve_vroom_object.generate_vroom_input(
+                normal_route_df, normal_stops, matrix
+            ),
+            context,
+            max_threads=max_threads,
+            exploration_level=exploration_level,
+        )
+        routes.append(
+            generate_vroom_object.restore_location_index(
+                solution.routes, normal_route_df
+            )
+        )
+        cost += solution.summary.cost
+        unassigned += solution.summary.unassigned
+    else:
+        unassigned += normal_stops.shape[0]
+    routes = [frame for frame in routes if frame.shape[0] > 0]
+    if not routes:
+        return CandidateSolution(pd.DataFrame(), cost, unassigned)
+    routes = pd.concat(routes).sort_values("vehicle_id", kind="stable")
+    return CandidateSolution(routes.reset_index(drop=True), cost, unassigned)
+
+
+def local_problem(route_df, stops_df, matrix) -> tuple:
+    """The problem with its locations re-indexed from zero, and the matrices of only its
+    profiles and locations, to send to a worker.
+
+    Returns:
+        the routes, stops and matrices, and the global index of each location, to
+        return the solution to global indices with `global_solution`
+    """
+    locations = np.unique(
+        np.r_[
+            route_df["location_index"].to_numpy(dtype=int),
+            stops_df["location_index"].to_numpy(dtype=int),
+        ]
+    )
+    route_df = route_df.assign(
+        location_index=np.searchsorted(
+            locations, route_df["location_index"].to_numpy(dtype=int)
+        )
+    )
+    stops_df = stops_df.assign(
+        location_index=np.searchsorted(
+            locations, stops_df["location_index"].to_numpy(dtype=int)
+        )
+    )
+    matrix = {
+        profile: profile_matrix.select_locations(matrix[profile], locations)
+        for profile in route_df["profile"].unique()
+    }
+    return route_df, stops_df, matrix, locations
+
+
+def global_routes(routes, locations) -> pd.DataFrame:
+    """Routes of a `local_problem` with their steps at their global location index."""
+    if routes.shape[0] > 0:
+        has_id = routes["id"].notna().to_numpy()
+        ids = routes.loc[has_id, "id"].to_numpy(dtype=int)
+        pickups = ids >= bicycle_trips.PICKUP_ID_OFFSET
+        ids = locations[
+            np.where(pickups, ids - bicycle_trips.PICKUP_ID_OFFSET, ids)
+        ] + np.where(pickups, bicycle_trips.PICKUP_ID_OFFSET, 0)
+        global_ids = routes["id"].copy()
+        global_ids[has_id] = ids
+        routes = routes.assign(
+            location_index=locations[routes["location_index"].to_numpy(dtype=int)],
+            id=global_ids,
+        )
+    return routes
+
+
+def global_solution(solution, locations) -> CandidateSolution:
+    """Solution of a `local_problem` with its steps at their global location index."""
+    return CandidateSolution(
+        global_routes(solution.routes, locations),
+        solution.summary.cost,
+        solution.summary.unassigned,
+    )
+
+
+def select_candidates(total_threads=None) -> list:
+    """One candidate per core, so that starts run side by side rather than in turn."""
+    if total_threads is None:
+        total_threads = solve_vroom_object.SOLVE_MAX_WORKERS
+    return MULTI_START_CANDIDATES[
+        : max(min(len(MULTI_START_CANDIDATES), total_threads), 1)
+    ]
+
+
+def solve_candidate(route_df, stops_df, matrix, candidate, nb_threads):
+    """Solve one start. Only takes plain data so that it can be run in a worker process."""
+    if candidate["shuffle_seed"] is not None:
+        stops_df = stops_df.sample(frac=1, random_state=candidate["shuffle_seed"])
+    start = time.perf_counter()
+    solution = solve_problem(
+        route_df,
+        stops_df,
+        matrix,
+        f"multi_start_{candidate['name']}",
+        max_threads=nb_threads,
+        exploration_level=candidate["exploration_level"],
+    )
+    return solution, time.perf_counter() - start
+
+
+def candidate_statistics(candidates, results) -> pd.DataFrame:
+    statistics = pd.DataFrame(
+        {
+            "candidate": [candidate["name"] for candidate in candidates],
+            "exploration_level": [
+                candidate["exploration_level"] for candidate in candidates
+            ],
+            "shuffle_seed": [candidate["shuffle_seed"] for candidate in candidates],
+            "cost": [solution.summary.cost for solution, _ in results],
+            "unassigned": [solution.summary.unassigned for solution, _ in results],
+            "solve_seconds": [round(seconds, 3) for _, seconds in results],
+        }
+    )
+    best = statistics.sort_values(["unassigned", "cost"], kind="stable").index[0]
+    statistics["best"] = statistics.index == best
+    return statistics
+
+
+def solve_candidates_sequential(
+    route_df, stops_df, matrix, candidates, nb_threads, results, progress
+):
+    for i, candidate in enumerate(candidates):
+        if results[i] is None:
+            results[i] = solve_candidate(
+                route_df, stops_df, matrix, candidate, nb_threads
+            )
+            progress(results)
+
+
+def multi_start_solve(route_df, stops_df, matrix, candidates=None, progress=None):
+    """Solve the problem from each candidate start and return the best solution.
+
+    Args:
+        candidates: starts to solve, by default one per core from `MULTI_START_CANDIDATES`
+        progress: called with the number of solved candidates, the number of
+            candidates and the best solution so far, each time a candidate is solved
+
+    Returns:
+        the best solution and a data-frame with the statistics of each candidate
+    """
+    candidates = select_candidates() if candidates is None else candidates
+    # each start gets its own copy of the matrices, so only the problem's are sent
+    route_df, stops_df, matrix, locations = local_problem(route_df, stops_df, matrix)
+    n_workers, nb_threads = solve_vroom_object.split_threads(len(candidates))
+    logging.info(
+        "Solving %i starts with %i workers and %i threads each",
+        len(candidates),
+        n_workers,
+        nb_threads,
+    )
+    results = [None] * len(candidates)
+
+    def report(results):
+        if progress is not None:
+            solved = [solution for solution, _ in filter(None, results)]
+            best = min(solved, key=lambda x: (x.summary.unassigned, x.summary.cost))
+            progress(len(solved), len(candidates), best)
+
+    if n_workers == 1:
+        solve_candidates_sequential(
+            route_df, stops_df, matrix, candidates, nb_threads, results, report
+        )
+    else:
+        pool = solve_vroom_object.get_pool()
+        try:
+            futures = {
+                pool.submit(
+                    solve_candidate, route_df, stops_df, matrix, candidate, nb_threads
+                ): i
+                for i, candidate in enumerate(candidates)
+            }
+            for future in as_completed(futures):
+                results[futures[future]] = future.result()
+                report(results)
+        except BrokenProcessPool:
+            logging.warning("Route solver pool stopped, solving starts one by one")
+            solve_vroom_object.reset_pool()
+            solve_candidates_sequential(
+                route_df, stops_df, matrix, candidates, nb_threads, results, report
+            )
+    statistics = candidate_statistics(candidates, results)
+    best = statistics.index[statistics["best"]][0]
+    logging.info(
+        f"Best of {len(candidates)} starts is {candidates[best]['name']} with cost "
+        f"{statistics.loc[best, 'cost']} and "
+        f"{statistics.loc[best, 'unassigned']} unassigned"
+    )
+    return global_solution(results[best][0], locations), statistics
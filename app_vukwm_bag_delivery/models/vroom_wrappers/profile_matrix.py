@@ -0,0 +1,96 @@
+"""
+Access to the time and distance matrices of a profile by global `location_index`.
+
+A profile's matrix may have fewer rows than there are locations: co-located locations
+share a matrix node, and the matrix may be restricted to the locations the profile's
+vehicles can visit. Such a matrix has a `location_rows` array, with the row and column
+of each global location index, or -1 for the locations it does not cover. Values
+between locations that are not covered are unknown.
+
+VROOM is given the matrices over the nodes of a problem's locations only, see
+`shared_nodes`, and locates its vehicles and jobs by node.
+"""
+import numpy as np
+
+
+def is_mapped(profile_matrix: dict) -> bool:
+    return "location_rows" in profile_matrix
+
+
+def map_locations(profile_matrix: dict, location_rows) -> dict:
+    """Mark a matrix as covering each global location at its row in `location_rows`."""
+    return {**profile_matrix, "location_rows": np.asarray(location_rows, dtype=int)}
+
+
+def positions(profile_matrix: dict, location_index) -> np.ndarray:
+    """Row of each global location index in the matrix, -1 if it is not covered."""
+    location_index = np.asarray(location_index, dtype=int)
+    if not is_mapped(profile_matrix):
+        return location_index
+    return profile_matrix["location_rows"][location_index]
+
+
+def lookup(profile_matrix: dict, name: str, from_index, to_index) -> np.ndarray:
+    """Matrix `name` values between global locations, NaN if unknown. Indices are
+    broadcast as in NumPy, e.g. `lookup(matrix, name, index[:, None], index[None, :])`
+    for the sub-matrix of `index`."""
+    from_position = positions(profile_matrix, from_index)
+    to_position = positions(profile_matrix, to_index)
+    values = profile_matrix[name][
+        np.maximum(from_position, 0), np.maximum(to_position, 0)
+    ]
+    if not is_mapped(profile_matrix):
+        return values
+    return np.where((from_position < 0) | (to_position < 0), np.nan, values)
+
+
+def shared_nodes(matrix: dict, location_index) -> tuple:
+    """Matrix nodes of the global locations in `location_index`, shared by the profiles
+    of `matrix`, as VROOM locates a job at the same index in each profile's matrix.
+    Locations at the same row of every profile's matrix, such as co-located locations,
+    share a node.
+
+    Returns:
+        the row of each node in each profile's matrix, -1 where the profile does not
+        cover it, as an array of nodes by profiles, and the node of each global location
+        index, -1 for the locations not in `location_index`
+    """
+    location_index = np.unique(np.asarray(location_index, dtype=int))
+    rows = np.stack(
+        [positions(matrix[profile], location_index) for profile in matrix], axis=1
+    )
+    node_rows, nodes = np.unique(rows, axis=0, return_inverse=True)
+    location_nodes = np.full(location_index.max(initial=-1) + 1, -1)
+    location_nodes[location_index] = nodes.ravel()
+    return node_rows, location_nodes
+
+
+def node_matrix(profile_matrix: dict, name: str, node_rows) -> np.ndarray:
+    """Matrix `name` between the nodes at `node_rows` of the profile's matrix.
+
+    VROOM never routes the profile's vehicles to the nodes that are not covered, as
+    they lack the skills. These are set to zero, which unlike a large value leaves
+    VROOM's heuristics, and so its solutions, unchanged."""
+    node_rows = np.asarray(node_rows, dtype=int)
+    rows = np.maximum(node_rows, 0)
+    values = profile_matrix[name][np.ix_(rows, rows)]
+    values[node_rows < 0, :] = 0
+    values[:, node_rows < 0] = 0
+    return values
+
+
+def select_locations(profile_matrix: dict, location_index) -> dict:
+    """Matrix of only the global locations in `location_index`, with location `i` at
+    `location_index[i]`, e.g. to send a sub-problem's matrix, with its locations
+    re-indexed from zero, to a worker process without the rest of the matrix."""
+    rows = positions(profile_matrix, location_index)
+    covered = rows >= 0
+    nodes, node_index = np.unique(rows[covered], return_inverse=True)
+    location_rows = np.full(rows.shape[0], -1)
+    location_rows[covered] = node_index.ravel()
+    selection = np.ix_(nodes, nodes)
+    return {
+        "time_matrix": profile_matrix["time_matrix"][selection],
+        "distance_matrix": profile_matrix["distance_matrix"][selection],
+        "location_rows": location_rows,
+    }
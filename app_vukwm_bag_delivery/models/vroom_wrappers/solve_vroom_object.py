@@ -1,6 +1,178 @@
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
 import streamlit as st
+from vroom.input import input
+
+from app_vukwm_bag_delivery.models.vroom_wrappers import (
+    bicycle_trips,
+    generate_vroom_object,
+    multi_start,
+    solver_policy,
+    warm_start,
+)
+
+SOLVE_THREADS = 4
+SOLVE_MAX_WORKERS = os.cpu_count() or 1
+# Edits with fewer routes or stops than these are solved in-process, as starting the
+# worker pool takes longer than solving them.
+POOL_MIN_ROUTES = 3
+POOL_MIN_STOPS = 60
+
+_POOL_LOCK = threading.Lock()
+_POOL = None
 
 
 def solve(problem_instance):
-    solution = problem_instance.solve(exploration_level=5, nb_threads=4)
-    return solution
+    return solver_policy.solve(problem_instance, "solve")
+
+
+def generate_vroom_input(unassigned_routes, unassigned_stops, matrix):
+    """VROOM input of the routes and stops, with the matrices of their locations only.
+    Locate its solution's steps with `generate_vroom_object.restore_location_index`."""
+    (
+        node_rows,
+        unassigned_routes,
+        unassigned_stops,
+    ) = generate_vroom_object.assign_vroom_locations(
+        matrix, unassigned_routes, unassigned_stops
+    )
+    problem_instance = input.Input()
+    problem_instance = generate_vroom_object.add_matrix_profiles(
+        problem_instance, matrix, node_rows
+    )
+    problem_instance = generate_vroom_object.add_vehicles(
+        problem_instance, unassigned_routes
+    )
+    problem_instance = generate_vroom_object.add_stops(
+        problem_instance, unassigned_stops, unassigned_routes
+    )
+    return problem_instance
+
+
+def solve_route(
+    route_info,
+    stop_info,
+    matrix,
+    previous_sequence=None,
+    use_warm_start=True,
+    nb_threads=SOLVE_THREADS,
+):
+    """Re-optimise a single route from its previous sequence, solving it from scratch
+    with VROOM when the warm-start cannot be used, as trips for a bicycle route.
+    Returns the `solution.routes` frame. The solver settings follow the size of the
+    route, using at most `nb_threads`.
+
+    Only takes plain data so that it can be run in a worker process."""
+    solution_routes = None
+    if use_warm_start and previous_sequence is not None:
+        solution_routes = warm_start.warm_start_route(
+            route_info, stop_info, previous_sequence, matrix
+        )
+    if solution_routes is None and bicycle_trips.COMPACT_BICYCLE_TRIPS:
+        problem = bicycle_trips.split_bicycle_problem(route_info, stop_info)
+        if problem is not None and problem[2].shape[0] == 0:
+            routes, _, _ = bicycle_trips.solve_bicycle_trips(
+                problem[0], problem[1], matrix, max_threads=nb_threads
+            )
+            solution_routes = routes if routes.shape[0] > 0 else None
+    if solution_routes is None:
+        problem_instance = generate_vroom_input(route_info, stop_info, matrix)
+        solution = solver_policy.solve(
+            problem_instance, "solve_route", max_threads=nb_threads
+        )
+        solution_routes = generate_vroom_object.restore_location_index(
+            solution.routes, route_info
+        )
+    return solution_routes
+
+
+def split_threads(n_problems, total_threads=SOLVE_MAX_WORKERS):
+    """Number of workers and solver threads per problem, so that together they use
+    about `total_threads` and a single problem still gets `SOLVE_THREADS`."""
+    n_workers = max(min(n_problems, total_threads), 1)
+    nb_threads = min(max(total_threads // n_workers, 1), SOLVE_THREADS)
+    return n_workers, nb_threads
+
+
+def get_pool():
+    """Process pool kept alive between reruns, so that workers only start once.
+
+    Workers are spawned rather than forked, as the Streamlit server runs threads."""
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is None:
+            _POOL = ProcessPoolExecutor(
+                max_workers=SOLVE_MAX_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _POOL
+
+
+def reset_pool():
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is not None:
+            _POOL.shutdown(wait=False, cancel_futures=True)
+        _POOL = None
+
+
+def solve_routes_sequential(subproblems, matrix, use_warm_start=True):
+    return [
+        solve_route(route_info, stop_info, matrix, previous_sequence, use_warm_start)
+        for route_info, stop_info, previous_sequence in subproblems
+    ]
+
+
+def solve_routes(subproblems, matrix, use_warm_start=True):
+    """Solve independent single route problems concurrently.
+
+    Args:
+        subproblems: list of (route_info, stop_info, previous_sequence)
+        matrix: time and distance matrices per profile, shared by all problems
+
+    Returns:
+        list of `solution.routes` frames, in the order of `subproblems`
+    """
+    n_workers, nb_threads = split_threads(len(subproblems))
+    n_stops = sum(stop_info.shape[0] for _, stop_info, _ in subproblems)
+    if len(subproblems) < POOL_MIN_ROUTES or n_stops < POOL_MIN_STOPS:
+        n_workers = 1
+    logging.info(
+        "Solving %i routes with %i stops, with %i workers and %i threads each",
+        len(subproblems),
+        n_stops,
+        n_workers,
+        nb_threads,
+    )
+    if n_workers == 1:
+        return solve_routes_sequential(subproblems, matrix, use_warm_start)
+    pool = get_pool()
+    try:
+        futures = []
+        for route_info, stop_info, previous_sequence in subproblems:
+            route_info, stop_info, route_matrix, locations = multi_start.local_problem(
+                route_info, stop_info, matrix
+            )
+            future = pool.submit(
+                solve_route,
+                route_info,
+                stop_info,
+                route_matrix,
+                previous_sequence,
+                use_warm_start,
+                nb_threads,
+            )
+            futures.append((future, locations))
+        return [
+            multi_start.global_routes(future.result(), locations)
+            for future, locations in futures
+        ]
+    except BrokenProcessPool:
+        logging.warning("Route solver pool stopped, solving routes one by one")
+        reset_pool()
+        return solve_routes_sequential(subproblems, matrix, use_warm_start)
@@ -0,0 +1,172 @@
+"""
+VROOM solver settings chosen from the size of each instance and the cores of the host.
+
+Small instances, such as the re-optimisation of an edited route, are solved on a single
+thread, as starting threads costs more than it saves. Large daily plans use every core,
+with a wall-clock limit so that the page stays responsive. Each solve is logged with
+its policy and the cost achieved, and can be written to a CSV file for tuning the tiers.
+"""
+import csv
+import datetime
+import inspect
+import logging
+import os
+import threading
+import time
+
+from vroom.solution.solution import Solution
+
+# The first tier with at least as many tasks as the instance is used. Tasks are VROOM
+# jobs, counting the pickup and delivery of a shipment separately.
+SOLVER_POLICY_TIERS = [
+    {
+        "max_tasks": 30,
+        "exploration_level": 5,
+        "max_threads": 1,
+        "timeout_seconds": None,
+    },
+    {
+        "max_tasks": 200,
+        "exploration_level": 5,
+        "max_threads": 4,
+        "timeout_seconds": None,
+    },
+    {
+        "max_tasks": None,
+        "exploration_level": 5,
+        "max_threads": None,
+        "timeout_seconds": 120,
+    },
+]
+# e.g. "data/06_model_output/solver_policy_log.csv", written as one file per process, as
+# solves run in worker processes, with the process id added to the name
+SOLVER_LOG_PATH = None
+SOLVER_LOG_COLUMNS = [
+    "solved_at",
+    "context",
+    "n_tasks",
+    "n_vehicles",
+    "host_threads",
+    "exploration_level",
+    "nb_threads",
+    "timeout_seconds",
+    "solve_seconds",
+    "cost",
+    "unassigned",
+]
+
+_LOG_LOCK = threading.Lock()
+
+
+def host_threads() -> int:
+    return os.cpu_count() or 1
+
+
+def choose_policy(n_tasks: int, n_vehicles: int, max_threads: int = None) -> dict:
+    """Solver settings of the first tier the instance fits in. `max_threads` caps the
+    threads, e.g. when several instances are solved at the same time."""
+    tier = next(
+        tier
+        for tier in SOLVER_POLICY_TIERS
+        if tier["max_tasks"] is None or n_tasks <= tier["max_tasks"]
+    )
+    nb_threads = host_threads()
+    if tier["max_threads"] is not None:
+        nb_threads = min(nb_threads, tier["max_threads"])
+    if max_threads is not None:
+        nb_threads = min(nb_threads, max_threads)
+    return {
+        "n_tasks": n_tasks,
+        "n_vehicles": n_vehicles,
+        "host_threads": host_threads(),
+        "exploration_level": tier["exploration_level"],
+        "nb_threads": max(nb_threads, 1),
+        "timeout_seconds": tier["timeout_seconds"],
+    }
+
+
+def instance_policy(problem_instance, max_threads: int = None) -> dict:
+    return choose_policy(
+        len(problem_instance.jobs), len(problem_instance.vehicles), max_threads
+    )
+
+
+def run_solver(problem_instance, policy: dict):
+    if policy["timeout_seconds"] is None:
+        return problem_instance.solve(
+            exploration_level=policy["exploration_level"],
+            nb_threads=policy["nb_threads"],
+        )
+    if "timeout" in inspect.signature(type(problem_instance).solve).parameters:
+        return problem_instance.solve(
+            exploration_level=policy["exploration_level"],
+            nb_threads=policy["nb_threads"],
+            timeout=datetime.timedelta(seconds=policy["timeout_seconds"]),
+        )
+    # pyvroom 0.0.14 only exposes the time limit, in milliseconds, on the binding
+    if "timeout: Optional[int]" not in (problem_instance._solve.__doc__ or ""):
+        raise RuntimeError(
+            "This pyvroom version has no known time limit, solver tiers with a "
+            "`timeout_seconds` need pyvroom 0.0.14 or a `timeout` on `Input.solve`"
+        )
+    return Solution(
+        problem_instance._solve(
+            exploration_level=policy["exploration_level"],
+            nb_threads=policy["nb_threads"],
+            timeout=int(policy["timeout_seconds"] * 1000),
+        )
+    )
+
+
+def process_log_path(log_path: str) -> str:
+    root, extension = os.path.splitext(log_path)
+    return f"{root}_{os.getpid()}{extension}"
+
+
+def record_solve(policy: dict, solution, solve_seconds: float, context: str):
+    row = {
+        **policy,
+        "solved_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "context": context,
+        "solve_seconds": round(solve_seconds, 3),
+        "cost": solution.summary.cost,
+        "unassigned": solution.summary.unassigned,
+    }
+    logging.info(
+        f"Solved {context} with {policy['n_tasks']} tasks and {policy['n_vehicles']} "
+        f"vehicles at exploration level {policy['exploration_level']} on "
+        f"{policy['nb_threads']} threads in {row['solve_seconds']} s, "
+        f"cost {row['cost']} with {row['unassigned']} unassigned"
+    )
+    if SOLVER_LOG_PATH is None:
+        return
+    log_path = process_log_path(SOLVER_LOG_PATH)
+    try:
+        with _LOG_LOCK:
+            if os.path.dirname(log_path):
+                os.makedirs(os.path.dirname(log_path), exist_ok=True)
+            write_header = not os.path.isfile(log_path)
+            with open(log_path, "a", newline="") as log_file:
+                writer = csv.DictWriter(log_file, fieldnames=SOLVER_LOG_COLUMNS)
+                if write_header:
+                    writer.writeheader()
+                writer.writerow({column: row[column] for column in SOLVER_LOG_COLUMNS})
+    except OSError:
+        logging.warning(f"Could not append to solver log {log_path}")
+
+
+def solve(
+    problem_instance,
+    context: str = "solve",
+    max_threads: int = None,
+    exploration_level: int = None,
+):
+    """Solve the VROOM instance with the policy for its size, and record the result.
+    `exploration_level` overrides the level of the policy."""
+    policy = instance_policy(problem_instance, max_threads)
+    if exploration_level is not None:
+        policy["exploration_level"] = exploration_level
+    start = time.perf_counter()
+    solution = run_solver(problem_instance, policy)
+    record_solve(policy, solution, time.perf_counter() - start, context)
+    return solution
@@ -0,0 +1,292 @@
+"""
+Warm-start re-optimisation of a single vehicle route.
+
+The current stop sequence of the vehicle is used as starting point. Stops that are new to
+the vehicle are inserted at their cheapest position, after which 2-opt and Or-opt moves
+are applied until no move improves the route. The result is returned in the same format
+as VROOM's `solution.routes`, so it can be decoded by `DecodeVroomSolution`.
+
+Routes that the warm-start cannot handle like VROOM would (bicycle replenishment
+shipments, skill mismatches, capacity or time-window violations) return None, in which
+case the caller should solve the route with VROOM.
+"""
+import logging
+from typing import List, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from app_vukwm_bag_delivery.models.vroom_wrappers import (
+    generate_vroom_object,
+    profile_matrix,
+)
+
+WARM_START_MAX_PASSES = 50
+OR_OPT_SEGMENT_LENGTHS = (1, 2, 3)
+WARM_START_PROFILES = ["auto"]
+
+
+class RouteEvaluator:
+    """Evaluate travel duration and time-window lateness of a job sequence.
+
+    Nodes are positions in the evaluator's matrix, with node 0 being the depot.
+    """
+
+    def __init__(
+        self,
+        durations: List[List[float]],
+        time_window_start: List[int],
+        time_window_end: List[int],
+        service: List[float],
+        shift_start: int,
+        shift_end: int,
+    ):
+        self.durations = durations
+        self.time_window_start = time_window_start
+        self.time_window_end = time_window_end
+        self.service = service
+        self.shift_start = shift_start
+        self.shift_end = shift_end
+
+    def evaluate(self, sequence: List[int]) -> Tuple[float, float]:
+        """Return (lateness, travel duration) of the sequence, to be minimised in that order."""
+        durations = self.durations
+        time = self.shift_start
+        previous = 0
+        travel = 0
+        lateness = 0
+        for node in sequence:
+            travel += durations[previous][node]
+            time += durations[previous][node]
+            if time < self.time_window_start[node]:
+                time = self.time_window_start[node]
+            elif time > self.time_window_end[node]:
+                lateness += time - self.time_window_end[node]
+            time += self.service[node]
+            previous = node
+        travel += durations[previous][0]
+        time += durations[previous][0]
+        if time > self.shift_end:
+            lateness += time - self.shift_end
+        return lateness, travel
+
+    def schedule(self, sequence: List[int], start: float) -> pd.DataFrame:
+        """Arrival, waiting and cumulative travel duration per step, VROOM style."""
+        durations = self.durations
+        time = start
+        travel = 0
+        previous = 0
+        steps = [{"node": 0, "arrival": start, "duration": 0, "waiting_time": 0}]
+        for node in sequence + [0]:
+            travel += durations[previous][node]
+            time += durations[previous][node]
+            waiting = max(self.time_window_start[node] - time, 0) if node else 0
+            steps.append(
+                {
+                    "node": node,
+                    "arrival": time,
+                    "duration": travel,
+                    "waiting_time": waiting,
+                }
+            )
+            time += waiting + (self.service[node] if node else 0)
+            previous = node
+        return pd.DataFrame(steps)
+
+    def latest_start(self, sequence: List[int]) -> float:
+        """Delay the start of the route to remove waiting without making any stop late,
+        which is how VROOM schedules the start of a route."""
+        schedule = self.schedule(sequence, self.shift_start)
+        jobs = schedule.iloc[1:-1]
+        waiting_before = jobs["waiting_time"].cumsum() - jobs["waiting_time"]
+        slack = waiting_before + (
+            np.array([self.time_window_end[node] for node in jobs["node"]])
+            - jobs["arrival"]
+        )
+        total_waiting = jobs["waiting_time"].sum()
+        end_slack = total_waiting + self.shift_end - schedule.iloc[-1]["arrival"]
+        delay = min([total_waiting, end_slack] + slack.tolist())
+        return self.shift_start + max(delay, 0)
+
+
+def cheapest_insertion(
+    evaluator: RouteEvaluator, sequence: List[int], nodes: List[int]
+) -> List[int]:
+    """Insert each node at the position with the lowest (lateness, travel) cost."""
+    sequence = list(sequence)
+    for node in nodes:
+        candidates = [
+            sequence[:position] + [node] + sequence[position:]
+            for position in range(len(sequence) + 1)
+        ]
+        sequence = min(candidates, key=evaluator.evaluate)
+    return sequence
+
+
+def two_opt_neighbours(sequence: List[int]):
+    for i in range(len(sequence) - 1):
+        for j in range(i + 1, len(sequence)):
+            yield sequence[:i] + sequence[i : j + 1][::-1] + sequence[j + 1 :]
+
+
+def or_opt_neighbours(sequence: List[int]):
+    for length in OR_OPT_SEGMENT_LENGTHS:
+        for i in range(len(sequence) - length + 1):
+            segment = sequence[i : i + length]
+            rest = sequence[:i] + sequence[i + length :]
+            for position in range(len(rest) + 1):
+                if position != i:
+                    yield rest[:position] + segment + rest[position:]
+
+
+def local_search(
+    evaluator: RouteEvaluator,
+    sequence: List[int],
+    max_passes: int = WARM_START_MAX_PASSES,
+) -> List[int]:
+    """First-improvement 2-opt and Or-opt, stopping as soon as a pass finds no improvement."""
+    best_cost = evaluator.evaluate(sequence)
+    for _ in range(max_passes):
+        improved = False
+        for neighbours in (two_opt_neighbours, or_opt_neighbours):
+            for candidate in neighbours(sequence):
+                cost = evaluator.evaluate(candidate)
+                if cost < best_cost:
+                    sequence, best_cost = candidate, cost
+                    improved = True
+                    break
+        if not improved:
+            break
+    return sequence
+
+
+def check_warm_start_route(route: pd.Series, stops: pd.DataFrame) -> bool:
+    """Check that the route is a plain job route that VROOM would fully assign."""
+    if route["profile"] not in WARM_START_PROFILES:
+        return False
+    vehicle_skills = (
+        generate_vroom_object.parse_vehicle_skills(route["skills"]) or set()
+    )
+    for skills in generate_vroom_object.parse_unique_values(
+        stops["skills"], generate_vroom_object.parse_stop_skills
+    ):
+        if skills and not skills.issubset(vehicle_skills):
+            return False
+    if stops.shape[0] > route["max_stops"]:
+        return False
+    if (stops["demand"] * 1000).round().sum() > int(route["capacity"]) * 1000:
+        return False
+    return True
+
+
+def route_evaluator(
+    route: pd.Series, stops: pd.DataFrame, matrix: dict
+) -> Tuple[RouteEvaluator, np.ndarray]:
+    """Evaluator with the route's depot as node 0 and the stops as nodes 1 to n, and
+    the global location index of each node.
+
+    The route and stops need time windows in seconds, and the stops service durations."""
+    locations = np.array(
+        [int(route["location_index"])] + stops["location_index"].tolist()
+    )
+    time_matrix = profile_matrix.lookup(
+        matrix[route["profile"]],
+        "time_matrix",
+        locations[:, None],
+        locations[None, :],
+    )
+    evaluator = RouteEvaluator(
+        time_matrix.tolist(),
+        [0] + stops["time_window_start_seconds"].tolist(),
+        [0] + stops["time_window_end_seconds"].tolist(),
+        [0] + stops["service_duration__seconds"].tolist(),
+        route["time_window_start_seconds"],
+        route["time_window_end_seconds"],
+    )
+    return evaluator, locations
+
+
+def solution_route(
+    route: pd.Series,
+    evaluator: RouteEvaluator,
+    locations: np.ndarray,
+    sequence: List[int],
+) -> pd.DataFrame:
+    """Job sequence of the route in VROOM `solution.routes` format, starting as late as
+    VROOM would."""
+    schedule = evaluator.schedule(sequence, evaluator.latest_start(sequence))
+    n_steps = schedule.shape[0]
+    step_type = ["start"] + ["job"] * (n_steps - 2) + ["end"]
+    location_index = np.array(locations)[schedule["node"].values]
+    return pd.DataFrame(
+        {
+            "vehicle_id": route["route_index"],
+            "type": step_type,
+            "arrival": schedule["arrival"].round().astype(int),
+            "duration": schedule["duration"].round().astype(int),
+            "setup": 0,
+            "service": [0] + [int(evaluator.service[node]) for node in sequence] + [0],
+            "waiting_time": schedule["waiting_time"].round().astype(int),
+            "location_index": location_index,
+            "id": pd.array(
+                [pd.NA] + location_index[1:-1].tolist() + [pd.NA], dtype="Int64"
+            ),
+            "description": "",
+        }
+    )
+
+
+def warm_start_route(
+    route_df: pd.DataFrame,
+    stops_df: pd.DataFrame,
+    previous_sequence: List[str],
+    matrix: dict,
+    max_passes: int = WARM_START_MAX_PASSES,
+) -> Union[pd.DataFrame, None]:
+    """Re-optimise a single vehicle route starting from its previous stop sequence.
+
+    Args:
+        route_df: single route, as in `unassigned_routes`
+        stops_df: stops now assigned to the route, as in `unassigned_stops`
+        previous_sequence: `stop_id`s in their previous visiting order, stops not in
+            `stops_df` are ignored and stops not in the sequence are inserted.
+        matrix: time and distance matrices per profile
+
+    Returns:
+        solution_routes: route in VROOM `solution.routes` format, or None if the route
+            has to be solved with VROOM.
+    """
+    if route_df.shape[0] != 1 or stops_df.shape[0] == 0:
+        return None
+    route = generate_vroom_object.add_midnight_seconds_time_windows(route_df).iloc[0]
+    if not check_warm_start_route(route, stops_df):
+        return None
+    stops = generate_vroom_object.assign_service_defaults(route_df, stops_df)
+    stops = generate_vroom_object.add_midnight_seconds_time_windows(stops)
+    stops = stops.reset_index(drop=True)
+
+    evaluator, locations = route_evaluator(route, stops, matrix)
+
+    node_ids = dict(zip(stops["stop_id"].astype(str), range(1, stops.shape[0] + 1)))
+    previous_nodes = [
+        node_ids[stop_id]
+        for stop_id in dict.fromkeys(map(str, previous_sequence))
+        if stop_id in node_ids
+    ]
+    new_nodes = [node for node in node_ids.values() if node not in previous_nodes]
+    sequence = cheapest_insertion(evaluator, previous_nodes, new_nodes)
+    sequence = local_search(evaluator, sequence, max_passes)
+
+    lateness, travel = evaluator.evaluate(sequence)
+    if lateness > 0:
+        logging.info("Warm-start route %s is infeasible", route["route_id"])
+        return None
+    logging.info(
+        "Warm-start route %s: %i stops, %i new, travel duration %i",
+        route["route_id"],
+        len(sequence),
+        len(new_nodes),
+        travel,
+    )
+
+    return solution_route(route, evaluator, locations, sequence)
@@ -1,12 +1,12 @@
 import datetime
 
 import numpy as np
-import pandas as pd
 import plotly.express as px
 import streamlit as st
 from st_aggrid import AgGrid, GridOptionsBuilder, GridUpdateMode
 
 import app_vukwm_bag_delivery.models.pipelines.process_input_data.add_time_window_info as add_time_window_info
+import app_vukwm_bag_delivery.time_utils as time_utils
 
 OPEN_DEFAULT = "09:00:00"
 CLOSE_DEFAULT = "16:00:00"
@@ -31,9 +31,10 @@ def add_min_open_time(df):
     df.loc[df["Delivery open time"] < "01:00:00", "Delivery open time"] = "01:00:00"
     df = df.assign(
         **{
-            "Delivery open time": (
-                pd.to_datetime(df["Delivery open time"]) - pd.Timedelta(hours=1)
-            ).dt.strftime("%H:%M:%S")
+            "Delivery open time": time_utils.seconds_to_hms(
+                time_utils.hms_to_seconds(df["Delivery open time"]) - 3600,
+                df.index,
+            )
         }
     )
     df = df.assign(
@@ -0,0 +1,60 @@
+"""
+Conversion between `HH:MM:SS` time of day strings and seconds after midnight.
+
+Times are computed in seconds, and only formatted as strings for displays and
+exports. Both conversions are vectorised.
+"""
+import re
+from typing import Union
+
+import numpy as np
+import pandas as pd
+
+SECONDS_PER_DAY = 24 * 3600
+TIME_OF_DAY_PATTERN = re.compile(r"^\s*(\d{1,2}):(\d{2})(?::(\d{2})(\.\d*)?)?\s*$")
+
+_TWO_DIGITS = np.array([f"{i:02d}" for i in range(100)], dtype=object)
+
+
+def _parse_time_of_day(value) -> float:
+    match = TIME_OF_DAY_PATTERN.match(value) if isinstance(value, str) else None
+    if match is None:
+        # other formats, e.g. full date-times, are parsed as before
+        timestamp = pd.to_datetime(value)
+        if pd.isna(timestamp):
+            return np.nan
+        return (timestamp - timestamp.normalize()) / pd.Timedelta("1 second")
+    hours, minutes, seconds, fraction = match.groups()
+    return (
+        int(hours) * 3600 + int(minutes) * 60 + int(seconds or 0) + float(fraction or 0)
+    )
+
+
+def hms_to_seconds(times: Union[pd.Series, list]) -> np.ndarray:
+    """Seconds after midnight of time of day strings, NaN if missing.
+
+    Each distinct time is only parsed once, as time windows repeat for most stops."""
+    codes, uniques = pd.factorize(pd.Series(times, dtype=object))
+    # missing values have code -1, which indexes the NaN at the end
+    parsed = np.array([_parse_time_of_day(value) for value in uniques] + [np.nan])
+    return parsed[codes]
+
+
+def seconds_to_hms(seconds: Union[pd.Series, np.ndarray], index=None) -> pd.Series:
+    """`HH:MM:SS` strings of seconds after midnight, NaN if missing.
+
+    Seconds are truncated and wrap around at midnight, as with `strftime`."""
+    if index is None and isinstance(seconds, pd.Series):
+        index = seconds.index
+    seconds = np.asarray(seconds, dtype=float)
+    missing = np.isnan(seconds)
+    total = np.where(missing, 0, np.floor(seconds)).astype(np.int64) % SECONDS_PER_DAY
+    hms = (
+        _TWO_DIGITS[total // 3600]
+        + ":"
+        + _TWO_DIGITS[total // 60 % 60]
+        + ":"
+        + _TWO_DIGITS[total % 60]
+    )
+    hms[missing] = np.nan
+    return pd.Series(hms, index=index, dtype=object)
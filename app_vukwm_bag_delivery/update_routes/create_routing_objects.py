@@ -1,33 +1,23 @@
 import pandas as pd
 import streamlit as st
-from vroom.input import input
 
 import app_vukwm_bag_delivery.update_routes.process_assigned_data as process_assigned_data
 from app_vukwm_bag_delivery.models.vroom_wrappers import (
     decode_vroom_solution,
-    generate_vroom_object,
+    solve_vroom_object,
 )
 from app_vukwm_bag_delivery.view_routes.generate_route_display import (
     gen_assigned_stops_display,
 )
 
+USE_WARM_START = True
+
 
 def generate_vroom_input(unassigned_routes, unassigned_stops):
-    problem_instance = input.Input()
     matrix = st.session_state.data_04_model_input["matrix"]
-    problem_instance = generate_vroom_object.add_matrix_profiles(
-        problem_instance,
-        matrix,
-    )
-
-    problem_instance = generate_vroom_object.add_vehicles(
-        problem_instance, unassigned_routes
-    )
-
-    problem_instance = generate_vroom_object.add_stops(
-        problem_instance, unassigned_stops, unassigned_routes
+    return solve_vroom_object.generate_vroom_input(
+        unassigned_routes, unassigned_stops, matrix
     )
-    return problem_instance
 
 
 def drop_non_deliveries(df):
@@ -62,11 +52,11 @@ def filter_stop_info(route_id):
     return unassigned_routes, unassigned_stops
 
 
-def decode_solution(unassigned_routes, unassigned_stops, solution):
+def decode_solution(unassigned_routes, unassigned_stops, solution_routes):
     matrix = st.session_state.data_04_model_input["matrix"]
     locations = st.session_state.data_03_primary["locations"]
     decoder = decode_vroom_solution.DecodeVroomSolution(
-        solution.routes,
+        solution_routes,
         locations,
         unassigned_routes,
         unassigned_stops,
@@ -130,23 +120,51 @@ def find_changed_routes():
     return vehicle_updates
 
 
+def return_previous_sequence(route_id):
+    """Stop sequence of the route before the current edit."""
+    previous_stops = st.session_state.edit_routes["assigned_stops"]
+    previous_stops = previous_stops.loc[
+        previous_stops["Vehicle Id"] == route_id
+    ].sort_values(["Stop sequence"])
+    return previous_stops["Site Bk"].dropna().astype(str).tolist()
+
+
+def solve_changed_routes(vehicle_info):
+    """Solve the changed vehicle routes concurrently, keyed by vehicle id."""
+    subproblems = [
+        (route_info, stop_info, return_previous_sequence(vehicle_id))
+        for vehicle_id, (route_info, stop_info) in vehicle_info.items()
+    ]
+    solution_routes = solve_vroom_object.solve_routes(
+        subproblems,
+        st.session_state.data_04_model_input["matrix"],
+        use_warm_start=USE_WARM_START,
+    )
+    return dict(zip(vehicle_info.keys(), solution_routes))
+
+
 def generate_new_routes(vehicle_updates):
     new_assigned_stops = []
     new_assigned_stops_df = pd.DataFrame()
     if vehicle_updates:
-        for vehicle_id in vehicle_updates:
-            route_info, stop_info = filter_stop_info(vehicle_id)
+        vehicle_info = {
+            vehicle_id: filter_stop_info(vehicle_id) for vehicle_id in vehicle_updates
+        }
+        with st.spinner("Solving"):
+            solution_routes = solve_changed_routes(
+                {
+                    vehicle_id: (route_info, stop_info)
+                    for vehicle_id, (route_info, stop_info) in vehicle_info.items()
+                    if vehicle_id != "Unassigned" and stop_info.shape[0] > 0
+                }
+            )
+        for vehicle_id, (route_info, stop_info) in vehicle_info.items():
             if stop_info.shape[0] > 0:
                 if vehicle_id == "Unassigned":
                     assigned_stops = make_stops_unassigned(vehicle_id)
                 else:
-                    problem_instance = generate_vroom_input(route_info, stop_info)
-                    with st.spinner("Solving"):
-                        solution = problem_instance.solve(
-                            exploration_level=5, nb_threads=4
-                        )
                     (assigned_stops, unserviced_stops) = decode_solution(
-                        route_info, stop_info, solution
+                        route_info, stop_info, solution_routes[vehicle_id]
                     )
                     assigned_stops = return_stops_display(
                         assigned_stops, unserviced_stops, route_info
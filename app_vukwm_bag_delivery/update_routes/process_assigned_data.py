@@ -3,6 +3,7 @@ import pandas as pd
 import streamlit as st
 
 import app_vukwm_bag_delivery.models.vroom_wrappers.decode_vroom_solution as decode
+import app_vukwm_bag_delivery.time_utils as time_utils
 from app_vukwm_bag_delivery.view_routes.generate_route_display import (
     gen_assigned_stops_display,
 )
@@ -227,11 +228,10 @@ def update_assigned_stops():
         )
         .sort_values(["Vehicle Id", "Stop sequence"])
     )
-    time_start = pd.to_datetime(solution["Arrival time"])
     solution = solution.assign(
         **{
-            "arrival_time__seconds": (
-                (time_start - time_start.dt.normalize()) / pd.Timedelta("1 second")
+            "arrival_time__seconds": time_utils.hms_to_seconds(
+                solution["Arrival time"]
             ),
             "service_duration__seconds": solution["Service duration (minutes)"] * 60,
             "waiting_duration__seconds": solution["Waiting time (minutes)"] * 60,
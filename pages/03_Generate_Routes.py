@@ -89,7 +89,7 @@ def routing_steps():
     step_place_holder2.markdown(":white_check_mark: Map data loaded")
     generate_vroom_input()
     step_place_holder3.markdown(":white_check_mark: Routing engine setup completed")
-    solve()
+    solve(step_place_holder4)
     step_place_holder4.markdown(":white_check_mark: Routes generated")
     decode_solution()
     step_place_holder5.markdown(":white_check_mark: Analyses completed")
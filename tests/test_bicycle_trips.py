@@ -0,0 +1,23 @@
+from app_vukwm_bag_delivery.models.vroom_wrappers import (
+    benchmark_bicycle_trips,
+    bicycle_trips,
+)
+
+
+def test_stops_of_no_cluster_get_an_extra_trip():
+    instance = benchmark_bicycle_trips.synthetic_bicycle_instance(12, seed=2)
+    route, stops, _, _ = bicycle_trips.split_bicycle_problem(
+        instance["unassigned_routes"], instance["unassigned_stops"]
+    )
+    stops = stops.loc[stops["time_window_end"] == "17:00:00"]
+    clustered = stops["location_index"].iloc[:-2].tolist()
+    left_out = stops["location_index"].iloc[-2:].tolist()
+    slot_end = route["time_window_end_seconds"]
+
+    trips, unassigned = bicycle_trips.sequence_trips(
+        route, stops, instance["matrix"], [(clustered, slot_end)]
+    )
+
+    served = [index for trip in trips for index in bicycle_trips.served_stops(trip)]
+    assert set(left_out) <= set(served)
+    assert len(served) + unassigned.shape[0] == stops.shape[0]
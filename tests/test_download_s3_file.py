@@ -0,0 +1,118 @@
+import hashlib
+import io
+import json
+import types
+
+import pandas as pd
+import pytest
+
+from app_vukwm_bag_delivery.models.pipelines.process_input_data import (
+    download_s3_file,
+)
+
+
+class StubBucket:
+    """In-memory bucket with the listing and download calls used by the loader."""
+
+    def __init__(self, name):
+        self.name = name
+        self.objects = {}
+        self.downloads = []
+        self.meta = types.SimpleNamespace(
+            client=types.SimpleNamespace(get_paginator=lambda _: self)
+        )
+
+    def put(self, key, body, last_modified):
+        self.objects[key] = {
+            "Key": key,
+            "Body": body,
+            "ETag": '"' + hashlib.md5(body).hexdigest() + '"',
+            "Size": len(body),
+            "LastModified": pd.Timestamp(last_modified, tz="UTC"),
+        }
+
+    def paginate(self, Bucket, Prefix, StartAfter=""):
+        keys = sorted(
+            key for key in self.objects if key.startswith(Prefix) and key > StartAfter
+        )
+        contents = [
+            {name: value for name, value in self.objects[key].items() if name != "Body"}
+            for key in keys
+        ]
+        return [{"Contents": contents}] if contents else [{}]
+
+    def download_file(self, key, local_path):
+        self.downloads.append(key)
+        with open(local_path, mode="wb") as file:
+            file.write(self.objects[key]["Body"])
+
+
+def csv_body(df):
+    return df.to_csv(index=False).encode()
+
+
+@pytest.fixture
+def bucket(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    bucket = StubBucket("routing-inputs")
+    monkeypatch.setattr(
+        download_s3_file, "get_s3_bucket_session", lambda s3_cred, name: bucket
+    )
+    return bucket
+
+
+def test_unchanged_object_is_not_downloaded_again(bucket):
+    bucket.put("time_windows/a.csv", csv_body(pd.DataFrame({"x": [1]})), "2023-01-02")
+
+    for _ in range(2):
+        df = download_s3_file.return_latest_file(
+            bucket.name, {}, "time_windows/", pd.read_csv, cache_input=True
+        )
+
+    assert bucket.downloads == ["time_windows/a.csv"]
+    assert df["x"].tolist() == [1]
+
+
+def test_reuploaded_object_is_downloaded_again(bucket):
+    bucket.put("time_windows/a.csv", csv_body(pd.DataFrame({"x": [1]})), "2023-01-02")
+    download_s3_file.return_latest_file(
+        bucket.name, {}, "time_windows/", pd.read_csv, cache_input=True
+    )
+    bucket.put("time_windows/a.csv", csv_body(pd.DataFrame({"x": [2]})), "2023-01-03")
+
+    df = download_s3_file.return_latest_file(
+        bucket.name, {}, "time_windows/", pd.read_csv, cache_input=True
+    )
+
+    assert bucket.downloads == ["time_windows/a.csv", "time_windows/a.csv"]
+    assert df["x"].tolist() == [2]
+
+
+def test_latest_file_of_each_prefix_is_returned(bucket):
+    excel = io.BytesIO()
+    pd.DataFrame({"order": ["o1"]}).to_excel(excel, index=False)
+    bucket.put("excel/orders.xlsx", excel.getvalue(), "2023-01-02")
+    bucket.put("geocoded/old.csv", csv_body(pd.DataFrame({"y": [0]})), "2023-01-01")
+    bucket.put("geocoded/new.csv", csv_body(pd.DataFrame({"y": [1]})), "2023-01-02")
+    bucket.put(
+        "unassigned/stops.json", json.dumps({"stops": [1]}).encode(), "2023-01-02"
+    )
+    bucket.put("time_windows/tw.csv", csv_body(pd.DataFrame({"tw": [2]})), "2023-01-02")
+    bucket.put("bag_weights/w.csv", csv_body(pd.DataFrame({"kg": [3]})), "2023-01-02")
+
+    files = download_s3_file.return_routing_files(
+        bucket.name,
+        {},
+        "excel/",
+        "geocoded/",
+        "unassigned/",
+        "time_windows/",
+        "bag_weights/",
+    )
+
+    excel_df, geo_df, unassigned_stops, time_windows, bag_weights = files
+    assert excel_df["order"].tolist() == ["o1"]
+    assert geo_df["y"].tolist() == [1]
+    assert unassigned_stops == {"stops": [1]}
+    assert time_windows["tw"].tolist() == [2]
+    assert bag_weights["kg"].tolist() == [3]
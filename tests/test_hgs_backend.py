@@ -0,0 +1,28 @@
+from app_vukwm_bag_delivery.models.solver_backends import (
+    benchmark_backends,
+    hgs_backend,
+)
+
+
+def test_stop_above_smallest_capacity_is_not_lost():
+    instance = benchmark_backends.synthetic_instance(30, 2, seed=1)
+    routes = instance["unassigned_routes"]
+    stops = instance["unassigned_stops"]
+    routes.loc[routes.index[0], "capacity"] = 50
+    stops.loc[stops.index[0], "demand"] = 80
+
+    solution = hgs_backend.solve_hgs(
+        instance["locations"], stops, routes, instance["matrix"], time_limit=1
+    )
+
+    served = solution.routes.loc[solution.routes["type"] == "job", "id"]
+    assert served.shape[0] > 0
+    assert served.shape[0] + solution.summary.unassigned == stops.shape[0]
+    # only the larger van can carry the stop
+    large_van = routes.loc[routes.index[1], "route_index"]
+    oversized = stops.loc[stops.index[0], "location_index"]
+    assert oversized in served.tolist()
+    assert (
+        solution.routes.loc[solution.routes["id"] == oversized, "vehicle_id"]
+        == large_van
+    ).all()